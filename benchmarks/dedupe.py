@@ -0,0 +1,84 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import dedupe
+
+# Times duplicate-patient detection over synthetic patients with known
+# duplicates mixed in: misspelt or reordered names, reformatted phone
+# numbers and ages a year out. Reports how many of them were found.
+# Run with: python benchmarks/dedupe.py [--patients 1000000] [--duplicates 0.05] [--workers N]
+
+SYLLABLES = ["ka", "ma", "ri", "jo", "an", "ne", "so", "li", "ta", "wa", "ni", "ru", "be", "mo", "chi",
+             "ke", "du", "la", "ven", "son", "ber", "ton", "el", "ish", "mar", "ok", "en", "ge", "ha", "po"]
+
+
+def make_words(rng, count, syllables):
+    parts = np.array(SYLLABLES)[rng.integers(0, len(SYLLABLES), (count, syllables))]
+    return np.unique(["".join(word).capitalize() for word in parts])
+
+
+def make_patients(count, duplicate_share):
+    rng = np.random.default_rng(42)
+    firsts, lasts = make_words(rng, 400, 2), make_words(rng, 20000, 3)
+    originals = count - int(count * duplicate_share)
+    patients = pd.DataFrame({
+        "id": np.arange(1, originals + 1),
+        "name": np.char.add(np.char.add(firsts[rng.integers(0, len(firsts), originals)], " "),
+                            lasts[rng.integers(0, len(lasts), originals)]),
+        "age": rng.integers(0, 95, originals),
+        "gender": np.array(["Male", "Female"])[rng.integers(0, 2, originals)],
+        "contact": np.char.add("07", rng.integers(10000000, 99999999, originals).astype(str))
+    })
+
+    # Duplicates of random patients, each changed in one or two ways
+    source = rng.choice(originals, count - originals, replace=False)
+    copies = patients.iloc[source].copy()
+    copies["id"] = np.arange(originals + 1, count + 1)
+    names = copies["name"].tolist()
+    for i, change in enumerate(rng.integers(0, 4, len(names))):
+        first, last = names[i].split(" ")
+        position = int(rng.integers(1, len(last)))
+        if change == 0:
+            last = last[:position] + last[position + 1:]
+        elif change == 1:
+            last = last[:position - 1] + last[position] + last[position - 1] + last[position + 1:]
+        elif change == 2:
+            first, last = last, first
+        names[i] = f"{first} {last}"
+    copies["name"] = names
+    reformat = rng.random(len(copies)) < 0.5
+    copies.loc[reformat, "contact"] = "+254 " + copies.loc[reformat, "contact"].str[1:]
+    older = rng.random(len(copies)) < 0.3
+    copies.loc[older, "age"] += 1
+    dropped = rng.random(len(copies)) < 0.2
+    copies.loc[dropped, "contact"] = None
+    expected = set(zip(patients["id"].to_numpy()[source], copies["id"]))
+    return pd.concat([patients, copies], ignore_index=True), expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time duplicate-patient detection")
+    parser.add_argument("--patients", type=int, default=1000000)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="Share of patients that are duplicates")
+    parser.add_argument("--workers", type=int, default=dedupe.WORKERS)
+    args = parser.parse_args()
+
+    patients, expected = make_patients(args.patients, args.duplicates)
+    print(f"{len(patients)} patients, {len(expected)} of them duplicates, {args.workers} workers")
+    start = time.perf_counter()
+    pairs = dedupe.find_duplicates(patients, args.workers)
+    elapsed = time.perf_counter() - start
+    found = set(zip(pairs["patient_id"], pairs["duplicate_id"]))
+    print(f"{len(pairs)} candidate pairs in {elapsed:.1f}s")
+    print(f"found {len(found & expected)} of {len(expected)} duplicates ({len(found & expected) / len(expected):.1%}), "
+          f"{len(found - expected)} other pairs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import sys
+import time
+from datetime import date
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import forecast
+
+# Times the nightly stock forecast over synthetic daily usage, against a
+# per-item loop computing the same numbers for a sample of items.
+# Run with: python benchmarks/forecast.py [--items 50000] [--days 730] [--density 0.3]
+
+
+def make_data(items, days, density, as_of):
+    rng = np.random.default_rng(42)
+    inventory = pd.DataFrame({
+        "id": np.arange(1, items + 1),
+        "quantity": rng.integers(0, 2000, items)
+    })
+    # Each item dispenses on about density of the days, around its own rate
+    rates = rng.gamma(2.0, 5.0, items)
+    item_index, day_index = np.nonzero(rng.random((items, days), dtype=np.float32) < density)
+    usage = pd.DataFrame({
+        "item_id": item_index + 1,
+        "day": np.datetime64(as_of, "D") - day_index.astype("timedelta64[D]"),
+        "quantity": rng.poisson(rates[item_index]) + 1
+    })
+    return inventory, usage
+
+
+def per_item(inventory, usage, as_of, days):
+    # The same forecast one item at a time, for comparison
+    decay = 0.5 ** (1 / forecast.HALF_LIFE_DAYS)
+    total_weight = (1 - decay ** days) / (1 - decay)
+    rows = []
+    by_item = dict(tuple(usage.groupby("item_id")))
+    for item in inventory.itertuples():
+        history = by_item.get(item.id)
+        mean = second = 0.0
+        if history is not None:
+            for day, used in zip(history["day"], history["quantity"]):
+                weight = decay ** (np.datetime64(as_of, "D") - np.datetime64(day, "D")).astype(int) / total_weight
+                mean += weight * used
+                second += weight * used * used
+        rows.append((item.id, mean, max(second - mean * mean, 0) ** 0.5))
+    return pd.DataFrame(rows, columns=["id", "daily_usage", "usage_std"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the vectorized stock forecast")
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--density", type=float, default=0.3, help="Share of days each item is dispensed")
+    parser.add_argument("--sample", type=int, default=500, help="Items timed in the per-item loop")
+    args = parser.parse_args()
+
+    as_of = date.today()
+    inventory, usage = make_data(args.items, args.days, args.density, as_of)
+    print(f"{args.items} items, {args.days} days, {len(usage):,} item-days of usage")
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        result = forecast.forecast(inventory, usage, as_of, history_days=args.days)
+        timings.append(time.perf_counter() - start)
+    print(f"vectorized: {min(timings):.2f}s for all items, {int((result['suggested_order'] > 0).sum())} to reorder")
+
+    sample = inventory.head(args.sample)
+    sample_usage = usage[usage["item_id"].isin(sample["id"])]
+    start = time.perf_counter()
+    looped = per_item(sample, sample_usage, as_of, args.days)
+    elapsed = time.perf_counter() - start
+    print(f"per item:   {elapsed:.2f}s for {len(sample)} items, about {elapsed * args.items / len(sample):.0f}s for all")
+
+    expected = result.set_index("id").loc[looped["id"], ["daily_usage", "usage_std"]].to_numpy()
+    assert np.allclose(expected, looped[["daily_usage", "usage_std"]].to_numpy(), atol=1e-3), "results differ"
+
+
+if __name__ == "__main__":
+    main()
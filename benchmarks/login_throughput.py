@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import passwords
+
+# Simulates a shift change: many sessions verifying passwords at once.
+# "inline" checks bcrypt on each session's own thread, as login used to;
+# "pool" goes through utils.passwords and its bounded worker pool.
+# Run with: python benchmarks/login_throughput.py [--sessions 200] [--rounds 12]
+
+
+def run(verify, sessions):
+    latencies = []
+    rejected = 0
+    lock = threading.Lock()
+    start_gate = threading.Event()
+
+    def login():
+        nonlocal rejected
+        start_gate.wait()
+        started = time.perf_counter()
+        try:
+            verify()
+        except passwords.PasswordServiceBusy:
+            with lock:
+                rejected += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=login) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start_gate.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return latencies, rejected, elapsed
+
+
+def report(name, sessions, latencies, rejected, elapsed):
+    if latencies:
+        latencies.sort()
+        p50 = statistics.median(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    else:
+        p50 = p95 = 0.0
+    print(f"{name:>8} {sessions:>9} {len(latencies) / elapsed:>11.1f} {p50:>9.3f} {p95:>9.3f} {rejected:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent login throughput")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--rounds", type=int, default=passwords.BCRYPT_ROUNDS)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(args.rounds)).decode("utf-8")
+    print(f"bcrypt cost {args.rounds}, {passwords.WORKERS} workers, {passwords.MAX_PENDING} pending hashes allowed")
+    print(f"{'mode':>8} {'sessions':>9} {'logins/s':>11} {'p50 (s)':>9} {'p95 (s)':>9} {'rejected':>9}")
+    for sessions in args.sessions:
+        inline = lambda: bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+        report("inline", sessions, *run(inline, sessions))
+        pool = lambda: passwords.verify_password(password, hashed)
+        report("pool", sessions, *run(pool, sessions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import search
+
+# Times patient searches on the full-text index over synthetic patients,
+# against the substring scan the patient lists used before.
+# Run with: python benchmarks/patient_search.py [--patients 500000]
+
+FIRST = ["james", "mary", "john", "patricia", "robert", "jennifer", "michael", "linda", "david", "elizabeth",
+         "wanjiru", "otieno", "achieng", "kamau", "njeri", "mwangi", "aisha", "fatuma", "hassan", "amina"]
+LAST = ["smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis", "wilson", "anderson",
+        "ochieng", "kariuki", "mutua", "odhiambo", "wambui", "kiprop", "chebet", "omondi", "njoroge", "kimani"]
+STREETS = ["elm street", "oak avenue", "moi avenue", "ngong road", "kenyatta avenue", "park lane", "river road"]
+CONDITIONS = ["asthma", "diabetes", "hypertension", "migraine", "arthritis", "penicillin allergy", "anemia",
+              "malaria", "tuberculosis", "eczema", "gout", "epilepsy", "", ""]
+
+QUERIES = {
+    "exact name": "kimani",
+    "two words": "mary ochieng",
+    "prefix": "wamb",
+    "phone fragment": "4455",
+    "typo": "hypertensoin",
+    "name and condition": "otieno asthma"
+}
+
+
+def make_patients(count):
+    rng = np.random.default_rng(42)
+    # Surnames get a numeric suffix so the vocabulary grows with the table, as real names do
+    surnames = np.char.add(np.array(LAST)[rng.integers(0, len(LAST), count)],
+                           rng.integers(0, count // 20 + 1, count).astype(str))
+    return pd.DataFrame({
+        "id": np.arange(1, count + 1),
+        "name": np.char.add(np.char.add(np.array(FIRST)[rng.integers(0, len(FIRST), count)], " "), surnames),
+        "contact": np.char.add("07", rng.integers(10000000, 99999999, count).astype(str)),
+        "address": np.char.add(rng.integers(1, 500, count).astype(str),
+                               np.char.add(" ", np.array(STREETS)[rng.integers(0, len(STREETS), count)])),
+        "medical_history": np.array(CONDITIONS)[rng.integers(0, len(CONDITIONS), count)]
+    })
+
+
+def scan(df, text):
+    # The old search: a case-insensitive substring match on any field
+    mask = np.zeros(len(df), dtype=bool)
+    for field in search.FIELDS:
+        mask |= df[field].str.contains(text, case=False, regex=False).to_numpy()
+    return df["id"].to_numpy()[mask]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time full-text patient search")
+    parser.add_argument("--patients", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    df = make_patients(args.patients)
+    start = time.perf_counter()
+    index = search.SearchIndex.build(df, search.FIELDS, None)
+    print(f"{args.patients} patients, {len(index.terms):,} terms, built in {time.perf_counter() - start:.1f}s")
+
+    # Writes since the build sit in the pending layer, which every query also reads
+    rng = np.random.default_rng(7)
+    for doc_id in rng.integers(1, args.patients + 1, search.MAX_PENDING):
+        record = df.iloc[doc_id - 1].to_dict()
+        index.apply(doc_id, search.document_terms(dict(record, medical_history="asthma follow up"), search.FIELDS))
+    print(f"{index.pending_count()} patients changed since the build")
+
+    for label, text in QUERIES.items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            ids, _ = index.search(text)
+            timings.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        scanned = scan(df, text)
+        scan_time = time.perf_counter() - started
+        print(f"{label:20} {text!r:16} {len(ids):7} matches  "
+              f"median {np.median(timings) * 1000:6.1f}ms  max {max(timings) * 1000:6.1f}ms  "
+              f"(substring scan {scan_time * 1000:.0f}ms, {len(scanned)} matches)")
+
+
+if __name__ == "__main__":
+    main()
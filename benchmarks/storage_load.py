@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import BACKENDS, get_backend
+
+# Compares full and projected billing loads across storage backends.
+# Run with: python benchmarks/storage_load.py [rows ...]
+
+def make_billing(rows):
+    rng = np.random.default_rng(42)
+    dates = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, rows), unit="D")
+    return pd.DataFrame({
+        "id": np.arange(1, rows + 1),
+        "patient_id": rng.integers(1, max(rows // 10, 2), rows),
+        "amount": rng.uniform(10, 5000, rows).round(2),
+        "date": dates.strftime("%Y-%m-%d"),
+        "status": rng.choice(["Pending", "Paid", "Overdue"], rows)
+    })
+
+
+def best_of(fn, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'rows':>10} {'backend':>8} {'full (s)':>10} {'date+amount (s)':>16} {'size (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            df = make_billing(rows)
+            for name in BACKENDS:
+                backend = get_backend(name)
+                path = backend.path(tmp, f"billing_{rows}")
+                backend.write(path, df)
+                full = best_of(lambda: backend.read(path))
+                projected = best_of(lambda: backend.read(path, ["date", "amount"]))
+                size = os.path.getsize(path) / 1024 / 1024
+                print(f"{rows:>10} {name:>8} {full:>10.4f} {projected:>16.4f} {size:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
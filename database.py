@@ -1,14 +1,67 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import create_engine, event, inspect, select, insert, func, text, Column, Integer, String, Date, DateTime, ForeignKey, Float, Boolean, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import visitors
+import logging
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
 # Get database URL from environment variable
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Connection pool settings; every Streamlit session in the process shares this pool
+def pool_options(url):
+    options = {
+        "pool_pre_ping": os.getenv("HMS_DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.getenv("HMS_DB_POOL_RECYCLE", "1800"))
+    }
+    # SQLite's default pools don't take a size
+    if make_url(url).get_backend_name() != "sqlite":
+        options["pool_size"] = int(os.getenv("HMS_DB_POOL_SIZE", "10"))
+        options["max_overflow"] = int(os.getenv("HMS_DB_MAX_OVERFLOW", "20"))
+        options["pool_timeout"] = int(os.getenv("HMS_DB_POOL_TIMEOUT", "30"))
+    return options
+
 # Create database engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+
+logger = logging.getLogger(__name__)
+
+# Statement timing: totals for query_stats() and a logged warning for slow statements
+SLOW_QUERY_MS = float(os.getenv("HMS_DB_SLOW_QUERY_MS", "200"))
+_query_stats = {"statements": 0, "seconds": 0.0, "slow": 0}
+_query_stats_lock = threading.Lock()
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    with _query_stats_lock:
+        _query_stats["statements"] += 1
+        _query_stats["seconds"] += elapsed
+        _query_stats["slow"] += slow
+    if slow:
+        logger.warning("Slow query (%.0f ms): %s", elapsed * 1000, " ".join(statement.split())[:500])
+
+@event.listens_for(engine, "handle_error")
+def _drop_timer(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+def query_stats():
+    with _query_stats_lock:
+        stats = dict(_query_stats)
+    stats["pool"] = engine.pool.status()
+    return stats
 
 # Create declarative base
 Base = declarative_base()
@@ -23,6 +76,7 @@ class User(Base):
     role = Column(String, nullable=False)  # 'admin' or staff role
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime)
+    audit_logs = relationship("AuditLog", back_populates="user")
 
 class Patient(Base):
     __tablename__ = 'patients'
@@ -33,9 +87,18 @@ class Patient(Base):
     contact_number = Column(String)
     address = Column(String)
     medical_history = Column(String)
+    age = Column(Integer)
+    gender = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Row version for optimistic concurrency; a stale UPDATE or DELETE raises StaleDataError
+    version = Column(Integer, nullable=False, server_default="1")
     appointments = relationship("Appointment", back_populates="patient")
 
+    __table_args__ = (
+        Index('ix_patients_name', 'name'),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
 class Appointment(Base):
     __tablename__ = 'appointments'
     
@@ -45,9 +108,32 @@ class Appointment(Base):
     appointment_date = Column(DateTime, nullable=False)
     status = Column(String)  # 'scheduled', 'completed', 'cancelled'
     notes = Column(String)
+    doctor = Column(String)  # Doctor's name, for appointments booked against staff records
+    duration = Column(Integer, nullable=False, server_default="30")  # minutes
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default="1")
     patient = relationship("Patient", back_populates="appointments")
 
+    __table_args__ = (
+        Index('ix_appointments_appointment_date', 'appointment_date'),
+        Index('ix_appointments_patient_id', 'patient_id'),
+        Index('ix_appointments_doctor_id_date', 'doctor_id', 'appointment_date'),
+        Index('ix_appointments_doctor_date', 'doctor', 'appointment_date'),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def ends_at(self):
+        return self.appointment_date + timedelta(minutes=self.duration or 30)
+
+# Every ORM insert or update is checked against the doctor's schedule, see
+# utils/scheduling.py. Bulk inserts skip mapper events and aren't checked.
+@event.listens_for(Appointment, "before_insert")
+@event.listens_for(Appointment, "before_update")
+def check_schedule(mapper, connection, target):
+    from utils.scheduling import check_appointment
+    check_appointment(target)
+
 class Inventory(Base):
     __tablename__ = 'inventory'
     
@@ -56,9 +142,118 @@ class Inventory(Base):
     quantity = Column(Integer, default=0)
     unit = Column(String)
     unit_price = Column(Float)
-    reorder_level = Column(Integer)
+    reorder_level = Column(Integer, default=10)
+    category = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_updated = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_inventory_quantity', 'quantity'),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+# Low stock is queried as (quantity - reorder_level) <= 0 so it can use this
+# expression index; quantity <= reorder_level compares two columns and can't
+Index('ix_inventory_stock_margin', Inventory.quantity - Inventory.reorder_level)
+
+# Append-only stock ledger behind utils/stock.py. Movements keep the ids of
+# items that are later deleted, so item_id isn't a foreign key.
+class StockMovement(Base):
+    __tablename__ = 'stock_movements'
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # 'receipt', 'dispense', 'adjustment'
+    quantity = Column(Integer, nullable=False)  # signed change in stock
+    reason = Column(String)
+    username = Column(String)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_stock_movements_item_id_id', 'item_id', 'id'),
+    )
+
+class StockSnapshot(Base):
+    __tablename__ = 'stock_snapshots'
+
+    id = Column(Integer, primary_key=True)
+    through_movement = Column(Integer, nullable=False)  # last movement included in the levels
+    item_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_stock_snapshots_through_movement', 'through_movement'),
+    )
+
+# Written in full by each run of utils/forecast.py; id is the item's id
+class StockForecast(Base):
+    __tablename__ = 'stock_forecasts'
+
+    id = Column(Integer, primary_key=True)
+    daily_usage = Column(Float)
+    usage_std = Column(Float)
+    days_of_supply = Column(Float)
+    safety_stock = Column(Integer)
+    reorder_point = Column(Integer)
+    suggested_order = Column(Integer)
+    computed_at = Column(DateTime)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_stock_forecasts_suggested_order', 'suggested_order'),
+    )
+
+# Written in full by each run of utils/dedupe.py; merging a pair deletes the duplicate's rows
+class PatientDuplicate(Base):
+    __tablename__ = 'patient_duplicates'
+
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, nullable=False)
+    duplicate_id = Column(Integer, nullable=False)
+    score = Column(Float)
+    name_similarity = Column(Float)
+    same_contact = Column(Boolean)
+    found_at = Column(DateTime)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_patient_duplicates_score', 'score'),
+    )
+
+class StaffMember(Base):
+    __tablename__ = 'staff'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    role = Column(String)
+    contact = Column(String)
+    schedule = Column(String)
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_staff_role', 'role'),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+class Bill(Base):
+    __tablename__ = 'billing'
+
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey('patients.id'))
+    amount = Column(Float)
+    date = Column(Date)
+    status = Column(String)  # 'Pending', 'Paid', 'Overdue'
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = (
+        Index('ix_billing_patient_id', 'patient_id'),
+        Index('ix_billing_status_date', 'status', 'date'),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
 class AuditLog(Base):
     __tablename__ = 'audit_logs'
@@ -68,13 +263,96 @@ class AuditLog(Base):
     action = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     details = Column(String)
+    user = relationship("User", back_populates="audit_logs")
+
+    # The audit viewer pages newest-first on (timestamp, id), optionally
+    # narrowed to one user or one action
+    __table_args__ = (
+        Index('ix_audit_logs_timestamp_id', 'timestamp', 'id'),
+        Index('ix_audit_logs_user_timestamp_id', 'user_id', 'timestamp', 'id'),
+        Index('ix_audit_logs_action_timestamp_id', 'action', 'timestamp', 'id'),
+    )
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# Migrations bring existing databases up to the models; create_all only
+# creates missing tables and never alters ones that already exist.
+def create_missing_indexes(connection):
+    existing = _existing_columns(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            # Indexes on columns a later migration adds are created by that migration
+            columns = {element.name for expression in index.expressions
+                       for element in visitors.iterate(expression) if isinstance(element, Column)}
+            if columns <= existing.get(table.name, set()):
+                # IF NOT EXISTS rather than checkfirst, which can't see expression indexes on SQLite
+                connection.execute(CreateIndex(index, if_not_exists=True))
 
-# Create all tables
-Base.metadata.create_all(engine)
+def add_missing_columns(connection):
+    existing = _existing_columns(connection)
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if table.name not in existing or column.name in existing[table.name]:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.execute(text(ddl))
+
+def _existing_columns(connection):
+    inspector = inspect(connection)
+    return {name: {column["name"] for column in inspector.get_columns(name)} for name in inspector.get_table_names()}
+
+def add_columns_and_indexes(connection):
+    add_missing_columns(connection)
+    create_missing_indexes(connection)
+
+def default_reorder_levels(connection):
+    # Items without a reorder level get the old fixed low-stock threshold
+    add_columns_and_indexes(connection)
+    connection.execute(text("UPDATE inventory SET reorder_level = 10 WHERE reorder_level IS NULL"))
+
+# (version, description, apply(connection)); append new entries, never edit applied ones
+MIGRATIONS = [
+    (1, "Add audit log, appointment and low-stock indexes", create_missing_indexes),
+    (2, "Add the columns and indexes behind the shared repositories", add_columns_and_indexes),
+    (3, "Add appointment durations and the per-doctor schedule index", add_columns_and_indexes),
+    (4, "Add the stock ledger and default inventory reorder levels", default_reorder_levels),
+]
+
+def migrate(bind=None):
+    # Creates missing tables, then applies pending migrations. Run by main.py once
+    # per process and by "python -m utils.db_schema migrate", not on import.
+    applied = []
+    with (bind or engine).begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Serialize app processes that start at the same time
+            connection.execute(text("SELECT pg_advisory_xact_lock(4471001)"))
+        Base.metadata.create_all(connection)
+        current = connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+        for version, description, apply in MIGRATIONS:
+            if version > current:
+                apply(connection)
+                connection.execute(insert(SchemaVersion).values(
+                    version=version, description=description, applied_at=datetime.utcnow()))
+                applied.append(version)
+    return applied
 
 # Create session factory
 SessionLocal = sessionmaker(bind=engine)
 
+# One session per thread. Streamlit runs each script run on its own thread,
+# so concurrent users never share a session; main.py calls db_session.remove()
+# when each run finishes to hand the connection back to the pool.
+db_session = scoped_session(SessionLocal)
+
 # Database dependency
 def get_db():
     db = SessionLocal()
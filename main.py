@@ -1,13 +1,21 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-import bcrypt
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
-from database import get_db, User, AuditLog, Patient, Appointment, Inventory
+from database import db_session, migrate, User, AuditLog
+from utils import metrics, passwords
+from utils.audit import audit
+from utils.rate_limit import RateLimited, failed_logins_by_user, logins_by_client
 
-# Initialize database session
-db = next(get_db())
+# Session for the current script run, see database.db_session
+db = db_session
+
+@st.cache_resource
+def migrate_database():
+    # Once per server process, before any page touches the database
+    return migrate()
 
 # Initialize session state
 def initialize_session():
@@ -24,10 +32,10 @@ def initialize_session():
 
 # Authentication functions
 def save_user_credentials(username, password, role='staff'):
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed = passwords.hash_password(password)
     new_user = User(
         username=username,
-        password=hashed.decode('utf-8'),
+        password=hashed,
         role=role
     )
     db.add(new_user)
@@ -35,26 +43,43 @@ def save_user_credentials(username, password, role='staff'):
     db.refresh(new_user)
     return new_user
 
+def client_address():
+    # Behind a reverse proxy every session shares the proxy's address
+    if os.getenv("HMS_TRUST_FORWARDED_FOR") == "1":
+        forwarded = st.context.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return getattr(st.context, "ip_address", None) or "unknown"
+
 def verify_credentials(username, password):
-    user = db.query(User).filter(User.username == username).first()
-    if user:
-        try:
-            if bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
-                user.last_login = datetime.utcnow()
-                db.commit()
-                return True, user.role == 'admin', user.id
-        except Exception as e:
-            st.error(f"Error verifying credentials: {str(e)}")
-    return False, False, None
+    # Raises RateLimited or PasswordServiceBusy when the login has to wait
+    client = client_address()
+    logins_by_client.check(client)
+    failed_logins_by_user.check(username)
+    logins_by_client.hit(client)
 
-def log_activity(action, details=None):
-    new_log = AuditLog(
-        user_id=st.session_state.user_id,
-        action=action,
-        details=details
-    )
-    db.add(new_log)
+    user = db.query(User.id, User.password, User.role).filter(User.username == username).first()
+    # End the read before hashing so the pooled connection isn't held for it
+    db.commit()
+    try:
+        valid, new_hash = passwords.verify_password(password, user.password if user else None)
+    except ValueError as e:
+        st.error(f"Error verifying credentials: {str(e)}")
+        valid, new_hash = False, None
+    if not valid:
+        failed_logins_by_user.hit(username)
+        return False, False, None
+
+    failed_logins_by_user.reset(username)
+    values = {"last_login": datetime.utcnow()}
+    if new_hash:
+        values["password"] = new_hash
+    db.query(User).filter(User.id == user.id).update(values)
     db.commit()
+    return True, user.role == 'admin', user.id
+
+def log_activity(action, details=None):
+    audit.log_event(st.session_state.user_id, action, details)
 
 def login_page():
     st.title("🏥 Hospital Management System")
@@ -90,16 +115,20 @@ def login_page():
                 username = st.text_input("Username")
                 password = st.text_input("Password", type="password")
                 if st.form_submit_button("Login"):
-                    authenticated, is_admin, user_id = verify_credentials(username, password)
-                    if authenticated:
-                        st.session_state.logged_in = True
-                        st.session_state.username = username
-                        st.session_state.is_admin = is_admin
-                        st.session_state.user_id = user_id
-                        log_activity("Logged in", f"User logged in as {username}")
-                        st.rerun()
+                    try:
+                        authenticated, is_admin, user_id = verify_credentials(username, password)
+                    except (RateLimited, passwords.PasswordServiceBusy) as e:
+                        st.error(str(e))
                     else:
-                        st.error("Invalid credentials")
+                        if authenticated:
+                            st.session_state.logged_in = True
+                            st.session_state.username = username
+                            st.session_state.is_admin = is_admin
+                            st.session_state.user_id = user_id
+                            log_activity("Logged in", f"User logged in as {username}")
+                            st.rerun()
+                        else:
+                            st.error("Invalid credentials")
 
         with tab2:
             with st.form("create_staff"):
@@ -145,35 +174,83 @@ def main_page():
     if st.session_state.current_page == "Dashboard":
         st.title("Hospital Dashboard")
 
-        # Real metrics from database
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            patient_count = db.query(Patient).count()
-            st.metric("Total Patients", patient_count)
-        with col2:
-            today_appointments = db.query(Appointment).filter(
-                Appointment.appointment_date >= datetime.now().date()
-            ).count()
-            st.metric("Today's Appointments", today_appointments)
-        with col3:
-            staff_count = db.query(User).filter(User.role != 'admin').count()
-            st.metric("Available Staff", staff_count)
-        with col4:
-            low_stock_count = db.query(Inventory).filter(
-                Inventory.quantity <= Inventory.reorder_level
-            ).count()
-            st.metric("Low Stock Items", low_stock_count)
+        # Counts come from the repositories; on the database backend all tiles are one cached query, see utils/metrics.py
+        values = metrics.get_metrics(metrics.DASHBOARD)
+        for col, name in zip(st.columns(len(metrics.DASHBOARD)), metrics.DASHBOARD):
+            with col:
+                st.metric(metrics.KPIS[name]["label"], values[name])
 
     elif st.session_state.current_page == "Audit Log":
         if st.session_state.is_admin:
-            st.title("System Audit Log")
-            audit_logs = db.query(AuditLog).order_by(AuditLog.timestamp.desc()).all()
-            for log in audit_logs:
-                user = db.query(User).filter(User.id == log.user_id).first()
-                st.text(f"{log.timestamp} - {user.username if user else 'Unknown User'}: {log.action} - {log.details if log.details else ''}")
+            audit_log_page()
         else:
             st.error("Access Denied: Only administrators can view the audit log")
 
+def audit_log_page():
+    st.title("System Audit Log")
+    # Show entries still waiting in the audit queue, including this session's own
+    audit.flush(timeout=5)
+
+    users = db.query(User.id, User.username).order_by(User.username).all()
+    actions = [action for (action,) in db.query(AuditLog.action).distinct().order_by(AuditLog.action)]
+    usernames = {user_id: username for user_id, username in users}
+
+    col1, col2, col3, col4 = st.columns(4)
+    user_id = col1.selectbox("User", [None] + list(usernames),
+                             format_func=lambda user_id: "All users" if user_id is None else usernames[user_id])
+    action = col2.selectbox("Action", [None] + actions,
+                            format_func=lambda action: "All actions" if action is None else action)
+    start = col3.date_input("From", value=None)
+    end = col4.date_input("To", value=None)
+    page_size = st.selectbox("Entries per page", [25, 50, 100, 200], index=1)
+
+    query = db.query(
+        AuditLog.id, AuditLog.timestamp, User.username, AuditLog.action, AuditLog.details
+    ).outerjoin(AuditLog.user)
+    if user_id is not None:
+        query = query.filter(AuditLog.user_id == user_id)
+    if action is not None:
+        query = query.filter(AuditLog.action == action)
+    if start:
+        query = query.filter(AuditLog.timestamp >= start)
+    if end:
+        query = query.filter(AuditLog.timestamp < end + timedelta(days=1))
+
+    # Keyset pagination: each page starts after the (timestamp, id) of the
+    # previous page's last row, so deep pages cost the same as the first
+    filters = (user_id, action, start, end, page_size)
+    if st.session_state.get("audit_filters") != filters:
+        st.session_state.audit_filters = filters
+        st.session_state.audit_cursors = []
+    cursors = st.session_state.audit_cursors
+    if cursors:
+        query = query.filter(tuple_(AuditLog.timestamp, AuditLog.id) < cursors[-1])
+    rows = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(page_size + 1).all()
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if not rows:
+        st.info("No audit entries match these filters")
+    else:
+        st.dataframe(
+            pd.DataFrame([{
+                "Time": row.timestamp,
+                "User": row.username or "Unknown User",
+                "Action": row.action,
+                "Details": row.details or ""
+            } for row in rows]),
+            hide_index=True
+        )
+
+    col1, col2, col3 = st.columns([1, 4, 1])
+    if col1.button("Newer", disabled=not cursors):
+        cursors.pop()
+        st.rerun()
+    col2.caption(f"Page {len(cursors) + 1}")
+    if col3.button("Older", disabled=not has_next):
+        cursors.append((rows[-1].timestamp, rows[-1].id))
+        st.rerun()
+
 def main():
     st.set_page_config(
         page_title="Hospital Management System",
@@ -189,4 +266,8 @@ def main():
         main_page()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        migrate_database()
+        main()
+    finally:
+        db_session.remove()
\ No newline at end of file
@@ -1,10 +1,20 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from utils.data_manager import DataManager
+from utils.data_manager import StaleRecordError
+from utils.repository import get_repository
+from utils.scheduling import SchedulingConflict, get_scheduler, DEFAULT_DURATION
+from utils.typeahead import get_typeahead, typeahead_select
 from utils.auth import Auth
 
-data_manager = DataManager()
+appointments = get_repository("appointments")
+patients = get_repository("patients")
+staff_members = get_repository("staff")
+scheduler = get_scheduler()
+patient_picker = get_typeahead("patients")
+doctor_picker = get_typeahead("doctors")
+
+DURATIONS = [15, 30, 45, 60, 90, 120]
 auth = Auth()
 
 def render():
@@ -12,69 +22,138 @@ def render():
     
     # Add new appointment
     with st.expander("Schedule New Appointment"):
+        # Pickers sit outside the form so their matches update as you type
+        col1, col2 = st.columns(2)
+        with col1:
+            patient_id = typeahead_select("Patient", patient_picker, "appointment_patient")
+        with col2:
+            doctor_id = typeahead_select("Doctor", doctor_picker, "appointment_doctor", placeholder="Type a name")
+        
         with st.form("add_appointment"):
-            patients_df = data_manager.load_data("patients")
-            staff_df = data_manager.load_data("staff")
-            
-            patient = st.selectbox("Patient", 
-                                 patients_df['name'].tolist() if not patients_df.empty else ["No patients available"])
             date = st.date_input("Date", min_value=datetime.now().date())
             time = st.time_input("Time")
-            doctor = st.selectbox("Doctor", 
-                                staff_df[staff_df['role'] == 'Doctor']['name'].tolist() if not staff_df.empty else ["No doctors available"])
+            duration = st.selectbox("Duration", DURATIONS, index=DURATIONS.index(DEFAULT_DURATION),
+                                    format_func=lambda minutes: f"{minutes} minutes")
             
             if st.form_submit_button("Schedule Appointment"):
-                if patient != "No patients available" and doctor != "No doctors available":
+                if patient_id is not None and doctor_id is not None:
+                    patient = patient_picker.name(patient_id)
+                    doctor = doctor_picker.name(doctor_id)
                     new_appointment = {
-                        "id": pd.util.hash_pandas_object(pd.Series([patient, date, time])).sum(),
-                        "patient_id": patients_df[patients_df['name'] == patient]['id'].iloc[0],
+                        "patient_id": patient_id,
                         "date": date.strftime("%Y-%m-%d"),
                         "time": time.strftime("%H:%M"),
+                        "duration": duration,
                         "doctor": doctor,
                         "status": "Scheduled"
                     }
-                    data_manager.add_record("appointments", new_appointment)
-                    auth.log_activity(f"Scheduled appointment for patient: {patient}")
-                    st.success("Appointment scheduled successfully!")
+                    try:
+                        scheduler.book(new_appointment)
+                        auth.log_activity(f"Scheduled appointment for patient: {patient}")
+                        st.success("Appointment scheduled successfully!")
+                    except SchedulingConflict as e:
+                        st.error(str(e))
+                        alternatives = scheduler.free_slots([doctor], duration, after=e.start, count=3)
+                        if alternatives:
+                            st.info(f"{doctor} is free at: " + ", ".join(start.strftime("%Y-%m-%d %H:%M") for start, _ in alternatives))
                 else:
-                    st.error("Please ensure patients and doctors are available")
+                    st.error("Please pick a patient and a doctor")
     
+    # Earliest free slots across doctors
+    with st.expander("Find Free Slots"):
+        doctor_names = staff_members.find([("role", "==", "Doctor")], columns=["name"])["name"].tolist()
+        col1, col2, col3 = st.columns(3)
+        slot_doctors = col1.multiselect("Doctors", doctor_names, placeholder="All doctors")
+        slot_duration = col2.selectbox("Length", DURATIONS, index=DURATIONS.index(DEFAULT_DURATION),
+                                       format_func=lambda minutes: f"{minutes} minutes")
+        slot_date = col3.date_input("From", datetime.now().date(), min_value=datetime.now().date())
+        slot_count = st.slider("Number of slots", 1, 20, 5)
+        slots = scheduler.free_slots(slot_doctors or doctor_names, slot_duration,
+                                     after=datetime.combine(slot_date, datetime.min.time()), count=slot_count)
+        if slots:
+            st.dataframe(pd.DataFrame([{
+                "Doctor": doctor,
+                "Date": start.strftime("%Y-%m-%d"),
+                "Time": f"{start.strftime('%H:%M')} - {(start + timedelta(minutes=slot_duration)).strftime('%H:%M')}"
+            } for start, doctor in slots]), hide_index=True)
+        else:
+            st.info("No free slots found")
+
     # View/Manage appointments
     st.subheader("Appointment Schedule")
     
-    appointments_df = data_manager.load_data("appointments")
-    if not appointments_df.empty:
-        appointments_df['date'] = pd.to_datetime(appointments_df['date'])
-        appointments_df = appointments_df.sort_values('date')
-        
-        # Filter appointments
-        filter_date = st.date_input("Filter by date", datetime.now().date())
-        filtered_df = appointments_df[appointments_df['date'].dt.date == filter_date]
+    week_of = st.date_input("Week of", datetime.now().date())
+    week_start = week_of - timedelta(days=week_of.weekday())
+    # Reads only the date partitions this week falls in
+    week_df = appointments.find([("date", ">=", week_start), ("date", "<=", week_start + timedelta(days=6))],
+                                sort=[("date", True), ("time", True), ("id", True)])
+    
+    if not week_df.empty:
+        week_df = with_patient_names(week_df)
+        grid = calendar_grid(week_df, week_start)
+        # Tall enough rows for the busiest doctor-day
+        lines = int(grid.map(lambda cell: cell.count("\n") + 1).to_numpy().max())
+        st.dataframe(grid, row_height=min(14 + 21 * lines, 300))
         
-        if not filtered_df.empty:
-            for _, appointment in filtered_df.iterrows():
-                patient_name = patients_df[patients_df['id'] == appointment['patient_id']]['name'].iloc[0]
-                with st.expander(f"Appointment: {patient_name} - {appointment['time']}"):
-                    with st.form(f"edit_appointment_{appointment['id']}"):
-                        status = st.selectbox("Status", 
-                                            ["Scheduled", "Completed", "Cancelled"],
-                                            index=["Scheduled", "Completed", "Cancelled"].index(appointment['status']))
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Update Status"):
-                                appointment['status'] = status
-                                data_manager.update_record("appointments", appointment['id'], appointment)
-                                auth.log_activity(f"Updated appointment status for patient: {patient_name}")
-                                st.success("Appointment updated successfully!")
-                        
-                        with col2:
-                            if st.form_submit_button("Cancel Appointment"):
-                                data_manager.delete_record("appointments", appointment['id'])
-                                auth.log_activity(f"Cancelled appointment for patient: {patient_name}")
-                                st.success("Appointment cancelled successfully!")
-                                st.rerun()
-        else:
-            st.info(f"No appointments scheduled for {filter_date}")
+        # Manage one appointment of the week
+        week_df = week_df.set_index("id", drop=False)
+        # Ids keep labels unique; the selection is restored by its label on rerun
+        labels = "#" + week_df["id"].astype(str) + " " + week_df["date"] + " " + week_df["time"] + " - " + week_df["patient_name"] + " (" + week_df["doctor"].fillna("") + ")"
+        selected = st.selectbox("Manage appointment", week_df.index, format_func=lambda i: labels[i])
+        render_appointment(week_df.loc[selected])
     else:
-        st.info("No appointments scheduled")
+        st.info(f"No appointments scheduled for the week of {week_start}")
+
+def with_patient_names(df):
+    names = patients.find([("id", "in", df["patient_id"].unique().tolist())], columns=["id", "name"])
+    names = names.set_index("id")["name"]
+    return df.assign(patient_name=df["patient_id"].map(names).fillna("Unknown patient"))
+
+def calendar_grid(df, week_start):
+    # Doctors down, days across; each cell lists that doctor's appointments for the day
+    days = [week_start + timedelta(days=i) for i in range(7)]
+    day_labels = [day.strftime("%a %d %b") for day in days]
+    starts = pd.to_datetime(df["date"] + " " + df["time"], errors="coerce")
+    durations = pd.to_numeric(df["duration"], errors="coerce").fillna(DEFAULT_DURATION)
+    ends = (starts + pd.to_timedelta(durations, unit="m")).dt.strftime("%H:%M")
+    status = (" (" + df["status"].fillna("") + ")").where(df["status"] != "Scheduled", "")
+    entries = df["time"] + "-" + ends.fillna("?") + " " + df["patient_name"] + status
+    day = starts.dt.normalize().map(dict(zip(pd.to_datetime(days), day_labels)))
+    grid = pd.DataFrame({"Doctor": df["doctor"].fillna("Unassigned"), "day": day, "entry": entries})
+    grid = grid.pivot_table(index="Doctor", columns="day", values="entry", aggfunc="\n".join)
+    return grid.reindex(columns=day_labels).fillna("")
+
+def render_appointment(appointment):
+    patient_name = appointment['patient_name']
+    with st.form(f"edit_appointment_{appointment['id']}"):
+        # Remember the version first shown in this form so concurrent edits are caught
+        version_key = f"edit_appointment_{appointment['id']}_version"
+        seen_version = st.session_state.setdefault(version_key, appointment['version'])
+        status = st.selectbox("Status", 
+                            ["Scheduled", "Completed", "Cancelled"],
+                            index=["Scheduled", "Completed", "Cancelled"].index(appointment['status']))
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("Update Status"):
+                try:
+                    # The slot may have been rebooked while this appointment was cancelled
+                    scheduler.set_status(appointment['id'], status, expected_version=seen_version)
+                    auth.log_activity(f"Updated appointment status for patient: {patient_name}")
+                    st.success("Appointment updated successfully!")
+                except StaleRecordError:
+                    st.error("This appointment was changed by someone else. Review the latest details and try again.")
+                except SchedulingConflict as e:
+                    st.error(str(e))
+                st.session_state.pop(version_key, None)
+        
+        with col2:
+            if st.form_submit_button("Cancel Appointment"):
+                try:
+                    appointments.delete(appointment['id'], expected_version=seen_version)
+                    auth.log_activity(f"Cancelled appointment for patient: {patient_name}")
+                    st.success("Appointment cancelled successfully!")
+                    st.rerun()
+                except StaleRecordError:
+                    st.error("This appointment was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
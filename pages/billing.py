@@ -1,19 +1,20 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
-from utils.data_manager import DataManager
+from utils.data_manager import StaleRecordError
+from utils.repository import get_repository
+from utils.typeahead import get_typeahead, typeahead_select
 from utils.auth import Auth
+from utils.paged_list import paged_list, RepositorySource
 
-data_manager = DataManager()
+bills = get_repository("billing")
+patients = get_repository("patients")
+patient_picker = get_typeahead("patients")
 auth = Auth()
 
 def render():
     st.title("Billing Management")
 
-    # Load required data
-    patients_df = data_manager.load_data("patients")
-
-    if patients_df.empty:
+    if not patients.count():
         st.warning("⚠️ No patients registered in the system. Please add patients before creating bills.")
         if st.button("Go to Patient Management"):
             st.session_state.current_page = "Patients"
@@ -22,22 +23,25 @@ def render():
 
     # Create new bill
     with st.expander("Create New Bill"):
+        # Outside the form so the matches update as you type
+        patient_id = typeahead_select("Patient", patient_picker, "bill_patient")
+        
         with st.form("create_bill"):
-            patient = st.selectbox("Patient", 
-                               patients_df['name'].tolist())
             amount = st.number_input("Amount", min_value=0.0, format="%.2f")
             status = st.selectbox("Status", ["Pending", "Paid", "Overdue"])
 
             if st.form_submit_button("Create Bill"):
-                if amount > 0:
+                if patient_id is None:
+                    st.error("Please pick a patient")
+                elif amount > 0:
+                    patient = patient_picker.name(patient_id)
                     new_bill = {
-                        "id": pd.util.hash_pandas_object(pd.Series([patient, datetime.now()])).sum(),
-                        "patient_id": patients_df[patients_df['name'] == patient]['id'].iloc[0],
+                        "patient_id": patient_id,
                         "amount": amount,
                         "date": datetime.now().strftime("%Y-%m-%d"),
                         "status": status
                     }
-                    data_manager.add_record("billing", new_bill)
+                    bills.add(new_bill)
                     auth.log_activity(f"Created new bill for patient: {patient}")
                     st.success("Bill created successfully!")
                 else:
@@ -46,40 +50,66 @@ def render():
     # View/Manage bills
     st.subheader("Billing Records")
 
-    billing_df = data_manager.load_data("billing")
-    if not billing_df.empty:
+    statuses = bills.distinct("status")
+    if statuses:
         # Filter by status
         status_filter = st.selectbox("Filter by Status", 
-                                 ["All"] + billing_df['status'].unique().tolist())
+                                 ["All"] + statuses)
 
-        filtered_df = billing_df if status_filter == "All" else billing_df[billing_df['status'] == status_filter]
+        filters = [] if status_filter == "All" else [("status", "==", status_filter)]
 
-        for _, bill in filtered_df.iterrows():
-            patient_name = patients_df[patients_df['id'] == bill['patient_id']]['name'].iloc[0]
-            with st.expander(f"Bill: {patient_name} - ${bill['amount']} ({bill['status']})"):
-                with st.form(f"edit_bill_{bill['id']}"):
-                    edit_amount = st.number_input("Amount", 
-                                              min_value=0.0, 
-                                              value=float(bill['amount']), 
-                                              format="%.2f")
-                    edit_status = st.selectbox("Status", 
-                                           ["Pending", "Paid", "Overdue"],
-                                           index=["Pending", "Paid", "Overdue"].index(bill['status']))
+        source = RepositorySource(bills, ["status", "date"], {
+            "Newest first": ("date", False),
+            "Oldest first": ("date", True),
+            "Highest amount": ("amount", False),
+            "Lowest amount": ("amount", True)
+        }, filters)
+        paged_list("billing", source, bill_title, render_bill)
+    else:
+        st.info("No billing records found. Create a new bill using the form above.")
 
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Update"):
-                            bill['amount'] = edit_amount
-                            bill['status'] = edit_status
-                            data_manager.update_record("billing", bill['id'], bill)
-                            auth.log_activity(f"Updated bill for patient: {patient_name}")
-                            st.success("Bill updated successfully!")
+def bill_patient_name(bill):
+    patient = patients.get(bill['patient_id'])
+    return patient['name'] if patient else "Unknown patient"
 
-                    with col2:
-                        if st.form_submit_button("Delete"):
-                            data_manager.delete_record("billing", bill['id'])
-                            auth.log_activity(f"Deleted bill for patient: {patient_name}")
-                            st.success("Bill deleted successfully!")
-                            st.rerun()
-    else:
-        st.info("No billing records found. Create a new bill using the form above.")
\ No newline at end of file
+def bill_title(bill):
+    return f"Bill: {bill_patient_name(bill)} - ${bill['amount']} ({bill['status']})"
+
+def render_bill(bill):
+    patient_name = bill_patient_name(bill)
+    with st.form(f"edit_bill_{bill['id']}"):
+        # Remember the version first shown in this form so concurrent edits are caught
+        version_key = f"edit_bill_{bill['id']}_version"
+        seen_version = st.session_state.setdefault(version_key, bill['version'])
+        edit_amount = st.number_input("Amount", 
+                                  min_value=0.0, 
+                                  value=float(bill['amount']), 
+                                  format="%.2f")
+        edit_status = st.selectbox("Status", 
+                               ["Pending", "Paid", "Overdue"],
+                               index=["Pending", "Paid", "Overdue"].index(bill['status']))
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("Update"):
+                try:
+                    bills.update(bill['id'], {
+                        "amount": edit_amount,
+                        "status": edit_status
+                    }, expected_version=seen_version)
+                    auth.log_activity(f"Updated bill for patient: {patient_name}")
+                    st.success("Bill updated successfully!")
+                except StaleRecordError:
+                    st.error("This bill was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
+
+        with col2:
+            if st.form_submit_button("Delete"):
+                try:
+                    bills.delete(bill['id'], expected_version=seen_version)
+                    auth.log_activity(f"Deleted bill for patient: {patient_name}")
+                    st.success("Bill deleted successfully!")
+                    st.rerun()
+                except StaleRecordError:
+                    st.error("This bill was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
@@ -1,12 +1,25 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from utils.data_manager import DataManager
+from utils.data_manager import StaleRecordError
+from utils.repository import get_repository
+from utils.stock import InsufficientStock, get_stock, DEFAULT_REORDER_LEVEL
+from utils import forecast
 from utils.auth import Auth
+from utils.paged_list import paged_list, RepositorySource
 
-data_manager = DataManager()
+inventory = get_repository("inventory")
+forecasts = get_repository("stock_forecasts")
+stock = get_stock()
 auth = Auth()
 
+# Movement form choice -> ledger movement kind
+MOVEMENTS = {
+    "Receive stock": "receipt",
+    "Dispense": "dispense",
+    "Stock count": "adjustment"
+}
+
 def render():
     st.title("Inventory Management")
     
@@ -15,60 +28,137 @@ def render():
         with st.form("add_item"):
             item = st.text_input("Item Name")
             quantity = st.number_input("Quantity", min_value=0)
+            reorder_level = st.number_input("Reorder Level", min_value=0, value=DEFAULT_REORDER_LEVEL)
             category = st.selectbox("Category", 
                                   ["Medicines", "Equipment", "Supplies", "Other"])
             
             if st.form_submit_button("Add Item"):
                 if item and quantity >= 0:
                     new_item = {
-                        "id": pd.util.hash_pandas_object(pd.Series([item, category])).sum(),
                         "item": item,
                         "quantity": quantity,
+                        "reorder_level": reorder_level,
                         "category": category,
                         "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     }
-                    data_manager.add_record("inventory", new_item)
+                    stock.add_item(new_item, user=st.session_state.get("username"))
                     auth.log_activity(f"Added new inventory item: {item}")
                     st.success("Item added successfully!")
                 else:
                     st.error("Please fill in all fields correctly")
     
+    # Items at or below their reorder level, straight from the low-stock index
+    low_stock_count = stock.low_stock_count()
+    if low_stock_count:
+        st.subheader("Needs Reordering")
+        st.warning(f"⚠️ {low_stock_count} items are at or below their reorder level")
+        reorder = stock.needs_reorder(limit=20)
+        st.dataframe(reorder[["item", "quantity", "reorder_level", "category"]], hide_index=True)
+    
+    # Suggested orders from the last consumption forecast
+    with st.expander("Reorder Suggestions"):
+        suggested = forecast.suggestions(limit=50)
+        if not suggested.empty:
+            st.caption(f"Forecast computed {suggested['computed_at'].iloc[0]}, "
+                       f"covering {forecast.LEAD_TIME_DAYS:g} days of lead time and {forecast.COVER_DAYS:g} days of use")
+            st.dataframe(suggested[["item", "quantity", "daily_usage", "days_of_supply", "reorder_point", "suggested_order"]],
+                         hide_index=True)
+        else:
+            st.info("No reorders suggested by the last forecast")
+        # The forecast reads the whole ledger, so it runs as a nightly job rather than from here
+        st.caption("Forecasts are recomputed by the nightly job `python -m utils.forecast`.")
+    
     # View/Manage inventory
     st.subheader("Current Inventory")
     
-    inventory_df = data_manager.load_data("inventory")
-    if not inventory_df.empty:
+    categories = inventory.distinct("category")
+    if categories:
         # Filter by category
         category_filter = st.selectbox("Filter by Category", 
-                                     ["All"] + inventory_df['category'].unique().tolist())
+                                     ["All"] + categories)
         
-        filtered_df = inventory_df if category_filter == "All" else inventory_df[inventory_df['category'] == category_filter]
+        filters = [] if category_filter == "All" else [("category", "==", category_filter)]
         
-        for _, item in filtered_df.iterrows():
-            with st.expander(f"{item['item']} - {item['quantity']} units"):
-                with st.form(f"edit_item_{item['id']}"):
-                    edit_quantity = st.number_input("Update Quantity", 
-                                                  min_value=0, 
-                                                  value=int(item['quantity']))
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Update"):
-                            item['quantity'] = edit_quantity
-                            item['last_updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            data_manager.update_record("inventory", item['id'], item)
-                            auth.log_activity(f"Updated inventory item: {item['item']}")
-                            st.success("Item updated successfully!")
-                    
-                    with col2:
-                        if st.form_submit_button("Delete"):
-                            data_manager.delete_record("inventory", item['id'])
-                            auth.log_activity(f"Deleted inventory item: {item['item']}")
-                            st.success("Item deleted successfully!")
-                            st.rerun()
-                
-                # Low stock warning
-                if item['quantity'] < 10:
-                    st.warning("⚠️ Low stock alert!")
+        source = RepositorySource(inventory, ["item", "category"], {
+            "Item (A-Z)": ("item", True),
+            "Lowest stock first": ("quantity", True),
+            "Highest stock first": ("quantity", False),
+            "Recently updated": ("last_updated", False)
+        }, filters)
+        paged_list("inventory", source, item_title, render_item)
     else:
         st.info("No items in inventory")
+
+def reorder_level_of(item):
+    return DEFAULT_REORDER_LEVEL if pd.isna(item['reorder_level']) else int(item['reorder_level'])
+
+def is_low_stock(item):
+    return item['quantity'] <= reorder_level_of(item)
+
+def item_title(item):
+    title = f"{item['item']} - {item['quantity']} units"
+    return f"{title} ⚠️ Low stock" if is_low_stock(item) else title
+
+def render_item(item):
+    with st.form(f"edit_item_{item['id']}"):
+        # Remember the version first shown in this form so concurrent edits are caught
+        version_key = f"edit_item_{item['id']}_version"
+        seen_version = st.session_state.setdefault(version_key, item['version'])
+        col1, col2 = st.columns(2)
+        movement = col1.selectbox("Movement", list(MOVEMENTS))
+        amount = col2.number_input("Quantity", min_value=0, value=0,
+                                   help="For a stock count, the number of units counted")
+        reason = st.text_input("Reason")
+        reorder_level = st.number_input("Reorder Level", min_value=0, value=reorder_level_of(item))
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.form_submit_button("Record Movement"):
+                try:
+                    if amount == 0 and MOVEMENTS[movement] != "adjustment":
+                        st.error("Enter a quantity to record")
+                    else:
+                        level = stock.record(item['id'], MOVEMENTS[movement], amount, reason or None,
+                                             user=st.session_state.get("username"), expected_version=seen_version)
+                        auth.log_activity(f"Recorded {MOVEMENTS[movement]} of {item['item']}, now {level} units")
+                        st.success(f"Stock updated: {level} units on hand")
+                except StaleRecordError:
+                    st.error("This item was changed by someone else. Review the latest details and try again.")
+                except InsufficientStock as e:
+                    st.error(str(e))
+                st.session_state.pop(version_key, None)
+        
+        with col2:
+            if st.form_submit_button("Save Reorder Level"):
+                try:
+                    stock.set_reorder_level(item['id'], reorder_level, expected_version=seen_version)
+                    auth.log_activity(f"Set reorder level of {item['item']} to {reorder_level}")
+                    st.success("Reorder level updated!")
+                except StaleRecordError:
+                    st.error("This item was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
+        
+        with col3:
+            if st.form_submit_button("Delete"):
+                try:
+                    stock.delete_item(item['id'], expected_version=seen_version)
+                    auth.log_activity(f"Deleted inventory item: {item['item']}")
+                    st.success("Item deleted successfully!")
+                    st.rerun()
+                except StaleRecordError:
+                    st.error("This item was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
+    
+    # Low stock warning
+    if is_low_stock(item):
+        st.warning("⚠️ Low stock alert!")
+    
+    item_forecast = forecasts.get(item['id'])
+    if item_forecast is not None and item_forecast['daily_usage'] > 0:
+        st.caption(f"Uses about {item_forecast['daily_usage']:g} a day, {item_forecast['days_of_supply']:g} days of supply left"
+                   + (f"; suggested order: {item_forecast['suggested_order']:g}" if item_forecast['suggested_order'] > 0 else ""))
+    
+    history = stock.history(item['id'], limit=10)
+    if not history.empty:
+        st.caption("Recent stock movements")
+        st.dataframe(history[["timestamp", "kind", "quantity", "reason", "user"]], hide_index=True)
@@ -1,18 +1,15 @@
 import streamlit as st
 from datetime import datetime
-from database import get_db, Patient, AuditLog
+from database import db_session, migrate, Patient
+from utils.audit import audit
+from utils.paged_list import paged_list, QuerySource
+from utils.search import get_patient_search
 
-# Initialize database session
-db = next(get_db())
+# Session for the current script run, see database.db_session
+db = db_session
 
 def log_patient_activity(user_id, action, details):
-    new_log = AuditLog(
-        user_id=user_id,
-        action=action,
-        details=details
-    )
-    db.add(new_log)
-    db.commit()
+    audit.log_event(user_id, action, details)
 
 def patient_registration():
     st.header("Patient Registration")
@@ -53,28 +50,35 @@ def patient_registration():
 def view_patients():
     st.header("View Patients")
     
-    patients = db.query(Patient).all()
-    
-    if not patients:
+    if db.query(Patient.id).first() is None:
         st.info("No patients registered yet")
         return
         
-    for patient in patients:
-        with st.expander(f"Patient: {patient.name}"):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.write("**Personal Information**")
-                st.write(f"Date of Birth: {patient.date_of_birth}")
-                st.write(f"Contact: {patient.contact_number}")
-                st.write(f"Address: {patient.address}")
-            with col2:
-                st.write("**Medical Information**")
-                st.write(f"Medical History: {patient.medical_history}")
-                st.write(f"Registration Date: {patient.created_at}")
-            
-            if st.button(f"Edit Patient #{patient.id}"):
-                st.session_state.editing_patient = patient.id
-                st.rerun()
+    # Sort and LIMIT/OFFSET run in the database and only one page is loaded;
+    # searches are ranked by the full-text index
+    source = QuerySource(db.query(Patient), [Patient.name, Patient.contact_number, Patient.medical_history], {
+        "Name (A-Z)": (Patient.name.asc(), Patient.id.asc()),
+        "Name (Z-A)": (Patient.name.desc(), Patient.id.desc()),
+        "Newest first": (Patient.created_at.desc(), Patient.id.desc())
+    }, ranked=get_patient_search("sql").search)
+    paged_list("db_patients", source, lambda patient: f"Patient: {patient.name}", render_patient_details,
+               empty_message="No patients match your search")
+
+def render_patient_details(patient):
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("**Personal Information**")
+        st.write(f"Date of Birth: {patient.date_of_birth}")
+        st.write(f"Contact: {patient.contact_number}")
+        st.write(f"Address: {patient.address}")
+    with col2:
+        st.write("**Medical Information**")
+        st.write(f"Medical History: {patient.medical_history}")
+        st.write(f"Registration Date: {patient.created_at}")
+    
+    if st.button(f"Edit Patient #{patient.id}"):
+        st.session_state.editing_patient = patient.id
+        st.rerun()
 
 def edit_patient(patient_id):
     patient = db.query(Patient).filter(Patient.id == patient_id).first()
@@ -114,6 +118,11 @@ def edit_patient(patient_id):
             except Exception as e:
                 st.error(f"Error updating patient information: {str(e)}")
 
+@st.cache_resource
+def migrate_database():
+    # Once per server process when this page is run on its own
+    return migrate()
+
 def main():
     if 'editing_patient' not in st.session_state:
         st.session_state.editing_patient = None
@@ -131,4 +140,8 @@ def main():
             view_patients()
 
 if __name__ == "__main__":
-    main()
+    try:
+        migrate_database()
+        main()
+    finally:
+        db_session.remove()
@@ -1,9 +1,13 @@
 import streamlit as st
-import pandas as pd
-from utils.data_manager import DataManager
+from utils.data_manager import StaleRecordError
+from utils.repository import get_repository
+from utils.search import get_patient_search
+from utils import dedupe
 from utils.auth import Auth
+from utils.paged_list import paged_list, RepositorySource
 
-data_manager = DataManager()
+patients = get_repository("patients")
+patient_search = get_patient_search()
 auth = Auth()
 
 def render():
@@ -16,59 +20,105 @@ def render():
             age = st.number_input("Age", min_value=0, max_value=120)
             gender = st.selectbox("Gender", ["Male", "Female", "Other"])
             contact = st.text_input("Contact")
+            address = st.text_input("Address")
             medical_history = st.text_area("Medical History")
             
             if st.form_submit_button("Add Patient"):
                 if name and contact:
                     new_patient = {
-                        "id": pd.util.hash_pandas_object(pd.Series([name, contact])).sum(),
                         "name": name,
                         "age": age,
                         "gender": gender,
                         "contact": contact,
+                        "address": address or None,
                         "medical_history": medical_history
                     }
-                    data_manager.add_record("patients", new_patient)
+                    patients.add(new_patient)
                     auth.log_activity(f"Added new patient: {name}")
                     st.success("Patient added successfully!")
                 else:
                     st.error("Please fill in required fields")
     
+    # Likely duplicates from the last dedupe run
+    with st.expander("Possible Duplicates"):
+        duplicates = dedupe.candidates(limit=20)
+        if not duplicates.empty:
+            st.caption(f"Checked {duplicates['found_at'].iloc[0]}. Merging keeps the first patient and moves "
+                       "the second one's appointments and bills to it.")
+            for pair in duplicates.itertuples():
+                col1, col2 = st.columns([5, 1])
+                col1.write(f"{pair.patient_name} (#{pair.patient_id}) and {pair.duplicate_name} (#{pair.duplicate_id}), "
+                           f"score {pair.score:.2f}")
+                if col2.button("Merge", key=f"merge_{pair.patient_id}_{pair.duplicate_id}"):
+                    try:
+                        moved = dedupe.merge(pair.patient_id, pair.duplicate_id)
+                        if moved is None:
+                            st.error("One of these patients no longer exists")
+                        else:
+                            auth.log_activity(f"Merged patient #{pair.duplicate_id} into #{pair.patient_id}")
+                            st.success(f"Patients merged, {moved} appointments and bills moved")
+                            st.rerun()
+                    except StaleRecordError:
+                        st.error("One of these patients was changed by someone else. Review them and try again.")
+        else:
+            st.info("No possible duplicates found by the last check")
+        # The check compares the whole registry, so it runs as a scheduled job rather than from here
+        st.caption("Duplicates are found by the scheduled job `python -m utils.dedupe find`.")
+    
     # View/Edit patients
     st.subheader("Patient Records")
-    patients_df = data_manager.load_data("patients")
-    
-    if not patients_df.empty:
-        for _, patient in patients_df.iterrows():
-            with st.expander(f"Patient: {patient['name']}"):
-                with st.form(f"edit_patient_{patient['id']}"):
-                    edit_name = st.text_input("Name", patient['name'])
-                    edit_age = st.number_input("Age", min_value=0, max_value=120, value=int(patient['age']))
-                    edit_gender = st.selectbox("Gender", ["Male", "Female", "Other"], 
-                                             index=["Male", "Female", "Other"].index(patient['gender']))
-                    edit_contact = st.text_input("Contact", patient['contact'])
-                    edit_history = st.text_area("Medical History", patient['medical_history'])
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Update"):
-                            updated_patient = {
-                                "id": patient['id'],
-                                "name": edit_name,
-                                "age": edit_age,
-                                "gender": edit_gender,
-                                "contact": edit_contact,
-                                "medical_history": edit_history
-                            }
-                            data_manager.update_record("patients", patient['id'], updated_patient)
-                            auth.log_activity(f"Updated patient: {edit_name}")
-                            st.success("Patient updated successfully!")
-                    
-                    with col2:
-                        if st.form_submit_button("Delete"):
-                            data_manager.delete_record("patients", patient['id'])
-                            auth.log_activity(f"Deleted patient: {patient['name']}")
-                            st.success("Patient deleted successfully!")
-                            st.rerun()
+    if patients.count():
+        # Searches go through the full-text index: prefixes, phone fragments and typos match, best first
+        source = RepositorySource(patients, ["name", "contact", "address", "medical_history"], {
+            "Name (A-Z)": ("name", True),
+            "Name (Z-A)": ("name", False),
+            "Age": ("age", True),
+            "Newest first": ("id", False)
+        }, ranked=patient_search.search)
+        paged_list("patients", source, lambda patient: f"Patient: {patient['name']}", render_patient)
     else:
         st.info("No patients registered yet")
+
+def render_patient(patient):
+    with st.form(f"edit_patient_{patient['id']}"):
+        # Remember the version first shown in this form so concurrent edits are caught
+        version_key = f"edit_patient_{patient['id']}_version"
+        seen_version = st.session_state.setdefault(version_key, patient['version'])
+        edit_name = st.text_input("Name", patient['name'])
+        edit_age = st.number_input("Age", min_value=0, max_value=120, value=int(patient['age']))
+        edit_gender = st.selectbox("Gender", ["Male", "Female", "Other"], 
+                                 index=["Male", "Female", "Other"].index(patient['gender']))
+        edit_contact = st.text_input("Contact", patient['contact'])
+        edit_address = st.text_input("Address", patient['address'] if isinstance(patient['address'], str) else "")
+        edit_history = st.text_area("Medical History", patient['medical_history'])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("Update"):
+                updated_patient = {
+                    "id": patient['id'],
+                    "name": edit_name,
+                    "age": edit_age,
+                    "gender": edit_gender,
+                    "contact": edit_contact,
+                    "address": edit_address or None,
+                    "medical_history": edit_history
+                }
+                try:
+                    patients.update(patient['id'], updated_patient, expected_version=seen_version)
+                    auth.log_activity(f"Updated patient: {edit_name}")
+                    st.success("Patient updated successfully!")
+                except StaleRecordError:
+                    st.error("This patient was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
+        
+        with col2:
+            if st.form_submit_button("Delete"):
+                try:
+                    patients.delete(patient['id'], expected_version=seen_version)
+                    auth.log_activity(f"Deleted patient: {patient['name']}")
+                    st.success("Patient deleted successfully!")
+                    st.rerun()
+                except StaleRecordError:
+                    st.error("This patient was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
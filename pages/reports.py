@@ -1,23 +1,27 @@
 import streamlit as st
+import os
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from database import AuditLog
+from utils import export, forecast
 from utils.data_manager import DataManager
+from utils.repository import get_repository
+from utils.stock import get_stock
 from utils.auth import Auth
 
-data_manager = DataManager()
 auth = Auth()
 
 def render():
     st.title("Reports and Analytics")
     
-    # Load all required data
-    patients_df = data_manager.load_data("patients")
-    appointments_df = data_manager.load_data("appointments")
-    inventory_df = data_manager.load_data("inventory")
-    billing_df = data_manager.load_data("billing")
-    staff_df = data_manager.load_data("staff")
+    # Charts are grouped in the store (rollups or SQL), sized by days and categories rather than rows
+    patients = get_repository("patients")
+    appointments = get_repository("appointments")
+    bills = get_repository("billing")
+    inventory = get_repository("inventory")
+    staff_members = get_repository("staff")
 
     # Report selection
     report_type = st.selectbox(
@@ -27,12 +31,17 @@ def render():
 
     if report_type == "Patient Demographics":
         st.subheader("Patient Demographics Analysis")
+        age_counts = patients.aggregate("age").rename_axis('age').reset_index(name='count')
+        gender_counts = patients.aggregate("gender")
         
-        if not patients_df.empty:
+        if not gender_counts.empty:
             # Age distribution
+            age_counts['age'] = pd.to_numeric(age_counts['age'])
             fig_age = px.histogram(
-                patients_df,
+                age_counts,
                 x="age",
+                y="count",
+                histfunc="sum",
                 title="Age Distribution",
                 labels={"age": "Age", "count": "Number of Patients"},
                 nbins=20,
@@ -41,7 +50,6 @@ def render():
             st.plotly_chart(fig_age)
 
             # Gender distribution
-            gender_counts = patients_df['gender'].value_counts()
             fig_gender = px.pie(
                 values=gender_counts.values,
                 names=gender_counts.index,
@@ -54,13 +62,12 @@ def render():
 
     elif report_type == "Appointment Analytics":
         st.subheader("Appointment Analytics")
+        appointments_by_day = appointments.aggregate("date")
         
-        if not appointments_df.empty:
-            # Convert date to datetime
-            appointments_df['date'] = pd.to_datetime(appointments_df['date'])
-            
+        if not appointments_by_day.empty:
             # Appointments by date
-            daily_appointments = appointments_df.groupby('date').size().reset_index(name='count')
+            daily_appointments = appointments_by_day.rename_axis('date').reset_index(name='count')
+            daily_appointments['date'] = pd.to_datetime(daily_appointments['date'])
             fig_appointments = px.line(
                 daily_appointments,
                 x="date",
@@ -72,7 +79,7 @@ def render():
             st.plotly_chart(fig_appointments)
 
             # Appointment status distribution
-            status_counts = appointments_df['status'].value_counts()
+            status_counts = appointments.aggregate("status")
             fig_status = px.pie(
                 values=status_counts.values,
                 names=status_counts.index,
@@ -85,13 +92,12 @@ def render():
 
     elif report_type == "Financial Reports":
         st.subheader("Financial Analysis")
+        revenue_by_day = bills.aggregate("date", "amount")
         
-        if not billing_df.empty:
-            # Convert date to datetime
-            billing_df['date'] = pd.to_datetime(billing_df['date'])
-            
+        if not revenue_by_day.empty:
             # Total revenue by date
-            daily_revenue = billing_df.groupby('date')['amount'].sum().reset_index()
+            daily_revenue = revenue_by_day.rename_axis('date').reset_index(name='amount')
+            daily_revenue['date'] = pd.to_datetime(daily_revenue['date'])
             fig_revenue = px.line(
                 daily_revenue,
                 x="date",
@@ -103,7 +109,7 @@ def render():
             st.plotly_chart(fig_revenue)
 
             # Payment status distribution
-            payment_status = billing_df['status'].value_counts()
+            payment_status = bills.aggregate("status")
             fig_payment = px.pie(
                 values=payment_status.values,
                 names=payment_status.index,
@@ -113,24 +119,26 @@ def render():
             st.plotly_chart(fig_payment)
 
             # Summary metrics
+            amount_by_status = bills.aggregate("status", "amount")
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Revenue", f"${billing_df['amount'].sum():,.2f}")
+                st.metric("Total Revenue", f"${amount_by_status.sum():,.2f}")
             with col2:
-                pending_amount = billing_df[billing_df['status'] == 'Pending']['amount'].sum()
+                pending_amount = amount_by_status.get('Pending', 0)
                 st.metric("Pending Payments", f"${pending_amount:,.2f}")
             with col3:
-                overdue_amount = billing_df[billing_df['status'] == 'Overdue']['amount'].sum()
+                overdue_amount = amount_by_status.get('Overdue', 0)
                 st.metric("Overdue Payments", f"${overdue_amount:,.2f}")
         else:
             st.info("No billing data available for analysis")
 
     elif report_type == "Inventory Status":
         st.subheader("Inventory Analysis")
+        category_totals = inventory.aggregate("category", "quantity")
         
-        if not inventory_df.empty:
+        if not category_totals.empty:
             # Items by category
-            category_counts = inventory_df.groupby('category')['quantity'].sum().reset_index()
+            category_counts = category_totals.rename_axis('category').reset_index(name='quantity')
             fig_category = px.bar(
                 category_counts,
                 x="category",
@@ -142,29 +150,48 @@ def render():
             st.plotly_chart(fig_category)
 
             # Low stock items
-            st.subheader("Low Stock Items (Quantity < 10)")
-            low_stock = inventory_df[inventory_df['quantity'] < 10]
+            st.subheader("Low Stock Items (At or Below Reorder Level)")
+            low_stock = get_stock().needs_reorder()
             if not low_stock.empty:
                 fig_low_stock = px.bar(
                     low_stock,
                     x="item",
-                    y="quantity",
+                    y=["quantity", "reorder_level"],
+                    barmode="group",
                     title="Low Stock Items",
-                    labels={"item": "Item", "quantity": "Quantity"},
-                    color_discrete_sequence=['#DEB887']
+                    labels={"item": "Item", "value": "Quantity", "variable": ""},
+                    color_discrete_sequence=['#DEB887', '#F5F5DC']
                 )
                 st.plotly_chart(fig_low_stock)
             else:
                 st.info("No items are currently low in stock")
+
+            # Forecast reorders
+            st.subheader("Reorder Suggestions")
+            suggested = forecast.suggestions(limit=20)
+            if not suggested.empty:
+                fig_supply = px.bar(
+                    suggested,
+                    x="item",
+                    y="days_of_supply",
+                    title="Days of Supply Left",
+                    labels={"item": "Item", "days_of_supply": "Days"},
+                    color_discrete_sequence=['#DEB887']
+                )
+                st.plotly_chart(fig_supply)
+                st.dataframe(suggested[["item", "quantity", "daily_usage", "reorder_point", "suggested_order"]],
+                             hide_index=True)
+            else:
+                st.info("No reorders suggested by the last forecast")
         else:
             st.info("No inventory data available for analysis")
 
     elif report_type == "Staff Overview":
         st.subheader("Staff Analysis")
+        role_counts = staff_members.aggregate("role")
         
-        if not staff_df.empty:
+        if not role_counts.empty:
             # Staff distribution by role
-            role_counts = staff_df['role'].value_counts()
             fig_roles = px.pie(
                 values=role_counts.values,
                 names=role_counts.index,
@@ -174,38 +201,101 @@ def render():
             st.plotly_chart(fig_roles)
 
             # Staff list by role
-            for role in staff_df['role'].unique():
+            for role in role_counts.index:
                 with st.expander(f"{role}s"):
-                    role_staff = staff_df[staff_df['role'] == role]
-                    st.dataframe(role_staff[['name', 'contact', 'schedule']])
+                    role_staff = staff_members.find([("role", "==", role)], columns=["name", "contact", "schedule"])
+                    st.dataframe(role_staff)
         else:
             st.info("No staff data available for analysis")
 
     # Export reports
+    render_export()
+
+
+# Export name -> (source, table); "data" tables come from their repository, "db" from the database
+EXPORTS = {
+    "Patient List": ("data", "patients"),
+    "Appointment Schedule": ("data", "appointments"),
+    "Financial Summary": ("data", "billing"),
+    "Inventory Status": ("data", "inventory"),
+    "Stock Movements": ("data", "stock_movements"),
+    "Reorder Suggestions": ("data", "stock_forecasts"),
+    "Audit Log": ("db", "audit_logs")
+}
+
+
+def render_export():
     st.subheader("Export Reports")
-    export_type = st.selectbox("Select report to export", 
-                              ["Patient List", "Appointment Schedule", "Financial Summary", "Inventory Status"])
+    export_type = st.selectbox("Select report to export", list(EXPORTS))
+    source, table = EXPORTS[export_type]
+    if source == "db":
+        model = AuditLog
+        all_columns = list(model.__table__.columns.keys())
+        date_column = "timestamp"
+    else:
+        all_columns = DataManager.SCHEMAS[table]
+        date_column = export.DATE_COLUMNS.get(table)
+
+    col1, col2 = st.columns([3, 1])
+    columns = col1.multiselect("Columns", all_columns, default=all_columns, key=f"export_columns_{table}")
+    formats = export.available_formats()
+    fmt = col2.selectbox("Format", formats, format_func=str.upper)
+    for missing in [name for name in export.FORMATS if name not in formats]:
+        col2.caption(f"{missing.upper()} export needs {export.REQUIRES[missing]}")
+
+    start = end = None
+    if date_column and st.checkbox("Limit to a date range", key=f"export_range_{table}"):
+        col1, col2 = st.columns(2)
+        start = col1.date_input("From", value=datetime.now().date() - timedelta(days=30), key=f"export_start_{table}")
+        end = col2.date_input("To", value=datetime.now().date(), key=f"export_end_{table}")
     
     if st.button("Generate Report"):
-        if export_type == "Patient List":
-            data = patients_df
-        elif export_type == "Appointment Schedule":
-            data = appointments_df
-        elif export_type == "Financial Summary":
-            data = billing_df
+        if not columns:
+            st.error("Select at least one column to export")
+        elif start and end and start > end:
+            st.error("The start date must be on or before the end date")
         else:
-            data = inventory_df
-            
-        # Convert DataFrame to CSV string
-        csv = data.to_csv(index=False)
-        
-        # Create download button
+            if source == "db":
+                chunks = export.model_chunks(model, columns, start, end, date_column)
+            else:
+                chunks = export.repository_chunks(get_repository(table), columns, start, end)
+            name = f"{export_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}"
+            # The file is written on an export worker; the page only polls the job
+            st.session_state.export_job = (export_type, export.submit(chunks, fmt, name))
+            auth.log_activity(f"Generated {export_type} report")
+
+    if st.session_state.get("export_job"):
+        export_type, job = st.session_state.export_job
+        if job.done():
+            render_export_result(export_type, job)
+        else:
+            wait_for_export()
+
+
+@st.fragment(run_every=1)
+def wait_for_export():
+    # Polls without rerunning the charts above; a full rerun shows the result
+    export_type, job = st.session_state.export_job
+    if job.done():
+        st.rerun()
+    st.info(f"Generating {export_type} report...")
+
+
+def render_export_result(export_type, job):
+    try:
+        result = job.result()
+    except Exception as e:
+        st.error(f"Could not generate the {export_type} report: {e}")
+        return
+    if not os.path.exists(result["path"]):
+        st.warning("This export has expired. Generate the report again.")
+        return
+    st.success(f"{export_type} report generated successfully! "
+               f"{result['rows']:,} rows, {result['bytes'] / 1024 / 1024:,.1f} MB")
+    with open(result["path"], "rb") as f:
         st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name=f"{export_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
+            label=f"Download {os.path.splitext(result['file_name'])[1][1:].upper()}",
+            data=f,
+            file_name=result["file_name"],
+            mime=result["mime"]
         )
-        
-        auth.log_activity(f"Generated {export_type} report")
-        st.success(f"{export_type} report generated successfully!")
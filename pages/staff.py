@@ -1,9 +1,10 @@
 import streamlit as st
-import pandas as pd
-from utils.data_manager import DataManager
+from utils.data_manager import StaleRecordError
+from utils.repository import get_repository
 from utils.auth import Auth
+from utils.paged_list import paged_list, RepositorySource
 
-data_manager = DataManager()
+staff_members = get_repository("staff")
 auth = Auth()
 
 def render():
@@ -21,13 +22,12 @@ def render():
             if st.form_submit_button("Add Staff Member"):
                 if name and contact:
                     new_staff = {
-                        "id": pd.util.hash_pandas_object(pd.Series([name, contact])).sum(),
                         "name": name,
                         "role": role,
                         "contact": contact,
                         "schedule": schedule
                     }
-                    data_manager.add_record("staff", new_staff)
+                    staff_members.add(new_staff)
                     auth.log_activity(f"Added new staff member: {name}")
                     st.success("Staff member added successfully!")
                 else:
@@ -36,43 +36,61 @@ def render():
     # View/Manage staff
     st.subheader("Staff Records")
     
-    staff_df = data_manager.load_data("staff")
-    if not staff_df.empty:
+    roles = staff_members.distinct("role")
+    if roles:
         # Filter by role
         role_filter = st.selectbox("Filter by Role", 
-                                 ["All"] + staff_df['role'].unique().tolist())
+                                 ["All"] + roles)
         
-        filtered_df = staff_df if role_filter == "All" else staff_df[staff_df['role'] == role_filter]
+        filters = [] if role_filter == "All" else [("role", "==", role_filter)]
         
-        for _, staff in filtered_df.iterrows():
-            with st.expander(f"{staff['name']} - {staff['role']}"):
-                with st.form(f"edit_staff_{staff['id']}"):
-                    edit_name = st.text_input("Name", staff['name'])
-                    edit_role = st.selectbox("Role", 
-                                           ["Doctor", "Nurse", "Receptionist", "Administrator", "Other"],
-                                           index=["Doctor", "Nurse", "Receptionist", "Administrator", "Other"].index(staff['role']))
-                    edit_contact = st.text_input("Contact", staff['contact'])
-                    edit_schedule = st.text_area("Schedule", staff['schedule'])
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Update"):
-                            updated_staff = {
-                                "id": staff['id'],
-                                "name": edit_name,
-                                "role": edit_role,
-                                "contact": edit_contact,
-                                "schedule": edit_schedule
-                            }
-                            data_manager.update_record("staff", staff['id'], updated_staff)
-                            auth.log_activity(f"Updated staff member: {edit_name}")
-                            st.success("Staff member updated successfully!")
-                    
-                    with col2:
-                        if st.form_submit_button("Delete"):
-                            data_manager.delete_record("staff", staff['id'])
-                            auth.log_activity(f"Deleted staff member: {staff['name']}")
-                            st.success("Staff member deleted successfully!")
-                            st.rerun()
+        source = RepositorySource(staff_members, ["name", "role", "contact"], {
+            "Name (A-Z)": ("name", True),
+            "Name (Z-A)": ("name", False),
+            "Role": ("role", True),
+            "Newest first": ("id", False)
+        }, filters)
+        paged_list("staff", source, lambda staff: f"{staff['name']} - {staff['role']}", render_staff)
     else:
         st.info("No staff members registered")
+
+def render_staff(staff):
+    with st.form(f"edit_staff_{staff['id']}"):
+        # Remember the version first shown in this form so concurrent edits are caught
+        version_key = f"edit_staff_{staff['id']}_version"
+        seen_version = st.session_state.setdefault(version_key, staff['version'])
+        edit_name = st.text_input("Name", staff['name'])
+        edit_role = st.selectbox("Role", 
+                               ["Doctor", "Nurse", "Receptionist", "Administrator", "Other"],
+                               index=["Doctor", "Nurse", "Receptionist", "Administrator", "Other"].index(staff['role']))
+        edit_contact = st.text_input("Contact", staff['contact'])
+        edit_schedule = st.text_area("Schedule", staff['schedule'])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.form_submit_button("Update"):
+                updated_staff = {
+                    "id": staff['id'],
+                    "name": edit_name,
+                    "role": edit_role,
+                    "contact": edit_contact,
+                    "schedule": edit_schedule
+                }
+                try:
+                    staff_members.update(staff['id'], updated_staff, expected_version=seen_version)
+                    auth.log_activity(f"Updated staff member: {edit_name}")
+                    st.success("Staff member updated successfully!")
+                except StaleRecordError:
+                    st.error("This staff member was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
+        
+        with col2:
+            if st.form_submit_button("Delete"):
+                try:
+                    staff_members.delete(staff['id'], expected_version=seen_version)
+                    auth.log_activity(f"Deleted staff member: {staff['name']}")
+                    st.success("Staff member deleted successfully!")
+                    st.rerun()
+                except StaleRecordError:
+                    st.error("This staff member was changed by someone else. Review the latest details and try again.")
+                st.session_state.pop(version_key, None)
@@ -0,0 +1,8 @@
+import pytest
+from utils.data_manager import DataManager
+
+
+@pytest.fixture
+def data_manager(tmp_path):
+    # A data store of its own; DataManager's registries are keyed by path
+    return DataManager(data_dir=str(tmp_path / "data"))
@@ -0,0 +1,66 @@
+import threading
+import pandas as pd
+from utils.id_allocator import IdAllocator
+
+
+def patient(name):
+    return {"name": name, "age": 40, "gender": "Male", "contact": "0700000000", "medical_history": ""}
+
+
+def test_ids_are_sequential_and_never_reused(data_manager):
+    ids = [data_manager.add_record("patients", patient(name)) for name in ["Alice", "Bob", "Carol"]]
+    data_manager.delete_record("patients", ids[-1])
+
+    assert ids == [1, 2, 3]
+    assert data_manager.add_record("patients", patient("Dan")) == 4
+    assert list(data_manager.add_records("patients", pd.DataFrame([patient("Eve"), patient("Finn")]))["id"]) == [5, 6]
+
+
+def test_sequence_is_seeded_past_existing_ids_ignoring_legacy_hashes(data_manager):
+    legacy = pd.DataFrame([dict(patient("Alice"), id=7, version=1),
+                           dict(patient("Bob"), id=IdAllocator.MAX_SEQUENCE_ID + 12345, version=1)])
+    data_manager.save_data("patients", legacy)
+
+    assert data_manager.add_record("patients", patient("Carol")) == 8
+
+
+def test_allocators_sharing_a_file_hand_out_disjoint_ranges(tmp_path):
+    # Two processes each have their own allocator on the data dir's sequences file
+    path = str(tmp_path / "sequences.json")
+    first, second = IdAllocator(path), IdAllocator(path)
+
+    assert list(first.allocate("patients", 2)) == [1, 2]
+    assert list(second.allocate("patients", 3)) == [3, 4, 5]
+    assert list(first.allocate("billing")) == [1]
+    assert list(first.allocate("patients")) == [6]
+
+
+def test_concurrent_inserts_get_unique_ids(data_manager):
+    ids = []
+    ids_lock = threading.Lock()
+
+    def insert(n):
+        for i in range(n):
+            record_id = data_manager.add_record("patients", patient(f"Patient {i}"))
+            with ids_lock:
+                ids.append(record_id)
+
+    writers = [threading.Thread(target=insert, args=(10,)) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert sorted(ids) == list(range(1, 41))
+    assert sorted(data_manager.load_data("patients")["id"]) == sorted(ids)
+
+
+def test_records_are_found_by_primary_key_after_changes(data_manager):
+    for name in ["Alice", "Bob", "Carol"]:
+        data_manager.add_record("patients", patient(name))
+    data_manager.update_record("patients", 2, {"name": "Robert"})
+    data_manager.delete_record("patients", 1)
+
+    assert data_manager.get_record("patients", 2)["name"] == "Robert"
+    assert data_manager.get_record("patients", 1) is None
+    assert data_manager.get_record("patients", 3)["name"] == "Carol"
@@ -0,0 +1,85 @@
+import threading
+import time
+import pandas as pd
+
+
+def patient(name, age=40):
+    return {"name": name, "age": age, "gender": "Female", "contact": "0700000000", "medical_history": ""}
+
+
+def base_rows(data_manager, file):
+    storage = data_manager._storage(file)
+    return len(storage.read(storage.path(data_manager.data_dir, file)))
+
+
+def test_writes_go_to_the_journal_and_replay_over_the_base_file(data_manager):
+    first = data_manager.add_record("patients", patient("Alice"))
+    second = data_manager.add_record("patients", patient("Bob"))
+    third = data_manager.add_record("patients", patient("Carol"))
+    data_manager.update_record("patients", first, {"age": 31})
+    data_manager.delete_record("patients", second)
+
+    assert base_rows(data_manager, "patients") == 0
+    assert data_manager.journal_stats("patients")["rows"] == 5
+    df = data_manager.load_data("patients")
+    # The latest entry per id wins and rows keep the position they were added at
+    assert df["id"].tolist() == [first, third]
+    assert df["age"].tolist() == [31, 40]
+
+
+def test_compact_folds_the_journal_into_the_base_file(data_manager):
+    for name in ["Alice", "Bob", "Carol"]:
+        data_manager.add_record("patients", patient(name))
+    data_manager.delete_record("patients", 2)
+    before = data_manager.load_data("patients")
+
+    data_manager.compact("patients")
+
+    assert not data_manager._journal("patients").exists()
+    assert base_rows(data_manager, "patients") == 2
+    pd.testing.assert_frame_equal(data_manager.load_data("patients"), before, check_dtype=False)
+
+
+def test_journal_compacts_once_it_reaches_the_threshold(data_manager):
+    data_manager.compact_threshold = 3
+    for name in ["Alice", "Bob", "Carol", "Dan"]:
+        data_manager.add_record("patients", patient(name))
+    # Compaction runs on a background thread
+    while data_manager._journal("patients").compacting:
+        time.sleep(0.01)
+
+    assert data_manager.journal_stats("patients")["rows"] < 3
+    assert data_manager.load_data("patients")["name"].tolist() == ["Alice", "Bob", "Carol", "Dan"]
+
+
+def test_partial_line_from_an_interrupted_append_is_dropped(data_manager):
+    data_manager.add_record("patients", patient("Alice"))
+    journal = data_manager._journal("patients")
+    with open(journal.path, "a") as f:
+        f.write("2,Bob,4")
+
+    assert journal.row_count() == 1
+    with open(journal.path) as f:
+        assert f.read().endswith("\n")
+    assert data_manager.add_record("patients", patient("Carol")) == 2
+    assert data_manager.load_data("patients")["name"].tolist() == ["Alice", "Carol"]
+
+
+def test_group_commit_flushes_queued_appends_together(data_manager):
+    journal = data_manager._journal("patients")
+    # Seed the id sequence first; seeding reads the table, which waits for the lock
+    data_manager.next_id("patients")
+    writers = [threading.Thread(target=data_manager.add_record, args=("patients", patient(name)))
+               for name in ["Alice", "Bob", "Carol", "Dan"]]
+    # Writers queue while the lock is held; the first to get it writes every queued row
+    with journal.lock:
+        for writer in writers:
+            writer.start()
+        while len(journal._queue) < len(writers):
+            time.sleep(0.01)
+    for writer in writers:
+        writer.join()
+
+    assert journal.flushes == 1
+    assert journal.appended == 4
+    assert sorted(data_manager.load_data("patients")["name"]) == ["Alice", "Bob", "Carol", "Dan"]
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from utils.locking import TableLock, atomic_write
+
+
+def write_text(text):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write(text)
+    return write
+
+
+def test_atomic_write_replaces_the_file(tmp_path):
+    path = str(tmp_path / "table.csv")
+    atomic_write(path, write_text("old"))
+    atomic_write(path, write_text("new"))
+
+    with open(path) as f:
+        assert f.read() == "new"
+    assert os.listdir(tmp_path) == ["table.csv"]
+
+
+def test_failed_atomic_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path / "table.csv")
+    atomic_write(path, write_text("old"))
+
+    def fail(tmp_path):
+        write_text("half")(tmp_path)
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(path, fail)
+    with open(path) as f:
+        assert f.read() == "old"
+    # The temp file is removed too
+    assert os.listdir(tmp_path) == ["table.csv"]
+
+
+def test_table_lock_is_reentrant_and_excludes_other_locks_on_the_file(tmp_path):
+    # A second TableLock on the same file stands in for another process
+    path = str(tmp_path / "table.lock")
+    first, second = TableLock(path), TableLock(path)
+    acquired = threading.Event()
+
+    def take():
+        with second:
+            acquired.set()
+
+    with first:
+        with first:
+            thread = threading.Thread(target=take)
+            thread.start()
+            assert not acquired.wait(0.2)
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    thread.join()
+
+
+WRITER = """
+import sys
+from utils.data_manager import DataManager
+
+data_manager = DataManager(data_dir=sys.argv[1])
+for _ in range(int(sys.argv[3])):
+    data_manager.add_record("billing", {"patient_id": int(sys.argv[2]), "amount": 1.0, "date": "2026-01-01",
+                                        "status": "Pending"})
+"""
+
+
+def test_processes_writing_one_table_lose_no_rows(data_manager):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # A low threshold makes the writers compact while the others append
+    env = dict(os.environ, PYTHONPATH=root, HMS_JOURNAL_COMPACT_ROWS="25")
+    writers = [subprocess.Popen([sys.executable, "-c", WRITER, data_manager.data_dir, str(writer), "40"], env=env)
+               for writer in range(3)]
+    for writer in writers:
+        assert writer.wait(timeout=120) == 0
+
+    df = data_manager.load_data("billing")
+    assert len(df) == 120
+    assert df["id"].is_unique
+    assert df["patient_id"].value_counts().to_dict() == {0: 40, 1: 40, 2: 40}
@@ -0,0 +1,53 @@
+import os
+from utils.data_manager import DataManager
+
+
+def test_flat_appointments_file_is_split_into_monthly_partitions(tmp_path):
+    # An appointments table from before partitions, durations and versions, with journal rows pending
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "appointments.csv").write_text(
+        "id,patient_id,date,time,doctor,status\n"
+        "1,1,2026-01-05,09:00,Dr Grey,Scheduled\n"
+        "2,2,2026-02-10,10:00,Dr Grey,Scheduled\n"
+        "3,3,,11:00,Dr Yang,Scheduled\n"
+    )
+    (data_dir / "appointments.journal.csv").write_text(
+        "id,patient_id,date,time,doctor,status,_op\n"
+        "2,2,2026-02-10,10:30,Dr Grey,Scheduled,U\n"
+        "4,4,2026-02-11,09:00,Dr Yang,Scheduled,I\n"
+    )
+
+    data_manager = DataManager(data_dir=str(data_dir))
+
+    assert not os.path.exists(data_dir / "appointments.csv")
+    storage = data_manager._storage("appointments")
+    partitions = storage.partitions(storage.path(str(data_dir), "appointments"))
+    assert sorted(os.path.basename(path).split(".")[0] for path in partitions) == ["2026-01", "2026-02", "undated"]
+    df = data_manager.load_data("appointments").set_index("id").sort_index()
+    assert list(df.index) == [1, 2, 3, 4]
+    assert df.loc[2, "time"] == "10:30"
+    # Columns added since the file was written get their defaults
+    assert df["duration"].tolist() == [30] * 4
+    assert df.loc[1, "version"] == 0
+    assert data_manager.load_range("appointments", "2026-02-01", "2026-02-28")["id"].tolist() == [2, 4]
+
+
+def test_upgraded_table_takes_new_writes(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "appointments.csv").write_text("id,patient_id,date,time,doctor,status\n"
+                                               "1,1,2026-01-05,09:00,Dr Grey,Scheduled\n")
+    data_manager = DataManager(data_dir=str(data_dir))
+
+    appointment_id = data_manager.add_record("appointments", {
+        "patient_id": 2, "date": "2026-03-01", "time": "09:00", "duration": 45, "doctor": "Dr Grey",
+        "status": "Scheduled"})
+    data_manager.update_record("appointments", 1, {"status": "Completed"}, expected_version=0)
+    data_manager.compact("appointments")
+
+    # A second start finds the partitions in place and leaves them as they are
+    df = DataManager(data_dir=str(data_dir)).load_data("appointments").set_index("id")
+    assert appointment_id == 2
+    assert df.loc[1, "status"] == "Completed"
+    assert df.loc[2, "duration"] == 45
@@ -0,0 +1,35 @@
+import os
+import pytest
+from sqlalchemy import create_engine
+
+# database.py builds its engine from DATABASE_URL when imported; the SQLite
+# checks below use their own engine, so any URL does unless Postgres is configured
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from database import engine, migrate
+from utils.db_schema import HOT_QUERIES, check, explain
+
+# The hot queries of utils/db_schema.py must be planned with the index
+# declared for each. SQLite always runs; Postgres runs when DATABASE_URL
+# points at one.
+
+
+@pytest.fixture(scope="module")
+def sqlite_engine(tmp_path_factory):
+    sqlite = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'hms.db'}")
+    migrate(sqlite)
+    yield sqlite
+    sqlite.dispose()
+
+
+@pytest.mark.parametrize("description, index, build", HOT_QUERIES, ids=[query[0] for query in HOT_QUERIES])
+def test_sqlite_plan_uses_index(sqlite_engine, description, index, build):
+    with sqlite_engine.connect() as connection:
+        plan = explain(connection, build())
+    assert index in plan, f"{description} is not planned with {index}:\n{plan}"
+
+
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="DATABASE_URL is not a Postgres database")
+def test_postgres_plans_use_indexes():
+    unused = [f"{description}: {index}\n{plan}" for description, index, used, plan in check(engine) if not used]
+    assert not unused, "\n".join(unused)
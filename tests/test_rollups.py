@@ -0,0 +1,75 @@
+import threading
+import time
+import pandas as pd
+from utils.rollups import ROLLUPS, RollupStore
+
+
+def patient(name, gender, age):
+    return {"name": name, "age": age, "gender": gender, "contact": "0700000000", "medical_history": ""}
+
+
+def assert_rollups_match_tables(data_manager, tmp_path):
+    rebuilt = RollupStore(str(tmp_path / "rebuilt.json"))
+    rebuilt.rebuild(data_manager)
+    for name in [name for rollups in ROLLUPS.values() for name, _, _ in rollups]:
+        pd.testing.assert_series_equal(data_manager.rollups.series(name), rebuilt.series(name), check_names=False)
+
+
+def test_single_writes_update_rollups(data_manager, tmp_path):
+    first = data_manager.add_record("patients", patient("Alice", "Female", 30))
+    data_manager.add_record("patients", patient("Bob", "Male", 40))
+    data_manager.update_record("patients", first, {"gender": "Other"})
+    data_manager.add_records("billing", pd.DataFrame({
+        "patient_id": [1, 2], "amount": [10.0, 5.5], "date": ["2026-01-02", "2026-01-03"], "status": ["Paid", "Pending"]
+    }))
+    data_manager.delete_record("patients", first)
+    assert_rollups_match_tables(data_manager, tmp_path)
+
+
+def test_group_commit_with_bulk_append_keeps_every_writes_rollups(data_manager, tmp_path):
+    # Queue single and bulk appends while the table lock is held, so one flush commits them all
+    journal = data_manager._journal("patients")
+    # Seed the id sequence first; seeding reads the table, which waits for the lock
+    data_manager.next_id("patients")
+    bulk = pd.DataFrame([patient(f"Bulk {i}", "Male", 20 + i) for i in range(3)])
+    writers = [threading.Thread(target=data_manager.add_record, args=("patients", patient(f"Single {i}", "Female", 50)))
+               for i in range(3)]
+    writers.append(threading.Thread(target=data_manager.add_records, args=("patients", bulk)))
+    with journal.lock:
+        for writer in writers:
+            writer.start()
+        while len(journal._queue) < len(writers):
+            time.sleep(0.01)
+    for writer in writers:
+        writer.join()
+
+    assert journal.flushes == 1
+    assert len(data_manager.load_data("patients")) == 6
+    assert_rollups_match_tables(data_manager, tmp_path)
+    # The bulk rows weren't patched into the name index, so it is rebuilt with every row
+    assert sorted(data_manager.index_values("patients", "name")) == sorted(
+        [f"Single {i}" for i in range(3)] + [f"Bulk {i}" for i in range(3)])
+
+
+def test_concurrent_writers_keep_rollups_in_step(data_manager, tmp_path):
+    def bills(n, status):
+        return pd.DataFrame({"patient_id": range(n), "amount": [2.5] * n, "date": ["2026-02-01"] * n,
+                             "status": [status] * n})
+
+    def single_writer(i):
+        for j in range(10):
+            bill_id = data_manager.add_record("billing", {"patient_id": i, "amount": 1.0 + j, "date": "2026-02-02",
+                                                          "status": "Pending"})
+            if j % 3 == 0:
+                data_manager.update_record("billing", bill_id, {"status": "Paid"})
+
+    writers = [threading.Thread(target=single_writer, args=(i,)) for i in range(3)]
+    writers += [threading.Thread(target=data_manager.add_records, args=("billing", bills(5, status)))
+                for status in ["Paid", "Pending"]]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert len(data_manager.load_data("billing")) == 40
+    assert_rollups_match_tables(data_manager, tmp_path)
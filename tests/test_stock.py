@@ -0,0 +1,31 @@
+import pytest
+from utils.data_manager import StaleRecordError
+from utils.repository import DataRepository
+from utils.stock import Stock
+
+
+@pytest.fixture
+def stock(data_manager):
+    return Stock(*[DataRepository(entity, data_manager) for entity in ["inventory", "stock_movements", "stock_snapshots"]])
+
+
+def test_movement_losing_to_a_concurrent_write_is_reversed(stock, data_manager):
+    item_id = stock.inventory.add({"item": "Gloves", "quantity": 20, "reorder_level": 5, "category": "Supplies"})
+    stock.record(item_id, "dispense", 5)
+    get = stock.inventory.get
+
+    def get_then_change(record_id):
+        # Another process dispenses after the item was read here
+        item = get(record_id)
+        data_manager.update_record("inventory", record_id, {"quantity": 12})
+        return item
+
+    stock.inventory.get = get_then_change
+    with pytest.raises(StaleRecordError):
+        stock.record(item_id, "dispense", 4)
+
+    movements = stock.movements.find()
+    # Nothing is removed from the ledger: the lost movement is followed by its reversal
+    assert movements["quantity"].tolist() == [-5, -4, 4]
+    assert movements["kind"].tolist() == ["dispense"] * 3
+    assert stock.inventory.get(item_id)["quantity"] == 12
@@ -0,0 +1,55 @@
+import pytest
+from utils.data_manager import DataManager, StaleRecordError
+
+
+def bill(amount):
+    return {"patient_id": 1, "amount": amount, "date": "2026-01-01", "status": "Pending"}
+
+
+def test_writes_bump_the_row_version(data_manager):
+    bill_id = data_manager.add_record("billing", bill(10.0))
+    assert data_manager.get_record("billing", bill_id)["version"] == 1
+
+    data_manager.update_record("billing", bill_id, {"status": "Paid"}, expected_version=1)
+    data_manager.update_record("billing", bill_id, {"amount": 12.0})
+
+    assert data_manager.get_record("billing", bill_id)["version"] == 3
+
+
+def test_stale_update_is_rejected_and_leaves_the_row_alone(data_manager):
+    bill_id = data_manager.add_record("billing", bill(10.0))
+    # Counts are kept per table name for the whole process
+    before = data_manager.conflict_stats().get("billing", {"checked": 0, "conflicts": 0})
+    # Two users read version 1; the first to save wins
+    data_manager.update_record("billing", bill_id, {"status": "Paid"}, expected_version=1)
+
+    with pytest.raises(StaleRecordError) as error:
+        data_manager.update_record("billing", bill_id, {"status": "Cancelled"}, expected_version=1)
+
+    assert (error.value.expected_version, error.value.current_version) == (1, 2)
+    record = data_manager.get_record("billing", bill_id)
+    assert (record["status"], record["version"]) == ("Paid", 2)
+    after = data_manager.conflict_stats()["billing"]
+    assert (after["checked"] - before["checked"], after["conflicts"] - before["conflicts"]) == (2, 1)
+
+
+def test_stale_delete_is_rejected(data_manager):
+    bill_id = data_manager.add_record("billing", bill(10.0))
+    data_manager.update_record("billing", bill_id, {"amount": 11.0})
+
+    with pytest.raises(StaleRecordError):
+        data_manager.delete_record("billing", bill_id, expected_version=1)
+    assert data_manager.delete_record("billing", bill_id, expected_version=2)
+    assert data_manager.get_record("billing", bill_id) is None
+
+
+def test_rows_from_before_versions_count_as_version_zero(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "billing.csv").write_text("id,patient_id,amount,date,status\n1,1,10.0,2026-01-01,Pending\n")
+    data_manager = DataManager(data_dir=str(data_dir))
+
+    with pytest.raises(StaleRecordError):
+        data_manager.update_record("billing", 1, {"status": "Paid"}, expected_version=1)
+    data_manager.update_record("billing", 1, {"status": "Paid"}, expected_version=0)
+    assert data_manager.get_record("billing", 1)["version"] == 1
@@ -0,0 +1,233 @@
+import atexit
+import glob
+import gzip
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from utils.locking import TableLock
+
+# Audit entries are queued in memory and written by a background flusher in
+# batches: one file append and one database commit per batch instead of one
+# per user action. A batch is written once it reaches batch_size entries or
+# flush_seconds after its first entry, and everything queued is flushed on
+# shutdown.
+
+
+class FileSink:
+    # Appends "[timestamp] user: activity" lines and rotates the file into
+    # gzip archives when it grows past max_bytes or a rotation period ends
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, rotate_seconds=86400, backups=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        # Shared with other processes appending to and rotating the same file
+        self.lock = TableLock(f"{os.path.splitext(path)[0]}.lock")
+
+    def write(self, entries):
+        lines = "".join(f"[{entry['timestamp']}] {entry['username']}: {entry['activity']}\n" for entry in entries)
+        with self.lock:
+            self._maybe_rotate()
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _maybe_rotate(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        # Periods are aligned to the epoch, so daily rotation happens at midnight UTC
+        period_ended = self.rotate_seconds and \
+            int(stat.st_mtime // self.rotate_seconds) != int(time.time() // self.rotate_seconds)
+        if stat.st_size == 0 or not (period_ended or stat.st_size >= self.max_bytes):
+            return
+        base, extension = os.path.splitext(self.path)
+        stamp = datetime.fromtimestamp(stat.st_mtime).strftime("%Y%m%d-%H%M%S")
+        archive = f"{base}.{stamp}{extension}.gz"
+        suffix = 1
+        while os.path.exists(archive):
+            archive = f"{base}.{stamp}-{suffix}{extension}.gz"
+            suffix += 1
+        rotating = f"{self.path}.rotating"
+        os.replace(self.path, rotating)
+        with open(rotating, "rb") as source, gzip.open(archive, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotating)
+        for old in self.archives()[:-self.backups or None]:
+            os.remove(old)
+
+    def archives(self):
+        base, extension = os.path.splitext(self.path)
+        return sorted(glob.glob(f"{glob.escape(base)}.*{extension}.gz"), key=os.path.getmtime)
+
+
+class DatabaseSink:
+    # Inserts AuditLog rows in bulk with a single commit per batch
+    def write(self, entries):
+        from database import SessionLocal, AuditLog
+
+        session = SessionLocal()
+        try:
+            session.bulk_insert_mappings(AuditLog, entries)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+class AuditLogger:
+    def __init__(self, sinks, batch_size=200, flush_seconds=1.0, queue_size=10000):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # Bounded so a stalled sink slows writers down instead of growing memory forever
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Batches a sink failed to write, retried on the next flush
+        self._pending = {name: [] for name in sinks}
+        self._max_pending = batch_size * 50
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "errors": 0, "dropped": 0}
+        self._stats_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+    def log_activity(self, username, activity):
+        self._put("file", {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username,
+            "activity": activity
+        })
+
+    def log_event(self, user_id, action, details=None):
+        self._put("db", {
+            "user_id": user_id,
+            "action": action,
+            "details": details,
+            "timestamp": datetime.utcnow()
+        })
+
+    def _put(self, sink, entry):
+        if self._closed:
+            # Late entries during interpreter shutdown are written straight through
+            self._write({sink: [entry]})
+            return
+        self._ensure_started()
+        self._queue.put((sink, entry))
+        with self._stats_lock:
+            self._stats["queued"] += 1
+
+    def flush(self, timeout=None):
+        # Blocks until everything queued before this call has been written
+        if self._thread is None or not self._thread.is_alive():
+            self._drain()
+            return True
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def close(self):
+        self.flush(timeout=30)
+        self._closed = True
+        self._drain()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize() + sum(len(entries) for entries in self._pending.values())
+        return stats
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, waiters = {}, []
+            deadline = time.monotonic() + self.flush_seconds
+            count = 0
+            while True:
+                sink, entry = item
+                if sink is None:
+                    waiters.append(entry)
+                    break
+                batch.setdefault(sink, []).append(entry)
+                count += 1
+                if count >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _drain(self):
+        batch = {}
+        while True:
+            try:
+                sink, entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if sink is None:
+                entry.set()
+            else:
+                batch.setdefault(sink, []).append(entry)
+        self._write(batch)
+
+    def _write(self, batch):
+        with self._write_lock:
+            self._write_sinks(batch)
+
+    def _write_sinks(self, batch):
+        for name, sink in self.sinks.items():
+            entries = self._pending[name] + batch.get(name, [])
+            if not entries:
+                continue
+            try:
+                sink.write(entries)
+            except Exception as e:
+                dropped = max(len(entries) - self._max_pending, 0)
+                self._pending[name] = entries[dropped:]
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                    self._stats["dropped"] += dropped
+                print(f"Audit log: could not write {len(entries)} {name} entries: {e}", file=sys.stderr)
+                continue
+            self._pending[name] = []
+            with self._stats_lock:
+                self._stats["written"] += len(entries)
+                self._stats["batches"] += 1
+
+
+audit = AuditLogger(
+    {
+        "file": FileSink(
+            os.getenv("HMS_AUDIT_FILE", "audit_log.txt"),
+            max_bytes=int(os.getenv("HMS_AUDIT_MAX_MB", "10")) * 1024 * 1024,
+            rotate_seconds=int(os.getenv("HMS_AUDIT_ROTATE_SECONDS", "86400")),
+            backups=int(os.getenv("HMS_AUDIT_BACKUPS", "30"))
+        ),
+        "db": DatabaseSink()
+    },
+    batch_size=int(os.getenv("HMS_AUDIT_BATCH_SIZE", "200")),
+    flush_seconds=float(os.getenv("HMS_AUDIT_FLUSH_SECONDS", "1.0"))
+)
+atexit.register(audit.close)
@@ -1,8 +1,8 @@
 import streamlit as st
-import hashlib
 import json
 import os
-from datetime import datetime
+from utils import passwords
+from utils.audit import audit
 
 class Auth:
     def __init__(self):
@@ -10,7 +10,7 @@ class Auth:
         self.audit_file = "audit_log.txt"
         
     def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        return passwords.hash_password(password)
     
     def save_admin(self, username, password):
         admin_data = {
@@ -25,15 +25,20 @@ class Auth:
             return False
         with open(self.admin_file, "r") as f:
             admin_data = json.load(f)
-        return (admin_data["username"] == username and 
-                admin_data["password"] == self.hash_password(password))
+        # Always verify so a wrong username takes as long as a wrong password
+        valid, new_hash = passwords.verify_password(password, admin_data["password"])
+        if not (valid and admin_data["username"] == username):
+            return False
+        if new_hash:
+            # Upgrades legacy SHA-256 digests and hashes of an older cost
+            admin_data["password"] = new_hash
+            with open(self.admin_file, "w") as f:
+                json.dump(admin_data, f)
+        return True
     
     def log_activity(self, activity):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        username = st.session_state.get("username", "Unknown")
-        log_entry = f"[{timestamp}] {username}: {activity}\n"
-        with open(self.audit_file, "a") as f:
-            f.write(log_entry)
+        # Queued and appended to the audit file in batches by the audit flusher
+        audit.log_activity(st.session_state.get("username", "Unknown"), activity)
             
     def admin_exists(self):
         return os.path.exists(self.admin_file)
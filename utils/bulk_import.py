@@ -0,0 +1,191 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+from datetime import date, datetime
+from utils.data_manager import DataManager
+
+# Streams legacy records into the CSV store or the SQL database in chunks,
+# so onboarding a ward is one command instead of one form submission per row.
+# Run with: python -m utils.bulk_import patients legacy_patients.csv [--db]
+#
+# Imported inventory quantities are taken into the stock ledger with one
+# snapshot once the rows are in, rather than a receipt per item. Imported
+# appointments are checked against the schedule and each other; any that
+# would double-book a doctor are left out and written to a conflicts file.
+
+# Columns assigned by the importer rather than read from the source file
+GENERATED_COLUMNS = ["id", "version", "created_at"]
+
+
+def required_columns(table, db=False):
+    if db:
+        # Columns the database fills in (e.g. appointments.duration) may be left out
+        columns = db_model(table).__table__.columns
+        return [column.name for column in columns if not column.nullable and column.name not in GENERATED_COLUMNS
+                and column.default is None and column.server_default is None]
+    return [column for column in DataManager.SCHEMAS[table]
+            if column not in GENERATED_COLUMNS and column not in DataManager.COLUMN_DEFAULTS]
+
+
+def allowed_columns(table, db=False):
+    if db:
+        return [column.name for column in db_model(table).__table__.columns if column.name not in GENERATED_COLUMNS]
+    return [column for column in DataManager.SCHEMAS[table] if column not in GENERATED_COLUMNS]
+
+
+def db_model(table):
+    from database import Patient, Appointment, Inventory, StaffMember, Bill
+
+    models = {
+        "patients": Patient,
+        "appointments": Appointment,
+        "inventory": Inventory,
+        "staff": StaffMember,
+        "billing": Bill
+    }
+    if table not in models:
+        raise ValueError(f"No database model for table: {table}")
+    return models[table]
+
+
+def adopt_stock(db, data_manager=None):
+    from utils.repository import DataRepository
+    from utils.stock import Stock, get_stock
+
+    if db:
+        return get_stock("sql").adopt()
+    return Stock(*(DataRepository(entity, data_manager)
+                   for entity in ["inventory", "stock_movements", "stock_snapshots"])).adopt()
+
+
+def appointment_schedule(db, data_manager=None):
+    # A private schedule index for checking imported appointments with fit_batch
+    from utils.repository import DataRepository, get_repository
+    from utils.scheduling import Scheduler
+
+    repository = get_repository("appointments", "sql") if db else DataRepository("appointments", data_manager)
+    return Scheduler(repository).index()
+
+
+def fits_schedule(schedule, chunk, db=False):
+    from utils.scheduling import fit_batch
+
+    if db:
+        starts = chunk["appointment_date"]
+    else:
+        starts = chunk["date"].astype(str) + " " + chunk["time"].astype(str)
+    missing = pd.Series(None, index=chunk.index)
+    fits = fit_batch(schedule, chunk.get("doctor", missing), starts, chunk.get("duration", missing),
+                     chunk.get("status", missing))
+    return pd.Series(fits, index=chunk.index)
+
+
+def validate_columns(table, columns, db=False):
+    missing = [column for column in required_columns(table, db) if column not in columns]
+    if missing:
+        raise ValueError(f"Source file is missing required columns for {table}: {', '.join(missing)}")
+    return [column for column in columns if column not in allowed_columns(table, db)]
+
+
+def import_file(table, source, chunksize=10000, db=False, data_dir="data", progress=None, conflicts_file=None):
+    # Only read the header up front so column errors surface before anything is written
+    header = pd.read_csv(source, nrows=0).columns.tolist()
+    ignored = validate_columns(table, header, db)
+    usecols = [column for column in header if column not in ignored]
+
+    if db:
+        from database import SessionLocal
+        session = SessionLocal()
+        model = db_model(table)
+        datetime_columns = [column.name for column in model.__table__.columns
+                            if column.name in usecols and column.type.python_type is datetime]
+        date_columns = [column.name for column in model.__table__.columns
+                        if column.name in usecols and column.type.python_type is date]
+    else:
+        data_manager = DataManager(data_dir=data_dir)
+    if table == "appointments":
+        schedule = appointment_schedule(db, None if db else data_manager)
+
+    total = 0
+    conflicts = 0
+    started = time.perf_counter()
+    try:
+        for chunk in pd.read_csv(source, usecols=usecols, chunksize=chunksize):
+            if table == "appointments":
+                fits = fits_schedule(schedule, chunk, db)
+                if not fits.all():
+                    if conflicts_file:
+                        chunk[~fits].to_csv(conflicts_file, mode="a", header=not conflicts, index=False)
+                    conflicts += int((~fits).sum())
+                    chunk = chunk[fits]
+            if db:
+                for column in datetime_columns:
+                    chunk[column] = pd.to_datetime(chunk[column])
+                for column in date_columns:
+                    chunk[column] = pd.to_datetime(chunk[column]).dt.date
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+                session.bulk_insert_mappings(model, chunk.to_dict("records"))
+                session.commit()
+            else:
+                data_manager.add_records(table, chunk)
+            total += len(chunk)
+            if progress:
+                progress(total, time.perf_counter() - started)
+    finally:
+        if db:
+            session.close()
+            # Bulk inserts skip the session events that keep dashboard metrics fresh
+            from utils import metrics
+            metrics.invalidate()
+
+    if table == "inventory":
+        adopt_stock(db, None if db else data_manager)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": total,
+        "seconds": elapsed,
+        "rows_per_second": total / elapsed if elapsed else 0.0,
+        "ignored_columns": ignored,
+        "conflicts": conflicts
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import legacy records")
+    parser.add_argument("table", choices=["patients", "staff", "inventory", "appointments", "billing"])
+    parser.add_argument("source", help="CSV file to import")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--db", action="store_true", help="Import into the SQL database instead of the CSV store")
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args()
+
+    def progress(rows, elapsed):
+        print(f"{rows} rows imported ({rows / elapsed:,.0f} rows/sec)", file=sys.stderr)
+
+    if args.db:
+        # Legacy data is often imported into a database the app hasn't started on yet
+        from database import migrate
+        migrate()
+
+    conflicts_file = f"{os.path.splitext(args.source)[0]}.conflicts.csv"
+    if os.path.exists(conflicts_file):
+        os.remove(conflicts_file)
+    try:
+        result = import_file(args.table, args.source, args.chunksize, args.db, args.data_dir, progress,
+                             conflicts_file)
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    if result["ignored_columns"]:
+        print(f"Ignored unknown columns: {', '.join(result['ignored_columns'])}")
+    if result["conflicts"]:
+        print(f"Left out {result['conflicts']} appointments that would double-book a doctor, see {conflicts_file}")
+    print(f"Imported {result['rows']} {args.table} rows in {result['seconds']:.2f}s "
+          f"({result['rows_per_second']:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
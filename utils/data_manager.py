@@ -1,47 +1,482 @@
+import numpy as np
 import pandas as pd
 import os
+import threading
 from datetime import datetime
+from utils.id_allocator import IdAllocator
+from utils.indexes import SecondaryIndex
+from utils.journal import TableJournal
+from utils.rollups import RollupStore
+from utils.storage import PartitionedBackend, get_backend
+from utils.table_cache import table_cache
+
+# Journals, allocators and indexes are shared process-wide so every DataManager
+# serializes on the same locks and sees the same index state
+_journals = {}
+_allocators = {}
+_indexes = {}
+_rollups = {}
+_conflicts = {}
+_listeners = {}
+_registry_lock = threading.Lock()
+
+
+class StaleRecordError(Exception):
+    # Raised when a write carries a row version that is no longer current
+    def __init__(self, file, record_id, expected_version, current_version):
+        super().__init__(
+            f"{file} record {record_id} is at version {current_version}, expected {expected_version}"
+        )
+        self.file = file
+        self.record_id = record_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
 
 class DataManager:
-    def __init__(self):
-        self.data_dir = "data"
+    SCHEMAS = {
+        "patients": ["id", "name", "age", "gender", "contact", "address", "medical_history", "version"],
+        "appointments": ["id", "patient_id", "date", "time", "duration", "doctor", "status", "version"],
+        "inventory": ["id", "item", "quantity", "reorder_level", "category", "last_updated", "version"],
+        "staff": ["id", "name", "role", "contact", "schedule", "version"],
+        "billing": ["id", "patient_id", "amount", "date", "status", "version"],
+        "stock_movements": ["id", "item_id", "kind", "quantity", "reason", "user", "timestamp", "version"],
+        "stock_snapshots": ["id", "through_movement", "item_id", "quantity", "taken_at", "version"],
+        "stock_forecasts": ["id", "daily_usage", "usage_std", "days_of_supply", "safety_stock", "reorder_point",
+                            "suggested_order", "computed_at", "version"],
+        "patient_duplicates": ["id", "patient_id", "duplicate_id", "score", "name_similarity", "same_contact",
+                               "found_at", "version"]
+    }
+
+    # Defaults for columns added to tables created before the column existed;
+    # bulk imports may leave these columns out
+    COLUMN_DEFAULTS = {
+        "version": 0,
+        "duration": 30,
+        "reorder_level": 10,
+        "address": None
+    }
+
+    # Secondary indexes kept up to date on every write; lookups on "id" use the primary key
+    INDEXES = {
+        "patients": ["name"],
+        "appointments": ["patient_id", "date"],
+        "billing": ["patient_id", "status"],
+        "stock_movements": ["item_id"],
+        "stock_snapshots": ["through_movement"]
+    }
+
+    # Tables stored as one file per month of a date column, see PartitionedBackend.
+    # Date-range reads through load_range() only open the months they need.
+    PARTITIONS = {
+        "appointments": "date"
+    }
+
+    def __init__(self, backend=None, data_dir="data"):
+        self.data_dir = data_dir
+        self.backend = get_backend(backend)
+        self._storages = {
+            file: PartitionedBackend(self.backend, column) for file, column in self.PARTITIONS.items()
+        }
+        self.compact_threshold = int(os.getenv("HMS_JOURNAL_COMPACT_ROWS", "1000"))
         self.initialize_data_files()
+        with _registry_lock:
+            self.rollups = _rollups.setdefault(data_dir, RollupStore(f"{data_dir}/rollups.json"))
+        if not self.rollups.exists():
+            self.rollups.rebuild(self)
         
     def initialize_data_files(self):
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
-            
-        files = {
-            "patients": ["id", "name", "age", "gender", "contact", "medical_history"],
-            "appointments": ["id", "patient_id", "date", "time", "doctor", "status"],
-            "inventory": ["id", "item", "quantity", "category", "last_updated"],
-            "staff": ["id", "name", "role", "contact", "schedule"],
-            "billing": ["id", "patient_id", "amount", "date", "status"]
-        }
-        
-        for file, columns in files.items():
-            filepath = f"{self.data_dir}/{file}.csv"
+
+        for file, columns in self.SCHEMAS.items():
+            storage = self._storage(file)
+            filepath = storage.path(self.data_dir, file)
             if not os.path.exists(filepath):
-                df = pd.DataFrame(columns=columns)
-                df.to_csv(filepath, index=False)
+                self._create_table(file, columns)
+            # Also after creating it: a table split from a flat file keeps that file's columns
+            if set(columns) - set(storage.columns(filepath)):
+                self._add_missing_columns(file, columns)
+
+    def _storage(self, file):
+        return self._storages.get(file, self.backend)
+
+    def _create_table(self, file, columns):
+        storage = self._storage(file)
+        flat_path = self.backend.path(self.data_dir, file)
+        if storage is self.backend or not os.path.exists(flat_path):
+            storage.write(storage.path(self.data_dir, file), pd.DataFrame(columns=columns))
+            return
+        # A table from before partitioning: split the base file, the journal carries over as is
+        journal = self._journal(file)
+        with journal.lock:
+            if not os.path.exists(storage.path(self.data_dir, file)):
+                df = self.backend.read(flat_path)
+                storage.write(storage.path(self.data_dir, file), df)
+                os.remove(flat_path)
+            # Pending journal rows keep the column order of the flat file
+            journal.columns = storage.columns(storage.path(self.data_dir, file))
+
+    def _add_missing_columns(self, file, columns):
+        with self._journal(file).lock:
+            df = self.load_data(file)
+            missing = [column for column in columns if column not in df.columns]
+            if not missing:
+                return
+            for column in missing:
+                df[column] = self.COLUMN_DEFAULTS.get(column)
+            self.save_data(file, df)
                 
-    def load_data(self, file):
-        return pd.read_csv(f"{self.data_dir}/{file}.csv")
+    def load_data(self, file, columns=None):
+        # Hand out a copy so callers can't mutate the shared cached frame
+        return self._load_table(file, columns).copy()
+
+    def _signature(self, file):
+        filepath = self._storage(file).path(self.data_dir, file)
+        return (table_cache.signature(filepath), table_cache.signature(self._journal(file).path))
+
+    def _load_table(self, file, columns=None):
+        return self._snapshot(file, columns)[1]
+
+    def _snapshot(self, file, columns=None):
+        # Returns the merged frame together with the table signature it reflects
+        storage = self._storage(file)
+        filepath = storage.path(self.data_dir, file)
+        merged_key = self._cache_key(f"{filepath}+journal", columns)
+        signature = self._signature(file)
+        df = table_cache.get(merged_key, signature)
+        if df is not None:
+            return signature, df
+
+        journal = self._journal(file)
+        # Read under the table lock so a concurrent append can't be half-read
+        with journal.lock:
+            signature = self._signature(file)
+            # The id column is always read so journal rows can be matched to base rows
+            read_columns = None if columns is None else list(dict.fromkeys(["id"] + list(columns)))
+            base = self._read_cached(filepath, read_columns, storage.read)
+            if signature[1] is None:
+                df = base
+            else:
+                changes = self._read_cached(journal.path, read_columns, _read_journal)
+                df = _replay(base, changes)
+            if columns is not None:
+                df = df[list(columns)]
+            table_cache.put(merged_key, signature, df)
+            return signature, df
+
+    def load_range(self, file, start=None, end=None, columns=None):
+        # Rows of a partitioned table whose partition column is within [start, end]
+        # ("YYYY-MM-DD", inclusive), reading only the partitions that can hold them
+        storage = self._storage(file)
+        column = self.PARTITIONS[file]
+        filepath = storage.path(self.data_dir, file)
+        key = self._cache_key(f"{filepath}+journal[{start}:{end}]", columns)
+        signature = self._signature(file)
+        df = table_cache.get(key, signature)
+        if df is not None:
+            return df
+
+        journal = self._journal(file)
+        with journal.lock:
+            signature = self._signature(file)
+            read_columns = None if columns is None else list(dict.fromkeys(["id", column] + list(columns)))
+            base = storage.read(filepath, read_columns, start, end)
+            if signature[1] is None:
+                df = base
+            else:
+                # The whole journal is replayed: a change may have moved a row into or out of the range
+                df = _replay(base, self._read_cached(journal.path, read_columns, _read_journal))
+            days = df[column].astype(str).str[:10]
+            mask = df[column].notna()
+            if start is not None:
+                mask &= days >= start
+            if end is not None:
+                mask &= days <= end
+            df = df[mask].reset_index(drop=True)
+            if columns is not None:
+                df = df[list(columns)]
+            table_cache.put(key, signature, df)
+            return df
+
+    def iter_chunks(self, file, columns=None, chunksize=50000, start=None, end=None):
+        # Streams the merged table for exports without caching or materializing it.
+        # Only the journal is read whole; rows it changed follow the base rows.
+        # start/end skip partitions outside the range; rows are not filtered by them.
+        storage = self._storage(file)
+        filepath = storage.path(self.data_dir, file)
+        journal = self._journal(file)
+        read_columns = None if columns is None else list(dict.fromkeys(["id"] + list(columns)))
+        with journal.lock:
+            # Every base file is opened under the lock, so a compaction swapping in
+            # new files once it is released can't change what is read
+            if storage is self.backend:
+                readers = [storage.read_chunks(filepath, read_columns, chunksize)]
+            else:
+                readers = [storage.backend.read_chunks(partition, read_columns, chunksize)
+                           for partition in storage.partitions(filepath, start, end)]
+            changes = _read_journal(journal.path, read_columns) if journal.exists() else None
+        return self._merge_chunks(file, readers, changes, columns)
+
+    def _merge_chunks(self, file, readers, changes, columns):
+        changed_ids = None
+        if changes is not None and not changes.empty:
+            changes = changes.drop_duplicates("id", keep="last")
+            changed_ids = changes["id"]
+            changes = changes[changes["_op"] != "D"].drop(columns="_op")
+        empty = True
+        for chunk in (chunk for reader in readers for chunk in reader):
+            if changed_ids is not None:
+                chunk = chunk[~chunk["id"].isin(changed_ids)]
+            empty = False
+            yield chunk if columns is None else chunk[list(columns)]
+        if changed_ids is not None and not changes.empty:
+            yield changes if columns is None else changes[list(columns)]
+        elif empty:
+            yield pd.DataFrame(columns=columns if columns is not None else self.SCHEMAS[file])
+
+    def _read_cached(self, path, columns, reader):
+        key = self._cache_key(path, columns)
+        signature = table_cache.signature(path)
+        df = table_cache.get(key, signature)
+        if df is None:
+            df = reader(path, columns)
+            table_cache.put(key, signature, df)
+        return df
+
+    def _cache_key(self, path, columns):
+        if columns is None:
+            return path
+        return f"{path}[{','.join(columns)}]"
+
+    def _journal(self, file):
+        path = f"{self.data_dir}/{file}.journal.csv"
+        with _registry_lock:
+            journal = _journals.get(path)
+            if journal is None:
+                storage = self._storage(file)
+                filepath = storage.path(self.data_dir, file)
+                # A partitioned table being created from a flat file has no manifest yet
+                columns = storage.columns(filepath) if os.path.exists(filepath) else self.SCHEMAS[file]
+                journal = TableJournal(path, columns)
+                _journals[path] = journal
+            journal.on_commit = lambda batch, write: self._commit(file, batch, write)
+            return journal
     
     def save_data(self, file, data):
-        data.to_csv(f"{self.data_dir}/{file}.csv", index=False)
+        storage = self._storage(file)
+        filepath = storage.path(self.data_dir, file)
+        journal = self._journal(file)
+        with journal.lock:
+            storage.write(filepath, data)
+            journal.clear()
+            journal.columns = list(data.columns)
+            table_cache.bump(filepath)
+            table_cache.bump(journal.path)
+
+    def compact(self, file):
+        # Fold the journal back into the base file
+        journal = self._journal(file)
+        with journal.lock:
+            if journal.row_count() == 0:
+                return
+            self.save_data(file, self._load_table(file))
+
+    def cache_stats(self):
+        return table_cache.stats()
+
+    def conflict_stats(self):
+        with _registry_lock:
+            return {file: dict(counts) for file, counts in _conflicts.items()}
+
+    def _check_version(self, file, record_id, current, expected_version):
+        current_version = _version(current.get("version"))
+        if expected_version is None:
+            return current_version
+        with _registry_lock:
+            counts = _conflicts.setdefault(file, {"checked": 0, "conflicts": 0})
+            counts["checked"] += 1
+            stale = _version(expected_version) != current_version
+            if stale:
+                counts["conflicts"] += 1
+        if stale:
+            raise StaleRecordError(file, record_id, expected_version, current_version)
+        return current_version
+
+    def journal_stats(self, file):
+        journal = self._journal(file)
+        return {
+            "rows": journal.row_count(),
+            "appended": journal.appended,
+            "flushes": journal.flushes
+        }
+        
+    def next_id(self, file, count=1):
+        ids = self._allocate_ids(file, count)
+        return ids[0] if count == 1 else ids
+
+    def _allocate_ids(self, file, count):
+        with _registry_lock:
+            allocator = _allocators.get(self.data_dir)
+            if allocator is None:
+                allocator = IdAllocator(f"{self.data_dir}/sequences.json")
+                _allocators[self.data_dir] = allocator
+        return allocator.allocate(file, count, lambda: self._load_table(file, ["id"])["id"].tolist())
+
+    def _primary_key(self, file):
+        # id -> row position in the merged frame, rebuilt once per table version
+        signature, df = self._snapshot(file)
+        key = f"{self._storage(file).path(self.data_dir, file)}#pk"
+        index = table_cache.get(key, signature)
+        if index is None:
+            index = pd.Index(df["id"])
+            table_cache.put(key, signature, index, nbytes=index.memory_usage(deep=True))
+        return df, index
+
+    def _index(self, file, column):
+        key = (self._storage(file).path(self.data_dir, file), column)
+        with _registry_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = SecondaryIndex(column)
+                _indexes[key] = index
+        with index.lock:
+            if index.signature != self._signature(file):
+                signature, df = self._snapshot(file, ["id", column])
+                index.rebuild(df, signature)
+        return index
+
+    def lookup_ids(self, file, column, value):
+        if column == "id":
+            return [value] if value in self._primary_key(file)[1] else []
+        return self._index(file, column).ids(value)
+
+    def lookup(self, file, column, value):
+        # Rows whose column equals value, found through the indexes instead of a scan
+        return self.lookup_all(file, column, [value])
+
+    def lookup_all(self, file, column, values):
+        # Rows whose column equals any of values
+        ids = [record_id for value in values for record_id in self.lookup_ids(file, column, value)]
+        df, index = self._primary_key(file)
+        positions = index.get_indexer(ids)
+        return df.iloc[positions[positions >= 0]].copy()
+
+    def index_values(self, file, column):
+        return self._index(file, column).values()
+
+    def _commit(self, file, batch, write):
+        # Runs under the table lock with the changes of each journal entry in a group
+        # commit. Rollups take every entry's changes; bulk entries (None) apply their own.
+        # Indexes current before this write are patched unless a bulk entry is in it;
+        # stale ones are rebuilt on their next use.
+        signature = self._signature(file)
+        write()
+        self.rollups.apply(file, [change for changes in batch if changes is not None for change in changes])
+        if any(changes is None for changes in batch):
+            return
+        changes = [change for changes in batch for change in changes]
+        new_signature = self._signature(file)
+        for column in self.INDEXES.get(file, []):
+            index = _indexes.get((self._storage(file).path(self.data_dir, file), column))
+            if index is None:
+                continue
+            with index.lock:
+                if index.signature == signature:
+                    for before, after in changes:
+                        index.apply(before, after)
+                    index.signature = new_signature
+        for listener in _listeners.get((self.data_dir, file), []):
+            listener(signature, changes, new_signature)
+
+    def subscribe(self, file, listener):
+        # listener(signature, changes, new_signature) is called under the table lock
+        # after each write that lists its changes; bulk writes only change the signature
+        with _registry_lock:
+            _listeners.setdefault((self.data_dir, file), []).append(listener)
+
+    def get_record(self, file, record_id):
+        df, index = self._primary_key(file)
+        if record_id not in index:
+            return None
+        return df.iloc[index.get_loc(record_id)].to_dict()
         
     def add_record(self, file, record):
-        df = self.load_data(file)
-        df = df.append(record, ignore_index=True)
-        self.save_data(file, df)
+        record = dict(record)
+        if pd.isna(record.get("id")):
+            record["id"] = self.next_id(file)
+        record["version"] = 1
+        self._append(file, [record], "I", [(None, record)])
+        return record["id"]
+
+    def add_records(self, file, records):
+        # Bulk insert a DataFrame: one id allocation and one journal append for all rows
+        if records.empty:
+            return records
+        ids = self._allocate_ids(file, len(records))
+        records = records.assign(id=np.arange(ids.start, ids.stop), version=1)
+        self._append(file, records, "I", None)
+        self.rollups.apply_frame(file, records)
+        return records
+
+    def _append(self, file, records, op, changes):
+        journal = self._journal(file)
+        rows = journal.append(records, op, changes)
+        if rows >= self.compact_threshold and not journal.compacting:
+            journal.compacting = True
+            threading.Thread(target=self._background_compact, args=(file,), daemon=True).start()
+
+    def _background_compact(self, file):
+        journal = self._journal(file)
+        try:
+            self.compact(file)
+        finally:
+            journal.compacting = False
         
-    def update_record(self, file, record_id, record):
-        df = self.load_data(file)
-        df.loc[df['id'] == record_id] = record
-        self.save_data(file, df)
+    def update_record(self, file, record_id, record, expected_version=None):
+        # Pass the version the caller read to reject the write if the row changed since
+        with self._journal(file).lock:
+            current = self.get_record(file, record_id)
+            if current is None:
+                return False
+            current_version = self._check_version(file, record_id, current, expected_version)
+            updated = dict(current)
+            updated.update({column: value for column, value in dict(record).items() if column in current})
+            updated["id"] = record_id
+            updated["version"] = current_version + 1
+            self._append(file, [updated], "U", [(current, updated)])
+            return True
         
-    def delete_record(self, file, record_id):
-        df = self.load_data(file)
-        df = df[df['id'] != record_id]
-        self.save_data(file, df)
+    def delete_record(self, file, record_id, expected_version=None):
+        with self._journal(file).lock:
+            current = self.get_record(file, record_id)
+            if current is None:
+                return False
+            self._check_version(file, record_id, current, expected_version)
+            # Tombstones carry the last row values so replay never introduces NaNs
+            self._append(file, [current], "D", [(current, None)])
+            return True
+
+
+def _version(value):
+    if value is None or pd.isna(value):
+        return 0
+    return int(value)
+
+
+def _read_journal(path, columns):
+    return pd.read_csv(path, usecols=None if columns is None else columns + ["_op"])
+
+
+def _replay(base, changes):
+    # The latest journal entry per id wins, which also makes an interrupted
+    # compaction harmless. Rows keep the position where their id first appeared.
+    frames = [frame for frame in (base, changes) if not frame.empty] or [base]
+    combined = pd.concat(frames, ignore_index=True)
+    if "_op" not in combined:
+        return combined
+    first_seen = combined.groupby("id", sort=False).ngroup().to_numpy()
+    latest = combined.drop_duplicates("id", keep="last")
+    latest = latest.iloc[np.argsort(first_seen[latest.index.to_numpy()], kind="stable")]
+    latest = latest[latest["_op"] != "D"].drop(columns="_op")
+    return latest.reset_index(drop=True)
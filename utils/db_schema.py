@@ -0,0 +1,87 @@
+import argparse
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, text
+from database import engine, migrate, Appointment, AuditLog, Inventory
+from utils.metrics import KPIS
+
+# Schema maintenance for the SQL database.
+#   python -m utils.db_schema migrate   create missing tables and apply pending migrations
+#   python -m utils.db_schema explain   check the hot queries use their indexes
+#
+# The explain check compiles each query below for the connected database,
+# asks the planner for its plan and fails unless the expected index shows
+# up in it. Postgres is told to avoid sequential scans first, so the check
+# doesn't depend on table sizes. tests/test_query_plans.py runs the same
+# check under pytest.
+
+def _day():
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today, today + timedelta(days=1)
+
+# (description, expected index, statement builder)
+HOT_QUERIES = [
+    ("Today's appointments", "ix_appointments_appointment_date", lambda: select(func.count(Appointment.id)).where(
+        Appointment.appointment_date >= _day()[0], Appointment.appointment_date < _day()[1])),
+    ("Appointments for a patient", "ix_appointments_patient_id",
+     lambda: select(Appointment.id).where(Appointment.patient_id == 1)),
+    ("A doctor's appointments on a day", "ix_appointments_doctor_id_date", lambda: select(Appointment.id).where(
+        Appointment.doctor_id == 1, Appointment.appointment_date >= _day()[0],
+        Appointment.appointment_date < _day()[1])),
+    ("Audit log, newest first", "ix_audit_logs_timestamp_id", lambda: select(AuditLog.id).order_by(
+        AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(50)),
+    ("Audit log for a user", "ix_audit_logs_user_timestamp_id", lambda: select(AuditLog.id).where(
+        AuditLog.user_id == 1).order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(50)),
+    ("Audit log for an action", "ix_audit_logs_action_timestamp_id", lambda: select(AuditLog.id).where(
+        AuditLog.action == "Logged in").order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(50)),
+    # The dashboard's low stock KPI, as it is sent
+    ("Low stock items", "ix_inventory_stock_margin", lambda: KPIS["low_stock_items"]["statement"](Inventory)),
+]
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        return "\n".join(row[-1] for row in rows)
+    if connection.dialect.name == "postgresql":
+        rows = connection.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        return json.dumps(rows if not isinstance(rows, str) else json.loads(rows))
+    raise ValueError(f"EXPLAIN check not supported for {connection.dialect.name}")
+
+
+def check(bind=None):
+    results = []
+    with (bind or engine).connect() as connection:
+        with connection.begin() as transaction:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SET LOCAL enable_seqscan = off"))
+            for description, index, build in HOT_QUERIES:
+                plan = explain(connection, build())
+                results.append((description, index, index in plan, plan))
+            transaction.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the database schema or check query plans")
+    parser.add_argument("command", choices=["migrate", "explain"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        applied = migrate()
+        print(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Schema is up to date")
+        return
+
+    failed = 0
+    for description, index, used, plan in check():
+        print(f"{'ok  ' if used else 'FAIL'} {description}: {index}")
+        if not used:
+            failed += 1
+            print("     " + plan.replace("\n", "\n     "))
+    if failed:
+        parser.exit(1, f"{failed} queries do not use their index\n")
+
+
+if __name__ == "__main__":
+    main()
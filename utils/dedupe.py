@@ -0,0 +1,265 @@
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utils.repository import get_repository
+
+# Offline duplicate-patient detection. Comparing every pair of patients is
+# out of reach for a large registry, so candidates are blocked first: two
+# patients are only compared if they share a blocking key, and within a
+# block only with their WINDOW nearest neighbours by name. The keys are
+#   - the soundex codes of the first and last names, in either order,
+#   - the last 9 digits of the contact number (so +254 7.. and 07.. agree),
+#   - the soundex of either name together with the age.
+#
+# Pairs are scored in bulk with numpy. Names are compared as sets of
+# character trigrams, word order ignored. The score is the weighted share
+# of the evidence that agrees: the name similarity, the contact number and
+# an age within a year, leaving out fields either patient lacks. A
+# conflicting gender halves it. Each pass is split by key into partitions
+# that are scored on a process pool.
+#
+# Results replace the patient_duplicates table, best first, for review on
+# the Patients page. merge() folds one patient into another and re-points
+# their appointments and bills.
+
+WORKERS = int(os.getenv("HMS_DEDUPE_WORKERS", str(os.cpu_count() or 1)))
+# Neighbours by name each patient is compared with inside a block
+WINDOW = int(os.getenv("HMS_DEDUPE_WINDOW", "5"))
+# Least score for a pair to be reported
+THRESHOLD = float(os.getenv("HMS_DEDUPE_THRESHOLD", "0.7"))
+# Weights of the name similarity, a matching contact and a close age
+NAME_WEIGHT, CONTACT_WEIGHT, AGE_WEIGHT = 0.6, 0.25, 0.15
+# Names are compared on their first NAME_WIDTH characters
+NAME_WIDTH = 24
+# Blocking passes: each compares patients sharing a value of any of its keys
+PASSES = [["name_key"], ["contact_key"], ["first_age_key", "last_age_key"]]
+
+COLUMNS = ["id", "patient_id", "duplicate_id", "score", "name_similarity", "same_contact", "found_at"]
+# Blank fields of the kept patient are filled from the duplicate
+FILL_COLUMNS = ["age", "gender", "contact", "address"]
+
+_SOUNDEX = str.maketrans("bfpvcgjkqsxzdtlmnr", "111122222222334556")
+
+
+def soundex(word):
+    word = re.sub(r"[^a-z]", "", str(word).lower())
+    if not word:
+        return ""
+    last = word[0].translate(_SOUNDEX)
+    digits = []
+    for char in word[1:]:
+        code = char.translate(_SOUNDEX)
+        if code.isdigit():
+            if code != last:
+                digits.append(code)
+            last = code
+        elif char not in "hw":
+            # A vowel separates two letters with the same code; h and w don't
+            last = ""
+    return (word[0] + "".join(digits) + "000")[:4].upper()
+
+
+def prepare(patients):
+    # Normalized fields and blocking keys, one row per patient
+    words = patients["name"].fillna("").astype(str).str.lower().str.findall(r"[a-z]+")
+    first, last = words.str[0].fillna(""), words.str[-1].fillna("")
+    # Far fewer distinct words than patients
+    words_used = pd.unique(pd.concat([first, last]))
+    codes = dict(zip(words_used, map(soundex, words_used)))
+    contact = patients["contact"].astype(object).where(patients["contact"].notna(), "").astype(str)
+    contact = contact.str.replace(r"\D", "", regex=True).str[-9:]
+    age = pd.to_numeric(patients["age"], errors="coerce")
+    prepared = pd.DataFrame({
+        "id": patients["id"].to_numpy(),
+        "name": words.map(lambda name: " ".join(sorted(name))),
+        "contact": contact.to_numpy(),
+        "age": age.to_numpy(),
+        "gender": patients["gender"].fillna("").astype(str).str.lower().to_numpy()
+    })
+    first_code, last_code = first.map(codes), last.map(codes)
+    prepared["name_key"] = np.where(first_code < last_code, first_code + "/" + last_code,
+                                    last_code + "/" + first_code)
+    prepared["name_key"] = prepared["name_key"].where(first.to_numpy() != "", "")
+    prepared["contact_key"] = contact.where(contact.str.len() >= 7, "").to_numpy()
+    age_text = "/" + age.round().astype("Int64").astype(str)
+    prepared["first_age_key"] = (first_code + age_text).where((first != "") & age.notna(), "").to_numpy()
+    prepared["last_age_key"] = (last_code + age_text).where((last != "") & age.notna(), "").to_numpy()
+    return prepared
+
+
+def find_duplicates(patients, workers=WORKERS):
+    # Candidate pairs from a frame of patients: patient_id < duplicate_id, best first
+    prepared = prepare(patients)
+    fields = ["id", "name", "contact", "age", "gender"]
+    tasks = []
+    for keys in PASSES:
+        # A patient sits in one block per key of the pass
+        rows = pd.concat([prepared[fields].assign(key=prepared[key]) for key in keys], ignore_index=True)
+        rows = rows[rows["key"] != ""].drop_duplicates(["id", "key"])
+        # Partitions by key keep each block whole, so they can be scored apart
+        partition = pd.util.hash_array(rows["key"].to_numpy()) % max(workers * 4, 1)
+        tasks.extend(part for _, part in rows.groupby(partition))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(score_block, tasks))
+    else:
+        results = [score_block(task) for task in tasks]
+    results = [result for result in results if not result.empty]
+    if not results:
+        return pd.DataFrame(columns=COLUMNS[1:-1])
+    # A pair can share more than one key
+    pairs = pd.concat(results, ignore_index=True)
+    pairs = pairs.sort_values("score", ascending=False, kind="stable").drop_duplicates(["patient_id", "duplicate_id"])
+    return pairs.sort_values(["score", "patient_id", "duplicate_id"], ascending=[False, True, True]).reset_index(drop=True)
+
+
+def score_block(rows):
+    # Scores each row against its next WINDOW rows with the same key, in name order
+    rows = rows.sort_values(["key", "name"], kind="stable")
+    keys = rows["key"].to_numpy()
+    left, right = [], []
+    for step in range(1, WINDOW + 1):
+        same = np.flatnonzero(keys[:-step] == keys[step:])
+        left.append(same)
+        right.append(same + step)
+    left, right = np.concatenate(left), np.concatenate(right)
+    ids = rows["id"].to_numpy()
+    # Both of a patient's name words can fall in one block
+    left, right = left[ids[left] != ids[right]], right[ids[left] != ids[right]]
+    if len(left) == 0:
+        return pd.DataFrame(columns=COLUMNS[1:-1])
+
+    grams = _trigrams(rows["name"].to_numpy())
+    similarity = np.concatenate([_similarity(grams[left[i:i + 100000]], grams[right[i:i + 100000]])
+                                 for i in range(0, len(left), 100000)])
+    contact = rows["contact"].to_numpy()
+    has_contact = (contact[left] != "") & (contact[right] != "")
+    same_contact = has_contact & (contact[left] == contact[right])
+    age = rows["age"].to_numpy(dtype="float64")
+    has_age = ~np.isnan(age[left]) & ~np.isnan(age[right])
+    close_age = np.abs(age[left] - age[right]) <= 1
+    gender = rows["gender"].to_numpy()
+    conflict = (gender[left] != gender[right]) & (gender[left] != "") & (gender[right] != "")
+    score = (NAME_WEIGHT * similarity + CONTACT_WEIGHT * same_contact + AGE_WEIGHT * close_age) / \
+        (NAME_WEIGHT + CONTACT_WEIGHT * has_contact + AGE_WEIGHT * has_age)
+    score = np.where(conflict, score / 2, score)
+
+    keep = score >= THRESHOLD
+    a, b = ids[left[keep]], ids[right[keep]]
+    return pd.DataFrame({
+        "patient_id": np.minimum(a, b),
+        "duplicate_id": np.maximum(a, b),
+        "score": score[keep].round(3),
+        "name_similarity": similarity[keep].round(3),
+        "same_contact": same_contact[keep]
+    })
+
+
+def _trigrams(names):
+    # Each name's distinct trigrams as int64 codes in a sorted row, -1 for none
+    padded = np.char.add(np.char.add("  ", names.astype(f"U{NAME_WIDTH}")), " ")
+    chars = np.ascontiguousarray(padded, dtype=f"U{NAME_WIDTH + 3}").view(np.uint32)
+    chars = chars.reshape(len(names), NAME_WIDTH + 3).astype(np.int64)
+    codes = (chars[:, :-2] << 42) | (chars[:, 1:-1] << 21) | chars[:, 2:]
+    # Trigrams running past the end, and the blank one of a name with no letters
+    codes[(chars[:, 2:] == 0) | ((chars[:, 1:-1] == 32) & (chars[:, 2:] == 32))] = -1
+    codes.sort(axis=1)
+    repeated = np.zeros(codes.shape, dtype=bool)
+    repeated[:, 1:] = codes[:, 1:] == codes[:, :-1]
+    codes[repeated] = -1
+    return codes
+
+
+def _similarity(a, b):
+    # Dice similarity of trigram rows: shared codes show up as equal neighbours once both rows are sorted together
+    both = np.concatenate([a, np.where(b < 0, -2, b)], axis=1)
+    both.sort(axis=1)
+    shared = ((both[:, 1:] == both[:, :-1]) & (both[:, 1:] >= 0)).sum(axis=1)
+    total = (a >= 0).sum(axis=1) + (b >= 0).sum(axis=1)
+    return np.where(total > 0, 2 * shared / np.maximum(total, 1), 0.0)
+
+
+def run(backend=None, workers=WORKERS):
+    # Finds duplicate candidates among all patients and replaces the patient_duplicates table
+    patients = get_repository("patients", backend).find(columns=["id", "name", "age", "gender", "contact"])
+    pairs = find_duplicates(patients, workers)
+    pairs.insert(0, "id", np.arange(1, len(pairs) + 1))
+    pairs["found_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    get_repository("patient_duplicates", backend).replace(pairs[COLUMNS])
+    return pairs
+
+
+def candidates(limit=None, backend=None):
+    # Pairs from the last run, best first, with both patients' names
+    duplicates = get_repository("patient_duplicates", backend)
+    pairs = duplicates.find(sort=[("score", False)], limit=limit)
+    if pairs.empty:
+        return pairs.assign(patient_name=pd.Series(dtype="object"), duplicate_name=pd.Series(dtype="object"))
+    ids = pd.unique(pd.concat([pairs["patient_id"], pairs["duplicate_id"]])).tolist()
+    names = get_repository("patients", backend).find([("id", "in", ids)], columns=["id", "name"]).set_index("id")["name"]
+    return pairs.assign(patient_name=pairs["patient_id"].map(names), duplicate_name=pairs["duplicate_id"].map(names))
+
+
+def merge(keep_id, duplicate_id, backend=None):
+    # Moves the duplicate's appointments and bills to the kept patient, fills the kept
+    # patient's blanks from it and deletes it. Returns the number of records moved,
+    # None if either patient is gone. Run it again if it was interrupted: records already moved stay moved.
+    keep_id, duplicate_id = int(keep_id), int(duplicate_id)
+    patients = get_repository("patients", backend)
+    keep, duplicate = patients.get(keep_id), patients.get(duplicate_id)
+    if keep is None or duplicate is None or keep_id == duplicate_id:
+        return None
+    moved = 0
+    for entity in ["appointments", "billing"]:
+        repository = get_repository(entity, backend)
+        for row in repository.find([("patient_id", "==", duplicate_id)], columns=["id", "version"]).itertuples():
+            repository.update(row.id, {"patient_id": keep_id}, expected_version=row.version)
+            moved += 1
+
+    changes = {column: duplicate[column] for column in FILL_COLUMNS if _blank(keep[column]) and not _blank(duplicate[column])}
+    if not _blank(duplicate["medical_history"]) and duplicate["medical_history"] != keep["medical_history"]:
+        changes["medical_history"] = duplicate["medical_history"] if _blank(keep["medical_history"]) else \
+            f"{keep['medical_history']}\n{duplicate['medical_history']}"
+    if changes:
+        patients.update(keep_id, changes, expected_version=keep["version"])
+    patients.delete(duplicate_id, expected_version=duplicate["version"])
+
+    duplicates = get_repository("patient_duplicates", backend)
+    for row in duplicates.find([(["patient_id", "duplicate_id"], "==", duplicate_id)], columns=["id"]).itertuples():
+        duplicates.delete(row.id)
+    return moved
+
+
+def _blank(value):
+    return value is None or (not isinstance(value, str) and pd.isna(value)) or value == ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate patients, or merge one into another")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    find_parser = subparsers.add_parser("find")
+    find_parser.add_argument("--workers", type=int, default=WORKERS)
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("keep_id", type=int)
+    merge_parser.add_argument("duplicate_id", type=int)
+    parser.add_argument("--backend", choices=["data", "sql"], default=None)
+    args = parser.parse_args()
+
+    if args.command == "find":
+        started = datetime.now()
+        pairs = run(args.backend, args.workers)
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"Found {len(pairs)} possible duplicates in {elapsed:.1f}s")
+    else:
+        moved = merge(args.keep_id, args.duplicate_id, args.backend)
+        if moved is None:
+            parser.exit(1, "Both patients must exist and differ\n")
+        print(f"Merged patient {args.duplicate_id} into {args.keep_id}, moving {moved} appointments and bills")
+
+
+if __name__ == "__main__":
+    main()
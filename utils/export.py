@@ -0,0 +1,209 @@
+import importlib.util
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import pandas as pd
+
+# Report exports stream rows a chunk at a time from a repository or the
+# database into a temporary file, on a worker thread, so a full table export
+# runs in bounded memory and never blocks a page render.
+
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "hms_exports")
+# Finished exports older than this are removed when the next one starts
+EXPORT_TTL_SECONDS = int(os.getenv("HMS_EXPORT_TTL_SECONDS", "86400"))
+CHUNKSIZE = 50000
+
+# Column a table's date range filter applies to
+DATE_COLUMNS = {
+    "appointments": "date",
+    "billing": "date",
+    "inventory": "last_updated",
+    "stock_movements": "timestamp"
+}
+
+# Excel's per-sheet row limit, header included; longer exports continue on a new sheet
+XLSX_MAX_ROWS = 1048576
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HMS_EXPORT_WORKERS", "2")), thread_name_prefix="export")
+
+
+def repository_chunks(repository, columns=None, start=None, end=None, chunksize=CHUNKSIZE):
+    # The date range is pushed down to the store the repository reads from
+    date_column = DATE_COLUMNS.get(repository.entity)
+    filters = []
+    if date_column and start:
+        filters.append((date_column, ">=", start))
+    if date_column and end:
+        filters.append((date_column, "<=", end))
+    yield from repository.iter_chunks(columns, filters, chunksize)
+
+
+def query_chunks(session, query, chunksize=CHUNKSIZE):
+    # query is an ORM Query or a select(); a server-side cursor keeps the
+    # driver from buffering the whole result set
+    connection = session.connection().execution_options(stream_results=True, yield_per=chunksize)
+    yield from pd.read_sql(getattr(query, "statement", query), connection, chunksize=chunksize)
+
+
+def model_chunks(model, columns=None, start=None, end=None, date_column=None, chunksize=CHUNKSIZE):
+    # Opens its own session because it runs on an export worker, not the page's thread
+    from database import SessionLocal
+
+    table = model.__table__
+    session = SessionLocal()
+    try:
+        query = session.query(*[table.c[column] for column in columns or table.columns.keys()])
+        if date_column and start:
+            query = query.filter(table.c[date_column] >= start)
+        if date_column and end:
+            query = query.filter(table.c[date_column] < end + timedelta(days=1))
+        yield from query_chunks(session, query.order_by(table.c.id), chunksize)
+    finally:
+        session.close()
+
+
+def write_csv(chunks, path):
+    rows = 0
+    header = True
+    with open(path, "w", newline="") as f:
+        for chunk in chunks:
+            chunk.to_csv(f, header=header, index=False)
+            header = False
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = _arrow_schema(pa, chunk)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(_conform(chunk, schema), schema=schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _arrow_schema(pa, chunk):
+    # Columns without a type yet (all empty in the first chunk) are exported as text
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+    return schema
+
+
+def _conform(chunk, schema):
+    # CSV chunks infer dtypes independently, so a later chunk can disagree with
+    # the first one; bring it back to the file's schema
+    import pyarrow as pa
+
+    chunk = chunk.copy()
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_string(field.type) and values.dtype != object:
+            chunk[field.name] = values.astype(object).where(values.notna(), None).map(
+                lambda value: value if value is None else str(value))
+        elif (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)) and values.dtype == object:
+            chunk[field.name] = pd.to_numeric(values, errors="coerce")
+    return chunk
+
+
+def write_xlsx(chunks, path):
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise ImportError("XLSX export needs the openpyxl package, installed with the xlsx extra") from e
+
+    # Write-only workbooks stream rows to disk instead of keeping every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    rows = 0
+    header = None
+    for chunk in chunks:
+        header = list(chunk.columns)
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            if sheet is None or sheet_rows >= XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Sheet{len(workbook.worksheets) + 1}")
+                sheet.append(header)
+                sheet_rows = 1
+            sheet.append([value.item() if hasattr(value, "item") else value for value in row])
+            sheet_rows += 1
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet("Sheet1").append(header or [])
+    workbook.save(path)
+    return rows
+
+
+# format -> (writer, file extension, MIME type)
+FORMATS = {
+    "csv": (write_csv, "csv", "text/csv"),
+    "parquet": (write_parquet, "parquet", "application/vnd.apache.parquet"),
+    "xlsx": (write_xlsx, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+}
+
+
+# format -> package its writer needs; openpyxl is the optional "xlsx" extra
+REQUIRES = {
+    "parquet": "pyarrow",
+    "xlsx": "openpyxl"
+}
+
+
+def available_formats():
+    # Formats whose package is installed; checked without importing it
+    return [fmt for fmt in FORMATS if fmt not in REQUIRES or importlib.util.find_spec(REQUIRES[fmt]) is not None]
+
+
+def export(chunks, fmt, name):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    writer, extension, mime = FORMATS[fmt]
+    cleanup()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{name}_{uuid.uuid4().hex[:8]}.{extension}")
+    started = time.perf_counter()
+    try:
+        rows = writer(chunks, path)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {
+        "path": path,
+        "file_name": f"{name}.{extension}",
+        "mime": mime,
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - started
+    }
+
+
+def submit(chunks, fmt, name):
+    # chunks is a generator, so reading the source also happens on the worker
+    return _executor.submit(export, chunks, fmt, name)
+
+
+def cleanup(max_age=EXPORT_TTL_SECONDS):
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,136 @@
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from utils.repository import get_repository
+
+# Nightly consumption forecast over the stock ledger (see utils/stock.py).
+# Daily usage is what an item dispensed per day, exponentially weighted so
+# recent weeks count most; the spread of that usage gives the safety stock.
+# Every item is computed in one vectorized pass: dispenses are reduced to
+# (item, day) totals and weighted sums are taken with np.bincount, so days
+# with no dispense are never materialized.
+#
+# For each item:
+#   reorder_point   = daily_usage * LEAD_TIME_DAYS + safety_stock
+#   safety_stock    = z(SERVICE_LEVEL) * usage_std * sqrt(LEAD_TIME_DAYS)
+#   suggested_order = enough to cover LEAD_TIME_DAYS + COVER_DAYS of usage plus
+#                     the safety stock, once quantity is at or below the reorder point
+#
+# Results replace the stock_forecasts table, one row per item keyed by the
+# item's id, which the Inventory and Reports pages read.
+
+HISTORY_DAYS = int(os.getenv("HMS_FORECAST_HISTORY_DAYS", "730"))
+HALF_LIFE_DAYS = float(os.getenv("HMS_FORECAST_HALF_LIFE_DAYS", "28"))
+LEAD_TIME_DAYS = float(os.getenv("HMS_REORDER_LEAD_TIME_DAYS", "7"))
+# Days of usage an order should last once it arrives
+COVER_DAYS = float(os.getenv("HMS_REORDER_COVER_DAYS", "30"))
+SERVICE_LEVEL = float(os.getenv("HMS_REORDER_SERVICE_LEVEL", "0.95"))
+
+COLUMNS = ["id", "daily_usage", "usage_std", "days_of_supply", "safety_stock", "reorder_point",
+           "suggested_order", "computed_at"]
+
+
+def forecast(items, usage, as_of, history_days=HISTORY_DAYS):
+    # items: id and quantity per item; usage: item_id, day (datetime64) and
+    # quantity used that day. Returns one row per item in COLUMNS.
+    if items.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    ids = items["id"].to_numpy()
+    quantity = pd.to_numeric(items["quantity"], errors="coerce").fillna(0).to_numpy(dtype="float64")
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+
+    # Map each usage row to its item's position; rows of deleted items and days outside the history drop out
+    item_ids = usage["item_id"].to_numpy()
+    found = np.minimum(np.searchsorted(sorted_ids, item_ids), len(ids) - 1)
+    age = (np.datetime64(as_of, "D") - usage["day"].to_numpy().astype("datetime64[D]")).astype("int64")
+    keep = (sorted_ids[found] == item_ids) & (age >= 0) & (age < history_days)
+    position = order[found[keep]]
+    used = usage["quantity"].to_numpy(dtype="float64")[keep]
+
+    # Weights decay by half every HALF_LIFE_DAYS and sum to 1 over the history,
+    # zero-usage days included, so the bincounts are weighted means
+    decay = 0.5 ** (1 / HALF_LIFE_DAYS)
+    total_weight = (1 - decay ** history_days) / (1 - decay)
+    weights = decay ** age[keep] / total_weight
+    mean = np.bincount(position, weights=weights * used, minlength=len(ids))
+    second = np.bincount(position, weights=weights * used * used, minlength=len(ids))
+    std = np.sqrt(np.maximum(second - mean * mean, 0))
+
+    z = NormalDist().inv_cdf(SERVICE_LEVEL)
+    safety = z * std * np.sqrt(LEAD_TIME_DAYS)
+    reorder_point = mean * LEAD_TIME_DAYS + safety
+    target = mean * (LEAD_TIME_DAYS + COVER_DAYS) + safety
+    suggested = np.where((mean > 0) & (quantity <= reorder_point), np.ceil(np.maximum(target - quantity, 0)), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_supply = np.where(mean > 0, quantity / mean, np.nan)
+
+    return pd.DataFrame({
+        "id": ids,
+        "daily_usage": mean.round(3),
+        "usage_std": std.round(3),
+        "days_of_supply": days_of_supply.round(1),
+        "safety_stock": np.ceil(safety).astype("int64"),
+        "reorder_point": np.ceil(reorder_point).astype("int64"),
+        "suggested_order": suggested.astype("int64"),
+        "computed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+
+
+def daily_usage(movements, since, chunksize=200000):
+    # (item_id, day, quantity) totals of the dispenses since the given day, read in chunks
+    totals = []
+    filters = [("kind", "==", "dispense"), ("timestamp", ">=", since)]
+    for chunk in movements.iter_chunks(["item_id", "timestamp", "quantity"], filters, chunksize):
+        # Group on the date part of the timestamp text; only the distinct days get parsed
+        day = chunk["timestamp"].astype(str).str[:10].rename("day")
+        used = -pd.to_numeric(chunk["quantity"], errors="coerce")
+        totals.append(used.groupby([chunk["item_id"], day]).sum())
+    if not totals:
+        return pd.DataFrame({"item_id": pd.Series(dtype="int64"), "day": pd.Series(dtype="datetime64[ns]"),
+                             "quantity": pd.Series(dtype="float64")})
+    # A day can span two chunks
+    usage = pd.concat(totals).groupby(level=[0, 1]).sum().rename("quantity").reset_index()
+    usage["day"] = pd.to_datetime(usage["day"], errors="coerce")
+    return usage.dropna(subset=["day"])
+
+
+def run(backend=None, as_of=None):
+    # Recomputes every item's forecast and replaces the stock_forecasts table
+    as_of = as_of or date.today()
+    items = get_repository("inventory", backend).find(columns=["id", "quantity"])
+    since = as_of - timedelta(days=HISTORY_DAYS - 1)
+    usage = daily_usage(get_repository("stock_movements", backend), since)
+    result = forecast(items, usage, as_of)
+    get_repository("stock_forecasts", backend).replace(result)
+    return result
+
+
+def suggestions(limit=None, backend=None):
+    # Items the last run suggests ordering, the fewest days of supply first
+    forecasts = get_repository("stock_forecasts", backend)
+    suggested = forecasts.find([("suggested_order", ">", 0)], sort=[("days_of_supply", True)], limit=limit)
+    if suggested.empty:
+        return suggested.assign(item=pd.Series(dtype="object"), quantity=pd.Series(dtype="int64"))
+    items = get_repository("inventory", backend).find([("id", "in", suggested["id"].tolist())],
+                                                      columns=["id", "item", "quantity"])
+    return suggested.merge(items, on="id", how="inner")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast stock consumption and suggest reorder quantities")
+    parser.add_argument("--backend", choices=["data", "sql"], default=None)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=None, help="Forecast date, YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    result = run(args.backend, args.as_of)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Forecast {len(result)} items in {elapsed:.1f}s, {int((result['suggested_order'] > 0).sum())} to reorder")
+
+
+if __name__ == "__main__":
+    main()
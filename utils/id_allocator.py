@@ -0,0 +1,39 @@
+import json
+import os
+from utils.locking import TableLock, atomic_write
+
+# Hands out monotonically increasing record ids per table and persists the
+# next free id, so ids stay small and never collide with earlier records.
+class IdAllocator:
+    # Legacy records used hashed ids; only ids below this are treated as sequence values
+    MAX_SEQUENCE_ID = 2 ** 31
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = TableLock(f"{os.path.splitext(path)[0]}.lock")
+
+    def allocate(self, table, count=1, existing_ids=None):
+        with self.lock:
+            sequences = self._read()
+            start = sequences.get(table)
+            if start is None:
+                start = self._seed(existing_ids() if existing_ids else [])
+            sequences[table] = start + count
+            self._write(sequences)
+            return range(start, start + count)
+
+    def _seed(self, ids):
+        ids = [int(i) for i in ids if 0 <= i < self.MAX_SEQUENCE_ID]
+        return max(ids, default=0) + 1
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _write(self, sequences):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(sequences, f)
+        atomic_write(self.path, write)
@@ -0,0 +1,44 @@
+import threading
+
+# Maps each value of one column to the ids of the rows holding it. An index
+# is stamped with the table signature it was built from; DataManager patches
+# it in place on its own writes and rebuilds it when another writer has
+# changed the table underneath it.
+class SecondaryIndex:
+    def __init__(self, column):
+        self.column = column
+        self.signature = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def rebuild(self, df, signature):
+        entries = {}
+        if not df.empty:
+            ids = df["id"].to_numpy()
+            for value, positions in df.groupby(self.column, sort=False).indices.items():
+                entries[_key(value)] = ids[positions].tolist()
+        self.entries = entries
+        self.signature = signature
+
+    def ids(self, value):
+        return list(self.entries.get(_key(value), ()))
+
+    def values(self):
+        return list(self.entries)
+
+    def apply(self, before, after):
+        if before is not None:
+            ids = self.entries.get(_key(before.get(self.column)))
+            if ids is not None and before["id"] in ids:
+                ids.remove(before["id"])
+                if not ids:
+                    del self.entries[_key(before.get(self.column))]
+        if after is not None and after.get(self.column) == after.get(self.column):
+            self.entries.setdefault(_key(after.get(self.column)), []).append(after["id"])
+
+
+def _key(value):
+    # Keep numpy scalars and plain Python values interchangeable as keys
+    if hasattr(value, "item"):
+        return value.item()
+    return value
@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import threading
+from utils.locking import TableLock
+
+# Append-only journal of rows written since the table's base file was last
+# rewritten. Each row carries an "_op" marker so the journal can be replayed
+# on top of the base file by DataManager.load_data.
+#
+# Appends use group commit: writers queue their rows and whichever thread
+# takes the table lock next writes and fsyncs everything queued so far, so a
+# burst of concurrent inserts costs one flush instead of one per row.
+class TableJournal:
+    def __init__(self, path, columns, on_commit=None):
+        self.path = path
+        self.columns = list(columns)
+        self.lock = TableLock(f"{os.path.splitext(path)[0]}.lock")
+        self.on_commit = on_commit
+        self.compacting = False
+        self.flushes = 0
+        self.appended = 0
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._rows = 0
+        self._size = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def row_count(self):
+        with self.lock:
+            size = os.path.getsize(self.path) if self.exists() else None
+            # Another process may have appended or compacted since we last looked
+            if size != self._size:
+                self._rows = 0
+                if size is not None:
+                    size = self._repair_tail()
+                    with open(self.path, "r", newline="") as f:
+                        self._rows = max(sum(1 for _ in f) - 1, 0)
+                self._size = size
+            return self._rows
+
+    def _repair_tail(self):
+        # Drop a partial last line left behind by a crash mid-append
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                os.fsync(f.fileno())
+            return os.fstat(f.fileno()).st_size
+
+    def append(self, records, op="I", changes=None):
+        # records is a list of dicts or a DataFrame; changes lists (before, after)
+        # pairs for index maintenance, or None when the caller can't provide them
+        entry = {"records": records, "op": op, "changes": changes, "done": False}
+        with self._queue_lock:
+            self._queue.append(entry)
+        with self.lock:
+            if not entry["done"]:
+                self._flush()
+            if entry.get("error") is not None:
+                raise entry["error"]
+            return self._rows
+
+    def _flush(self):
+        with self._queue_lock:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return
+        # One item per entry: its (before, after) pairs, or None for a bulk append
+        changes = [entry["changes"] for entry in batch]
+        try:
+            if self.on_commit is not None:
+                self.on_commit(changes, lambda: self._write(batch))
+            else:
+                self._write(batch)
+        except Exception as e:
+            for entry in batch:
+                entry["error"] = e
+        for entry in batch:
+            entry["done"] = True
+
+    def _write(self, batch):
+        count = self.row_count()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if not self.exists():
+            writer.writerow(self.columns + ["_op"])
+        for entry in batch:
+            records = entry["records"]
+            if hasattr(records, "to_csv"):
+                # Bulk appends are serialized in one vectorized pass
+                records = records.reindex(columns=self.columns).assign(_op=entry["op"])
+                records.to_csv(buffer, header=False, index=False, lineterminator="\n")
+                continue
+            for record in records:
+                writer.writerow([_to_cell(record.get(column)) for column in self.columns] + [entry["op"]])
+        with open(self.path, "a", newline="") as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+            self._size = f.tell()
+        self._rows = count + sum(len(entry["records"]) for entry in batch)
+        self.flushes += 1
+        self.appended += sum(len(entry["records"]) for entry in batch)
+
+    def clear(self):
+        with self.lock:
+            if self.exists():
+                os.remove(self.path)
+            self._rows = 0
+            self._size = None
+
+
+def _to_cell(value):
+    if value is None:
+        return ""
+    try:
+        if value != value:
+            return ""
+    except (TypeError, ValueError):
+        pass
+    if hasattr(value, "item"):
+        return value.item()
+    return value
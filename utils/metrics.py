@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from datetime import date
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from utils.repository import get_repository
+from utils.stock import get_stock
+
+# Dashboard KPIs. Each KPI is a count over one entity's repository, so the
+# tiles follow HMS_REPOSITORY_BACKEND. On the SQL backend every count is a
+# scalar subquery and any set of tiles is fetched with a single SELECT,
+# cached for all sessions for a few seconds; commits that touch a KPI's
+# models drop the cache and writes from other processes show up once the
+# TTL runs out. The data backend counts on its cached frames and indexes.
+#
+# A KPI has a label, an entity and either "filters": today -> repository
+# filters, or, for counts filters can't express, "count": backend -> the
+# value on the data backend and "statement": model -> a count SELECT that
+# joins the aggregate on the SQL backend
+
+KPIS = {
+    "total_patients": {
+        "label": "Total Patients",
+        "entity": "patients",
+        "filters": lambda today: []
+    },
+    "todays_appointments": {
+        "label": "Today's Appointments",
+        "entity": "appointments",
+        "filters": lambda today: [("date", "==", today)]
+    },
+    "available_staff": {
+        "label": "Available Staff",
+        "entity": "staff",
+        "filters": lambda today: []
+    },
+    "low_stock_items": {
+        "label": "Low Stock Items",
+        "entity": "inventory",
+        # Items at or below their own reorder level: the low-stock index, or the
+        # stock margin expression index (ix_inventory_stock_margin) in SQL
+        "count": lambda backend: get_stock(backend).low_stock_count(),
+        "statement": lambda model: select(func.count(model.id)).where(model.quantity - model.reorder_level <= 0)
+    },
+    "pending_bills": {
+        "label": "Pending Bills",
+        "entity": "billing",
+        "filters": lambda today: [("status", "==", "Pending")]
+    }
+}
+
+DASHBOARD = ["total_patients", "todays_appointments", "available_staff", "low_stock_items", "pending_bills"]
+
+TTL_SECONDS = float(os.getenv("HMS_METRICS_TTL_SECONDS", "30"))
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Bumped on every invalidation so a result computed before it is never cached after it
+_generation = 0
+_watched = {get_repository(kpi["entity"], "sql").model for kpi in KPIS.values()}
+
+
+def get_metrics(names=DASHBOARD, backend=None):
+    today = date.today()
+    values = {}
+    queried = []
+    for name in names:
+        repository = get_repository(KPIS[name]["entity"], backend)
+        if repository.backend == "sql":
+            queried.append(name)
+        elif "count" in KPIS[name]:
+            values[name] = KPIS[name]["count"](repository.backend)
+        else:
+            values[name] = repository.count(KPIS[name]["filters"](today))
+    values.update(_query_metrics(queried, today))
+    return values
+
+
+def _query_metrics(names, today):
+    if not names:
+        return {}
+    key = (today, tuple(names))
+    with _cache_lock:
+        cached = _cache.get(key)
+        generation = _generation
+    if cached is not None and cached[0] > time.monotonic():
+        return dict(cached[1])
+
+    repositories = [get_repository(KPIS[name]["entity"], "sql") for name in names]
+    statement = select(*[
+        _count_statement(name, repository, today).scalar_subquery().label(name)
+        for name, repository in zip(names, repositories)
+    ])
+    values = dict(repositories[0].session.execute(statement).one()._mapping)
+    with _cache_lock:
+        if generation == _generation:
+            _cache[key] = (time.monotonic() + TTL_SECONDS, values)
+    return dict(values)
+
+
+def _count_statement(name, repository, today):
+    if "statement" in KPIS[name]:
+        return KPIS[name]["statement"](repository.model)
+    return repository.count_statement(KPIS[name]["filters"](today))
+
+
+def invalidate():
+    global _generation
+    with _cache_lock:
+        _cache.clear()
+        _generation += 1
+
+
+@event.listens_for(Session, "after_flush")
+def _track_writes(session, flush_context):
+    if any(type(obj) in _watched for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["metrics_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("metrics_dirty", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_writes(session):
+    session.info.pop("metrics_dirty", None)
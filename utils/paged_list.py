@@ -0,0 +1,116 @@
+import math
+import streamlit as st
+from sqlalchemy import or_
+
+PAGE_SIZES = [10, 20, 50, 100]
+
+# Filtering, sorting and slicing happen against the data source, and widgets
+# are only built for the rows on the visible page. Each row renders as a
+# one-line summary; its full edit form is only built once the row is opened.
+def paged_list(key, source, row_title, render_row, empty_message="No matching records"):
+    search_col, sort_col, size_col = st.columns([3, 2, 1])
+    search = search_col.text_input("Search", key=f"{key}_search").strip()
+    sort = sort_col.selectbox("Sort by", list(source.sort_options), key=f"{key}_sort")
+    page_size = size_col.selectbox("Per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    total = source.count(search)
+    if total == 0:
+        st.info(empty_message)
+        return
+
+    pages = math.ceil(total / page_size)
+    page_key = f"{key}_page"
+    # Keep the page in range when a new search shrinks the result set
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=page_key)
+    offset = (page - 1) * page_size
+    st.caption(f"Showing {offset + 1}-{min(offset + page_size, total)} of {total}")
+
+    open_key = f"{key}_open"
+    for row in source.fetch(search, sort, offset, page_size):
+        row_id = source.row_id(row)
+        is_open = st.session_state.get(open_key) == row_id
+        title_col, button_col = st.columns([5, 1])
+        title_col.write(row_title(row))
+        if button_col.button("Close" if is_open else "Open", key=f"{key}_toggle_{row_id}"):
+            st.session_state[open_key] = None if is_open else row_id
+            st.rerun()
+        if is_open:
+            with st.container(border=True):
+                render_row(row)
+
+
+class RepositorySource:
+    # sort_options maps a label to (column, ascending); filters are repository
+    # filters applied before the search, e.g. [("status", "==", "Pending")].
+    # ranked, when given, maps search text to matching ids best first (see
+    # utils/search.py) and replaces the substring search; results then come
+    # in that order rather than the chosen sort.
+    def __init__(self, repository, search_columns, sort_options, filters=None, ranked=None):
+        self.repository = repository
+        self.search_columns = search_columns
+        self.sort_options = sort_options
+        self.filters = list(filters or [])
+        self.ranked = ranked
+
+    def _filters(self, search):
+        if not search:
+            return self.filters
+        return self.filters + [(self.search_columns, "contains", search)]
+
+    def _ranked_ids(self, search):
+        ids = self.ranked(search)
+        if self.filters and ids:
+            allowed = set(self.repository.find(self.filters + [("id", "in", ids)], columns=["id"])["id"])
+            ids = [row_id for row_id in ids if row_id in allowed]
+        return ids
+
+    def count(self, search):
+        if search and self.ranked:
+            return len(self._ranked_ids(search))
+        return self.repository.count(self._filters(search))
+
+    def fetch(self, search, sort, offset, limit):
+        if search and self.ranked:
+            ids = self._ranked_ids(search)[offset:offset + limit]
+            if not ids:
+                return []
+            df = self.repository.find([("id", "in", ids)]).set_index("id", drop=False)
+            return [row for _, row in df.reindex([row_id for row_id in ids if row_id in df.index]).iterrows()]
+        df = self.repository.find(self._filters(search), sort=[self.sort_options[sort]], offset=offset, limit=limit)
+        return [row for _, row in df.iterrows()]
+
+    def row_id(self, row):
+        return row["id"]
+
+
+class QuerySource:
+    # sort_options maps a label to a tuple of ORDER BY expressions, e.g. (Patient.name, Patient.id);
+    # ranked works as for RepositorySource, with ids of the query's entity
+    def __init__(self, query, search_columns, sort_options, ranked=None):
+        self.query = query
+        self.search_columns = search_columns
+        self.sort_options = sort_options
+        self.ranked = ranked
+
+    def _filter(self, search):
+        if not search:
+            return self.query
+        return self.query.filter(or_(*[column.ilike(f"%{search}%") for column in self.search_columns]))
+
+    def count(self, search):
+        if search and self.ranked:
+            return len(self.ranked(search))
+        return self._filter(search).order_by(None).count()
+
+    def fetch(self, search, sort, offset, limit):
+        if search and self.ranked:
+            ids = self.ranked(search)[offset:offset + limit]
+            entity = self.query.column_descriptions[0]["entity"]
+            rows = {row.id: row for row in self.query.filter(entity.id.in_(ids)).all()} if ids else {}
+            return [rows[row_id] for row_id in ids if row_id in rows]
+        return self._filter(search).order_by(*self.sort_options[sort]).offset(offset).limit(limit).all()
+
+    def row_id(self, row):
+        return row.id
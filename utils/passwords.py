@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+# Password hashing and verification run on a small bounded worker pool
+# rather than on the script thread of whichever session is logging in.
+# bcrypt releases the GIL while hashing, so the pool runs one hash per
+# worker in parallel; once max_pending hashes are waiting, new requests
+# are turned away instead of queueing CPU work nobody will wait for.
+#
+# HMS_BCRYPT_ROUNDS sets the cost of new hashes. A successful login with a
+# hash of any other cost, or a legacy unsalted SHA-256 hex digest, returns
+# a fresh hash so the caller can store it. That upgrade is best-effort:
+# when the pool is full it waits for a later login.
+
+BCRYPT_ROUNDS = int(os.getenv("HMS_BCRYPT_ROUNDS", "12"))
+WORKERS = int(os.getenv("HMS_PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+MAX_PENDING = int(os.getenv("HMS_PASSWORD_MAX_PENDING", str(WORKERS * 8)))
+# Seconds a caller waits for its hash before giving up
+TIMEOUT_SECONDS = float(os.getenv("HMS_PASSWORD_TIMEOUT_SECONDS", "10"))
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="password")
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_BCRYPT_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+_dummy_lock = threading.Lock()
+
+
+class PasswordServiceBusy(Exception):
+    def __init__(self):
+        super().__init__("Too many sign-ins are being processed. Please try again in a moment.")
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordServiceBusy()
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=TIMEOUT_SECONDS)
+    except TimeoutError:
+        raise PasswordServiceBusy()
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(password, hashed):
+    if _LEGACY_SHA256.match(hashed):
+        return hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).hexdigest(), hashed)
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+# What unknown usernames are checked against, hashed on the pool from startup
+_dummy_hash = _executor.submit(_hash, os.urandom(16).hex(), BCRYPT_ROUNDS)
+
+
+def hash_password(password, rounds=None):
+    return _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+
+def needs_rehash(hashed):
+    match = _BCRYPT_COST.match(hashed)
+    return match is None or int(match.group(1)) != BCRYPT_ROUNDS
+
+
+def verify_password(password, hashed):
+    # Returns (matches, new_hash); new_hash is set when the stored hash is outdated
+    if hashed is None:
+        # Spend the same time as a real check so unknown usernames can't be told apart
+        _run(_check, password, _get_dummy_hash())
+        return False, None
+    if not _run(_check, password, hashed):
+        return False, None
+    if not needs_rehash(hashed):
+        return True, None
+    try:
+        return True, hash_password(password)
+    except PasswordServiceBusy:
+        # The password was right; the upgrade can wait for a later login
+        return True, None
+
+
+def _get_dummy_hash():
+    global _dummy_hash
+    with _dummy_lock:
+        try:
+            if needs_rehash(_dummy_hash.result(timeout=TIMEOUT_SECONDS)):
+                _dummy_hash = _executor.submit(_hash, os.urandom(16).hex(), BCRYPT_ROUNDS)
+            return _dummy_hash.result(timeout=TIMEOUT_SECONDS)
+        except TimeoutError:
+            raise PasswordServiceBusy()
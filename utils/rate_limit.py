@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Sliding-window limits on login attempts, kept in memory per server
+# process. Usernames are limited on failed attempts so a guessed password
+# can't be brute forced; client addresses are limited on every attempt so
+# one machine can't tie up the password workers.
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many login attempts. Try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    def __init__(self, limit, window_seconds):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._events = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window_seconds:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def retry_after(self, key):
+        # Seconds until key may try again, 0 when it is under its limit
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None or len(events) < self.limit:
+                return 0
+            return events[0] + self.window_seconds - now
+
+    def check(self, key):
+        retry_after = self.retry_after(key)
+        if retry_after:
+            raise RateLimited(retry_after)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._events.setdefault(key, deque()).append(now)
+            self._calls += 1
+            # Every so often drop keys whose window has passed so memory stays bounded
+            if self._calls % 1000 == 0:
+                for stale in list(self._events):
+                    self._recent(stale, now)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+failed_logins_by_user = RateLimiter(
+    int(os.getenv("HMS_LOGIN_FAILURES_PER_USER", "5")),
+    float(os.getenv("HMS_LOGIN_FAILURE_WINDOW_SECONDS", "900"))
+)
+logins_by_client = RateLimiter(
+    int(os.getenv("HMS_LOGINS_PER_CLIENT", "120")),
+    float(os.getenv("HMS_LOGIN_CLIENT_WINDOW_SECONDS", "60"))
+)
@@ -0,0 +1,669 @@
+import argparse
+import os
+import threading
+import pandas as pd
+from datetime import date, datetime, time, timedelta
+from utils.data_manager import DataManager, StaleRecordError, _version
+from utils.rollups import ROLLUPS
+
+# One repository per entity (patients, appointments, inventory, staff,
+# billing, and the stock ledger tables) with the same API over either store:
+#   "data" - DataManager tables (CSV or Feather, with journal and indexes)
+#   "sql"  - the SQLAlchemy models in database.py
+# HMS_REPOSITORY_BACKEND picks the store the pages use. Records always use
+# the DataManager column names; the SQL repository maps them onto models.
+#
+# Filters are (column, op, value) tuples, ANDed together. column may be a
+# list of columns to match any of them. ops: == != < <= > >= in contains.
+# A plain date value (not a datetime) compares whole days, so a timestamp
+# anywhere on the end date of a range still matches.
+#
+# Filters, sorts, counts, distinct values, aggregates and pagination run in
+# the backend: as SQL for "sql", and on the cached frames, secondary indexes
+# and report rollups for "data".
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(entity, backend=None):
+    backend = backend or os.getenv("HMS_REPOSITORY_BACKEND", "data")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown repository backend: {backend}")
+    with _repositories_lock:
+        repository = _repositories.get((entity, backend))
+        if repository is None:
+            repository = BACKENDS[backend](entity)
+            _repositories[(entity, backend)] = repository
+        return repository
+
+
+class Repository:
+    backend = None
+
+    def __init__(self, entity):
+        if entity not in DataManager.SCHEMAS:
+            raise ValueError(f"Unknown entity: {entity}")
+        self.entity = entity
+        self.columns = DataManager.SCHEMAS[entity]
+
+    def signature(self):
+        # Changes whenever a row is added, changed or removed; used to tell when derived state is stale
+        raise NotImplementedError
+
+    def get(self, record_id):
+        rows = self.find([("id", "==", record_id)], limit=1)
+        return None if rows.empty else rows.iloc[0].to_dict()
+
+    def ids(self):
+        return set(self.find(columns=["id"])["id"].tolist())
+
+    def find(self, filters=None, columns=None, sort=None, offset=0, limit=None):
+        raise NotImplementedError
+
+    def count(self, filters=None):
+        raise NotImplementedError
+
+    def distinct(self, column, filters=None):
+        raise NotImplementedError
+
+    def aggregate(self, column, value=None, filters=None):
+        # Series of row counts, or sums of value, indexed by column
+        raise NotImplementedError
+
+    def iter_chunks(self, columns=None, filters=None, chunksize=50000):
+        raise NotImplementedError
+
+    def add(self, record):
+        raise NotImplementedError
+
+    def add_many(self, df):
+        raise NotImplementedError
+
+    def replace(self, df):
+        # Swaps every row for the rows of df, ids included, in one write
+        raise NotImplementedError
+
+    def update(self, record_id, record, expected_version=None):
+        raise NotImplementedError
+
+    def delete(self, record_id, expected_version=None):
+        raise NotImplementedError
+
+
+class DataRepository(Repository):
+    backend = "data"
+
+    def __init__(self, entity, data_manager=None):
+        super().__init__(entity)
+        self.data_manager = data_manager or DataManager()
+        self._last = (None, None)
+
+    def signature(self):
+        return self.data_manager._signature(self.entity)
+
+    def _filtered(self, filters):
+        filters = list(filters or [])
+        # Search and paging call this twice per render with the same filters
+        key = (self.data_manager._signature(self.entity), repr(filters))
+        if self._last[0] == key:
+            return self._last[1]
+        df = None
+        bounds = _bounds(filters, DataManager.PARTITIONS.get(self.entity))
+        if bounds is not None:
+            # Only the partitions inside the range are read; the filters below still apply exactly
+            df = self.data_manager.load_range(self.entity, *bounds)
+        for i, (column, op, value) in enumerate(filters if df is None else []):
+            # An equality or "in" on an indexed column only touches the matching rows
+            if op in ("==", "in") and isinstance(column, str) and not isinstance(value, date) and \
+                    (column == "id" or column in DataManager.INDEXES.get(self.entity, [])):
+                values = [value] if op == "==" else list(dict.fromkeys(value))
+                df = self.data_manager.lookup_all(self.entity, column, values)
+                del filters[i]
+                break
+        if df is None:
+            df = self.data_manager._load_table(self.entity)
+        for column, op, value in filters:
+            df = df[_mask(df, column, op, value)]
+        self._last = (key, df)
+        return df
+
+    def find(self, filters=None, columns=None, sort=None, offset=0, limit=None):
+        df = self._filtered(filters)
+        if sort:
+            df = df.sort_values([column for column, _ in sort], ascending=[asc for _, asc in sort], kind="stable")
+        df = df.iloc[offset:None if limit is None else offset + limit]
+        return df[list(columns or self.columns)].reset_index(drop=True)
+
+    def count(self, filters=None):
+        return len(self._filtered(filters))
+
+    def distinct(self, column, filters=None):
+        if not filters and column in DataManager.INDEXES.get(self.entity, []):
+            return self.data_manager.index_values(self.entity, column)
+        return sorted(self._filtered(filters)[column].dropna().unique().tolist())
+
+    def aggregate(self, column, value=None, filters=None):
+        if not filters:
+            # Answer from a report rollup when one is grouped by this column
+            for name, keys, value_column in ROLLUPS.get(self.entity, []):
+                if value_column == value and column in keys:
+                    return self.data_manager.rollups.series(name, level=keys.index(column))
+        df = self._filtered(filters)
+        if value is None:
+            series = df.groupby(column).size().astype("float64")
+        else:
+            series = pd.to_numeric(df[value], errors="coerce").fillna(0).groupby(df[column]).sum()
+        return _label_index(series)
+
+    def iter_chunks(self, columns=None, filters=None, chunksize=50000):
+        columns = list(columns or self.columns)
+        filter_columns = [c for column, _, _ in filters or [] for c in _as_list(column)]
+        read_columns = list(dict.fromkeys(columns + filter_columns))
+        bounds = _bounds(filters, DataManager.PARTITIONS.get(self.entity)) or (None, None)
+        for chunk in self.data_manager.iter_chunks(self.entity, read_columns, chunksize, *bounds):
+            for column, op, value in filters or []:
+                chunk = chunk[_mask(chunk, column, op, value)]
+            yield chunk[columns]
+
+    def add(self, record):
+        return self.data_manager.add_record(self.entity, record)
+
+    def add_many(self, df):
+        return self.data_manager.add_records(self.entity, df)
+
+    def replace(self, df):
+        self.data_manager.save_data(self.entity, df.reindex(columns=self.columns).assign(version=1))
+        return len(df)
+
+    def update(self, record_id, record, expected_version=None):
+        return self.data_manager.update_record(self.entity, record_id, record, expected_version)
+
+    def delete(self, record_id, expected_version=None):
+        return self.data_manager.delete_record(self.entity, record_id, expected_version)
+
+
+# entity -> (model name, {entity column: model attribute or (kind, model attribute)})
+# "date" and "time" fields are the day and the clock time of one DateTime column
+SQL_ENTITIES = {
+    "patients": ("Patient", {
+        "id": "id", "name": "name", "age": "age", "gender": "gender", "contact": "contact_number",
+        "address": "address", "medical_history": "medical_history", "version": "version"
+    }),
+    "appointments": ("Appointment", {
+        "id": "id", "patient_id": "patient_id", "date": ("date", "appointment_date"),
+        "time": ("time", "appointment_date"), "duration": "duration", "doctor": "doctor", "status": "status",
+        "version": "version"
+    }),
+    "inventory": ("Inventory", {
+        "id": "id", "item": "item_name", "quantity": "quantity", "reorder_level": "reorder_level",
+        "category": "category", "last_updated": "last_updated", "version": "version"
+    }),
+    "staff": ("StaffMember", {
+        "id": "id", "name": "name", "role": "role", "contact": "contact", "schedule": "schedule", "version": "version"
+    }),
+    "billing": ("Bill", {
+        "id": "id", "patient_id": "patient_id", "amount": "amount", "date": ("date", "date"),
+        "status": "status", "version": "version"
+    }),
+    "stock_movements": ("StockMovement", {
+        "id": "id", "item_id": "item_id", "kind": "kind", "quantity": "quantity", "reason": "reason",
+        "user": "username", "timestamp": "timestamp", "version": "version"
+    }),
+    "stock_snapshots": ("StockSnapshot", {
+        "id": "id", "through_movement": "through_movement", "item_id": "item_id", "quantity": "quantity",
+        "taken_at": "taken_at", "version": "version"
+    }),
+    "stock_forecasts": ("StockForecast", {
+        "id": "id", "daily_usage": "daily_usage", "usage_std": "usage_std", "days_of_supply": "days_of_supply",
+        "safety_stock": "safety_stock", "reorder_point": "reorder_point", "suggested_order": "suggested_order",
+        "computed_at": "computed_at", "version": "version"
+    }),
+    "patient_duplicates": ("PatientDuplicate", {
+        "id": "id", "patient_id": "patient_id", "duplicate_id": "duplicate_id", "score": "score",
+        "name_similarity": "name_similarity", "same_contact": "same_contact", "found_at": "found_at",
+        "version": "version"
+    })
+}
+
+
+class SQLRepository(Repository):
+    backend = "sql"
+
+    def __init__(self, entity, session=None):
+        import database
+
+        super().__init__(entity)
+        model_name, fields = SQL_ENTITIES[entity]
+        self.database = database
+        self.model = getattr(database, model_name)
+        self.fields = fields
+        # The per-run scoped session unless a caller brings its own
+        self.session = session or database.db_session
+
+    def _field(self, column):
+        field = self.fields[column]
+        kind, name = field if isinstance(field, tuple) else ("value", field)
+        return kind, getattr(self.model, name)
+
+    def _select_columns(self, columns):
+        return [self._field(column)[1].label(column) for column in columns]
+
+    def _conditions(self, filters):
+        return [self._condition(column, op, value) for column, op, value in filters or []]
+
+    def _condition(self, column, op, value):
+        from sqlalchemy import String, and_, cast, or_
+
+        if isinstance(column, (list, tuple)):
+            return or_(*[self._condition(c, op, value) for c in column])
+        kind, attribute = self._field(column)
+        if op == "contains":
+            return cast(attribute, String).ilike(f"%{value}%")
+        if op == "in":
+            return or_(*[self._condition(column, "==", v) for v in value]) if kind != "value" else attribute.in_(value)
+        if kind == "time":
+            raise ValueError(f"Can't filter {self.entity} on {column}")
+        if kind == "date" or (isinstance(value, date) and not isinstance(value, datetime)):
+            # Whole-day comparison against [start of day, start of next day)
+            day = date.fromisoformat(value[:10]) if isinstance(value, str) else value
+            day = day.date() if isinstance(day, datetime) else day
+            start, end = day, day + timedelta(days=1)
+            if attribute.type.python_type is datetime:
+                start, end = datetime.combine(start, time()), datetime.combine(end, time())
+            return {
+                "==": and_(attribute >= start, attribute < end),
+                "!=": or_(attribute < start, attribute >= end),
+                "<": attribute < start,
+                "<=": attribute < end,
+                ">": attribute >= end,
+                ">=": attribute >= start
+            }[op]
+        return {
+            "==": attribute == value,
+            "!=": attribute != value,
+            "<": attribute < value,
+            "<=": attribute <= value,
+            ">": attribute > value,
+            ">=": attribute >= value
+        }[op]
+
+    def _statement(self, columns, filters):
+        from sqlalchemy import select
+        return select(*self._select_columns(columns)).where(*self._conditions(filters))
+
+    def _to_frame(self, rows, columns):
+        df = pd.DataFrame(rows, columns=columns)
+        for column in columns:
+            kind, attribute = self._field(column)
+            if df.empty or (kind == "value" and attribute.type.python_type is not datetime):
+                continue
+            # Timestamps come back in the text formats the data store uses
+            formats = {"date": "%Y-%m-%d", "time": "%H:%M", "value": "%Y-%m-%d %H:%M:%S"}
+            df[column] = pd.to_datetime(df[column], errors="coerce").dt.strftime(formats[kind])
+        return df
+
+    def find(self, filters=None, columns=None, sort=None, offset=0, limit=None):
+        columns = list(columns or self.columns)
+        order = []
+        for column, ascending in sort or []:
+            attribute = self._field(column)[1]
+            order.append(attribute.asc() if ascending else attribute.desc())
+        # Tie-break on id so pages never overlap or skip rows
+        order.append(self.model.id.asc())
+        statement = self._statement(columns, filters).order_by(*order).offset(offset)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return self._to_frame(self.session.execute(statement).all(), columns)
+
+    def signature_statement(self):
+        from sqlalchemy import func, select
+
+        # Updates bump a row's version, deletes the count and inserts the highest id
+        model = self.model
+        return select(func.count(model.id), func.max(model.id), func.sum(model.version))
+
+    def signature(self):
+        return tuple(self.session.execute(self.signature_statement()).one())
+
+    def count_statement(self, filters=None):
+        from sqlalchemy import func, select
+        return select(func.count(self.model.id)).where(*self._conditions(filters))
+
+    def count(self, filters=None):
+        return self.session.execute(self.count_statement(filters)).scalar()
+
+    def _group_expression(self, column):
+        from sqlalchemy import func
+
+        kind, attribute = self._field(column)
+        if kind == "date":
+            return func.date(attribute)
+        if kind == "time":
+            raise ValueError(f"Can't group {self.entity} by {column}")
+        return attribute
+
+    def distinct(self, column, filters=None):
+        from sqlalchemy import select
+
+        expression = self._group_expression(column)
+        statement = select(expression).where(*self._conditions(filters), expression.is_not(None)).distinct()
+        return sorted(_label(value) if self._field(column)[0] == "date" else value
+                      for (value,) in self.session.execute(statement))
+
+    def aggregate(self, column, value=None, filters=None):
+        from sqlalchemy import func, select
+
+        expression = self._group_expression(column)
+        total = func.count(self.model.id) if value is None else func.coalesce(func.sum(self._field(value)[1]), 0)
+        statement = select(expression, total).where(*self._conditions(filters), expression.is_not(None)).group_by(expression)
+        rows = self.session.execute(statement).all()
+        series = pd.Series({key: float(amount) for key, amount in rows}, dtype="float64")
+        return _label_index(series)
+
+    def iter_chunks(self, columns=None, filters=None, chunksize=50000):
+        from utils.export import query_chunks
+
+        columns = list(columns or self.columns)
+        # A separate session, since chunks are usually read on an export worker
+        session = self.database.SessionLocal()
+        try:
+            statement = self._statement(columns, filters).order_by(self.model.id)
+            for chunk in query_chunks(session, statement, chunksize):
+                yield self._to_frame(chunk, columns)
+        finally:
+            session.close()
+
+    def _values(self, record, current=None):
+        # Entity columns -> model attributes; date and time halves are recombined
+        values = {}
+        moments = {}
+        for column, value in record.items():
+            if column not in self.fields or column == "version":
+                continue
+            kind, attribute = self._field(column)
+            if kind == "value":
+                values[attribute.key] = None if _missing(value) else _coerce(_python(value), attribute.type.python_type)
+            else:
+                moments.setdefault(attribute.key, {})[kind] = value
+        for key, parts in moments.items():
+            existing = getattr(current, key, None) if current is not None else None
+            values[key] = _combine(parts, existing, getattr(self.model, key).type.python_type)
+        return values
+
+    def add(self, record):
+        obj = self.model(**self._values(record))
+        self.session.add(obj)
+        try:
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return obj.id
+
+    def add_many(self, df):
+        rows = []
+        for record in df.to_dict("records"):
+            values = self._values(record)
+            values["version"] = 1
+            rows.append(values)
+        try:
+            self.session.bulk_insert_mappings(self.model, rows)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        # Bulk inserts skip the session events that keep dashboard metrics fresh
+        from utils import metrics
+        metrics.invalidate()
+        return len(rows)
+
+    def replace(self, df):
+        from sqlalchemy import delete
+
+        rows = []
+        for record in df.to_dict("records"):
+            values = self._values(record)
+            values["version"] = 1
+            rows.append(values)
+        try:
+            self.session.execute(delete(self.model))
+            self.session.bulk_insert_mappings(self.model, rows)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return len(rows)
+
+    def _current(self, record_id, expected_version):
+        obj = self.session.get(self.model, _python(record_id))
+        if obj is not None and expected_version is not None and _version(obj.version) != _version(expected_version):
+            raise StaleRecordError(self.entity, record_id, expected_version, obj.version)
+        return obj
+
+    def _commit(self, record_id, expected_version):
+        from sqlalchemy.orm.exc import StaleDataError
+
+        try:
+            self.session.commit()
+        except StaleDataError:
+            # Someone else committed a newer version between our read and write
+            self.session.rollback()
+            raise StaleRecordError(self.entity, record_id, expected_version, None)
+
+    def update(self, record_id, record, expected_version=None):
+        obj = self._current(record_id, expected_version)
+        if obj is None:
+            return False
+        for key, value in self._values(record, obj).items():
+            if key != "id":
+                setattr(obj, key, value)
+        self._commit(record_id, expected_version)
+        return True
+
+    def delete(self, record_id, expected_version=None):
+        obj = self._current(record_id, expected_version)
+        if obj is None:
+            return False
+        self.session.delete(obj)
+        self._commit(record_id, expected_version)
+        return True
+
+
+BACKENDS = {
+    "data": DataRepository,
+    "sql": SQLRepository
+}
+
+
+def _as_list(column):
+    return list(column) if isinstance(column, (list, tuple)) else [column]
+
+
+def _bounds(filters, column):
+    # ("YYYY-MM-DD" start, end) implied by the range filters on column, or None if unbounded
+    if column is None:
+        return None
+    start = end = None
+    for filter_column, op, value in filters or []:
+        if filter_column != column or op not in ("==", "<", "<=", ">", ">=") or _missing(value):
+            continue
+        day = value if isinstance(value, date) else pd.Timestamp(value)
+        day = day.date() if isinstance(day, datetime) else day
+        # Strict bounds only skip a whole day for plain dates; timestamps can still match on their own day
+        whole_day = isinstance(value, date) and not isinstance(value, datetime)
+        if op in ("==", ">=", ">"):
+            first = day + timedelta(days=1) if op == ">" and whole_day else day
+            start = first if start is None else max(start, first)
+        if op in ("==", "<=", "<"):
+            last = day - timedelta(days=1) if op == "<" and whole_day else day
+            end = last if end is None else min(end, last)
+    if start is None and end is None:
+        return None
+    return (None if start is None else start.isoformat(), None if end is None else end.isoformat())
+
+
+def _mask(df, column, op, value):
+    if isinstance(column, (list, tuple)):
+        mask = pd.Series(False, index=df.index)
+        for c in column:
+            mask |= _mask(df, c, op, value)
+        return mask
+    values = df[column]
+    if op == "contains":
+        return values.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+    if op == "in":
+        return values.isin(list(value))
+    if isinstance(value, date):
+        # Dates compare whole days, datetimes exact timestamps
+        values = pd.to_datetime(values, errors="coerce")
+        if not isinstance(value, datetime):
+            values = values.dt.normalize()
+        value = pd.Timestamp(value)
+    return {
+        "==": values.__eq__,
+        "!=": values.__ne__,
+        "<": values.__lt__,
+        "<=": values.__le__,
+        ">": values.__gt__,
+        ">=": values.__ge__
+    }[op](value)
+
+
+def _combine(parts, existing, python_type):
+    day = parts.get("date", existing.date() if isinstance(existing, datetime) else existing)
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    if python_type is not datetime:
+        return day
+    clock = parts.get("time", existing.time() if isinstance(existing, datetime) else time())
+    if isinstance(clock, str):
+        clock = time.fromisoformat(clock)
+    return datetime.combine(day, clock)
+
+
+def _coerce(value, python_type):
+    if python_type is datetime and isinstance(value, str):
+        return pd.Timestamp(value).to_pydatetime()
+    if python_type is date and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _python(value):
+    return value.item() if hasattr(value, "item") else value
+
+
+def _missing(value):
+    try:
+        return value is None or bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def _label(value):
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (date, datetime)):
+        value = value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def _label_index(series):
+    # Keys come back as text on both backends, like the rollup series
+    series.index = [_label(key) for key in series.index]
+    return series.groupby(level=0).sum().sort_index()
+
+
+# Consistency check and migration between the two stores
+
+MIGRATION_ORDER = ["patients", "staff", "inventory", "stock_movements", "stock_snapshots", "appointments", "billing"]
+
+
+def _normalized(df):
+    # Compare as text; empty and missing values are treated alike
+    return df.astype(object).where(df.notna(), "").map(_label)
+
+
+def check(entities=None):
+    # Compares both stores row by row on every column except version
+    report = {}
+    for entity in entities or MIGRATION_ORDER:
+        data, sql = get_repository(entity, "data"), get_repository(entity, "sql")
+        columns = [column for column in data.columns if column != "version"]
+        left = _normalized(data.find(columns=columns).set_index("id"))
+        right = _normalized(sql.find(columns=columns).set_index("id"))
+        common = left.index.intersection(right.index)
+        differs = (left.loc[common] != right.loc[common]).any(axis=1)
+        report[entity] = {
+            "data_rows": len(left),
+            "sql_rows": len(right),
+            "only_in_data": sorted(left.index.difference(right.index).tolist()),
+            "only_in_sql": sorted(right.index.difference(left.index).tolist()),
+            "different": sorted(differs[differs].index.tolist())
+        }
+    return report
+
+
+def migrate_to_sql(entities=None, chunksize=10000, progress=None):
+    # Copies data-store rows into the database, keeping their ids. Rows whose id
+    # is already in the database are skipped, so the migration can be rerun.
+    from sqlalchemy import text
+
+    result = {}
+    for entity in entities or MIGRATION_ORDER:
+        data, sql = get_repository(entity, "data"), get_repository(entity, "sql")
+        existing = sql.ids()
+        copied = skipped = 0
+        for chunk in data.iter_chunks(chunksize=chunksize):
+            new = chunk[~chunk["id"].isin(existing)]
+            skipped += len(chunk) - len(new)
+            if not new.empty:
+                copied += sql.add_many(new)
+            if progress:
+                progress(entity, copied, skipped)
+        session = sql.session
+        if session.get_bind().dialect.name == "postgresql" and copied:
+            # Explicit ids don't advance the serial sequence
+            table = sql.model.__tablename__
+            session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+            session.commit()
+        result[entity] = {"copied": copied, "skipped": skipped}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the data store with the database, or copy it across")
+    parser.add_argument("command", choices=["check", "migrate"])
+    parser.add_argument("entities", nargs="*", help=f"Any of: {', '.join(MIGRATION_ORDER)} (default: all)")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    args = parser.parse_args()
+    unknown = [entity for entity in args.entities if entity not in MIGRATION_ORDER]
+    if unknown:
+        parser.error(f"unknown entities: {', '.join(unknown)}")
+    entities = args.entities or None
+
+    if args.command == "migrate":
+        for entity, counts in migrate_to_sql(entities, args.chunksize).items():
+            print(f"{entity}: {counts['copied']} rows copied, {counts['skipped']} already in the database")
+        return
+
+    mismatched = 0
+    for entity, result in check(entities).items():
+        ok = not (result["only_in_data"] or result["only_in_sql"] or result["different"])
+        mismatched += not ok
+        print(f"{'ok  ' if ok else 'DIFF'} {entity}: {result['data_rows']} data rows, {result['sql_rows']} database rows")
+        for label in ("only_in_data", "only_in_sql", "different"):
+            if result[label]:
+                ids = ", ".join(map(str, result[label][:20]))
+                more = f" (+{len(result[label]) - 20} more)" if len(result[label]) > 20 else ""
+                print(f"     {label.replace('_', ' ')}: {ids}{more}")
+    if mismatched:
+        parser.exit(1, f"{mismatched} entities differ between the stores\n")
+
+
+if __name__ == "__main__":
+    main()
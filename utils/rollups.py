@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import pandas as pd
+from utils.locking import TableLock, atomic_write
+
+# Pre-aggregated counters behind the Reports page. DataManager feeds every
+# insert, update and delete through apply(), so each write only adjusts a
+# handful of counters and reports read series sized by days or categories
+# instead of by rows. rebuild() recomputes everything from the tables.
+#
+# Each rollup maps table rows to a nested key path and a value to add:
+#   (rollup name, group keys..., value column or None to count rows)
+ROLLUPS = {
+    "appointments": [
+        ("appointments_by_day", ["date", "status"], None)
+    ],
+    "billing": [
+        ("revenue_by_day", ["date", "status"], "amount"),
+        ("bills_by_status", ["status"], None),
+        ("amount_by_status", ["status"], "amount")
+    ],
+    "patients": [
+        ("patients_by_gender", ["gender"], None),
+        ("patients_by_age", ["age"], None)
+    ],
+    "staff": [
+        ("staff_by_role", ["role"], None)
+    ],
+    "inventory": [
+        ("inventory_by_category", ["category"], "quantity")
+    ]
+}
+
+
+class RollupStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = TableLock(f"{os.path.splitext(path)[0]}.lock")
+        self._state = None
+        self._stat = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def state(self):
+        stat = _stat(self.path)
+        if stat is None:
+            return {}
+        if stat != self._stat:
+            with open(self.path, "r") as f:
+                self._state = json.load(f)
+            self._stat = stat
+        return self._state
+
+    def apply(self, table, changes):
+        # changes is a list of (before, after) row dicts; None marks an insert or delete
+        if table not in ROLLUPS or not changes:
+            return
+        deltas = {}
+        for before, after in changes:
+            for row, sign in ((before, -1), (after, 1)):
+                if row is None:
+                    continue
+                for name, keys, value_column in ROLLUPS[table]:
+                    path = [_key(row.get(key)) for key in keys]
+                    if None in path:
+                        continue
+                    value = 1 if value_column is None else _number(row.get(value_column))
+                    _add(deltas.setdefault(name, {}), path, sign * value)
+        self._merge(deltas)
+
+    def apply_frame(self, table, df):
+        if table in ROLLUPS and not df.empty:
+            self._merge(_aggregate(table, df))
+
+    def _merge(self, deltas):
+        with self.lock:
+            # A missing store is rebuilt from the tables before it is next read
+            if not self.exists():
+                return
+            state = json.loads(json.dumps(self.state()))
+            for name, values in deltas.items():
+                _merge_into(state.setdefault(name, {}), values)
+            self._write(state)
+
+    def rebuild(self, data_manager):
+        state = {}
+        for table in ROLLUPS:
+            columns = sorted({column for _, keys, value in ROLLUPS[table] for column in keys + [value] if column})
+            state.update(_aggregate(table, data_manager.load_data(table, columns=columns)))
+        with self.lock:
+            self._write(state)
+        return state
+
+    def _write(self, state):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+        atomic_write(self.path, write)
+        self._state = state
+        self._stat = _stat(self.path)
+
+    def series(self, name, level=0):
+        # Collapse a rollup to a Series indexed by one of its key levels
+        totals = {}
+        for path, value in _leaves(self.state().get(name, {})):
+            totals[path[level]] = totals.get(path[level], 0) + value
+        return pd.Series(totals, dtype="float64").sort_index()
+
+    def frame(self, name, columns, value_name):
+        rows = [path + [value] for path, value in _leaves(self.state().get(name, {}))]
+        return pd.DataFrame(rows, columns=columns + [value_name])
+
+
+def _aggregate(table, df):
+    state = {}
+    for name, keys, value_column in ROLLUPS[table]:
+        rows = df.dropna(subset=keys)
+        if value_column is None:
+            grouped = rows.groupby(keys).size()
+        else:
+            grouped = pd.to_numeric(rows[value_column], errors="coerce").fillna(0).groupby(
+                [rows[key] for key in keys]).sum()
+        values = state.setdefault(name, {})
+        for index, value in grouped.items():
+            path = [_key(part) for part in (index if isinstance(index, tuple) else (index,))]
+            _add(values, path, float(value))
+    return state
+
+
+def _key(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if pd.isna(value) else value
+
+
+def _add(tree, path, value):
+    for key in path[:-1]:
+        tree = tree.setdefault(key, {})
+    tree[path[-1]] = round(tree.get(path[-1], 0) + value, 2)
+
+
+def _merge_into(tree, deltas):
+    for key, value in deltas.items():
+        if isinstance(value, dict):
+            _merge_into(tree.setdefault(key, {}), value)
+            if not tree[key]:
+                del tree[key]
+        else:
+            total = round(tree.get(key, 0) + value, 2)
+            if total:
+                tree[key] = total
+            else:
+                tree.pop(key, None)
+
+
+def _leaves(tree, prefix=None):
+    prefix = prefix or []
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            yield from _leaves(value, prefix + [key])
+        else:
+            yield prefix + [key], value
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def main():
+    from utils.data_manager import DataManager
+
+    parser = argparse.ArgumentParser(description="Rebuild the report rollups from the data tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args()
+
+    data_manager = DataManager(data_dir=args.data_dir)
+    state = data_manager.rollups.rebuild(data_manager)
+    print(f"Rebuilt {len(state)} rollups in {data_manager.rollups.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import heapq
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+import pandas as pd
+from sqlalchemy import inspect
+from utils.repository import get_repository
+
+# Appointment scheduling over a per-doctor interval index. Each doctor's
+# booked appointments are kept as parallel arrays sorted by start minute, so
+# a conflict check is two bisects plus the few appointments that start
+# within the longest booking before the new one. Free slots walk the same
+# arrays, jumping past each booking, and are merged across doctors lazily.
+#
+# The index is built from the appointments repository and stamped with its
+# signature. Bookings made here patch it in place; any other write makes
+# the signature differ and the index is rebuilt on next use. Cancelled
+# appointments don't hold their slot, so bringing one back goes through
+# set_status(), which checks the slot like book() does. Bulk imports check
+# their rows with fit_batch() against a private copy of the index.
+
+DEFAULT_DURATION = 30
+SLOT_MINUTES = int(os.getenv("HMS_SLOT_MINUTES", "15"))
+WORKING_HOURS = os.getenv("HMS_WORKING_HOURS", "08:00-17:00")
+# How far ahead free slot searches look before giving up
+HORIZON_DAYS = int(os.getenv("HMS_SCHEDULING_HORIZON_DAYS", "60"))
+INACTIVE_STATUSES = ["Cancelled"]
+
+_EPOCH = datetime(1970, 1, 1)
+_MINUTES_PER_DAY = 24 * 60
+
+
+class SchedulingConflict(Exception):
+    def __init__(self, doctor, start, end, conflicts):
+        super().__init__(
+            f"{doctor} is already booked between {_format(start)} and {_format(end)}"
+        )
+        self.doctor = doctor
+        self.start = start
+        self.end = end
+        self.conflicts = conflicts
+
+
+class DoctorIntervals:
+    # One doctor's appointments as (start, end) minute intervals sorted by start
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        self.starts_by_id = {}
+        # Length of the longest interval ever added; bounds how far back an overlap can start
+        self.longest = 0
+
+    def add(self, start, end, appointment_id):
+        self.remove(appointment_id)
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, appointment_id)
+        self.starts_by_id[appointment_id] = start
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, appointment_id):
+        start = self.starts_by_id.pop(appointment_id, None)
+        if start is None:
+            return
+        position = bisect_left(self.starts, start)
+        while self.ids[position] != appointment_id:
+            position += 1
+        del self.starts[position], self.ends[position], self.ids[position]
+
+    def overlapping(self, start, end, ignore=None):
+        # Positions of intervals that overlap [start, end)
+        high = bisect_left(self.starts, end)
+        low = bisect_right(self.starts, start - self.longest)
+        return [i for i in range(low, high) if self.ends[i] > start and self.ids[i] != ignore]
+
+    def free_starts(self, start, stop, duration, day_start, day_end):
+        # Yields free start minutes on the slot grid within working hours, earliest first
+        t = _ceil(start, SLOT_MINUTES)
+        while t + duration <= stop:
+            minute_of_day = t % _MINUTES_PER_DAY
+            if minute_of_day < day_start:
+                t += day_start - minute_of_day
+                continue
+            if minute_of_day + duration > day_end:
+                t += _MINUTES_PER_DAY - minute_of_day + day_start
+                continue
+            blocking = self.overlapping(t, t + duration)
+            if blocking:
+                t = _ceil(max(self.ends[i] for i in blocking), SLOT_MINUTES)
+                continue
+            yield t
+            t = _ceil(t + duration, SLOT_MINUTES)
+
+
+class ScheduleIndex:
+    def __init__(self, signature=None):
+        self.signature = signature
+        self.doctors = {}
+        self.bookings = {}
+
+    @classmethod
+    def build(cls, df, signature):
+        index = cls(signature)
+        if df.empty:
+            return index
+        starts = pd.to_datetime(df["date"].astype(str) + " " + df["time"].astype(str), errors="coerce")
+        durations = pd.to_numeric(df["duration"], errors="coerce").fillna(DEFAULT_DURATION).astype("int64")
+        valid = starts.notna() & df["doctor"].notna()
+        frame = pd.DataFrame({
+            "id": df["id"][valid],
+            "doctor": df["doctor"][valid],
+            "start": (starts[valid] - _EPOCH) // pd.Timedelta(minutes=1),
+            "duration": durations[valid]
+        }).sort_values("start", kind="stable")
+        for doctor, rows in frame.groupby("doctor", sort=False):
+            intervals = DoctorIntervals()
+            intervals.starts = rows["start"].tolist()
+            intervals.ends = (rows["start"] + rows["duration"]).tolist()
+            intervals.ids = rows["id"].tolist()
+            intervals.starts_by_id = dict(zip(intervals.ids, intervals.starts))
+            intervals.longest = int(rows["duration"].max())
+            index.doctors[doctor] = intervals
+            index.bookings.update(dict.fromkeys(intervals.ids, doctor))
+        return index
+
+    def add(self, doctor, start, end, appointment_id):
+        self.remove(appointment_id)
+        self.doctors.setdefault(doctor, DoctorIntervals()).add(start, end, appointment_id)
+        self.bookings[appointment_id] = doctor
+
+    def remove(self, appointment_id):
+        doctor = self.bookings.pop(appointment_id, None)
+        if doctor is not None:
+            self.doctors[doctor].remove(appointment_id)
+
+    def conflicts(self, doctor, start, end, ignore=None):
+        intervals = self.doctors.get(doctor)
+        if intervals is None:
+            return []
+        return [intervals.ids[i] for i in intervals.overlapping(start, end, ignore)]
+
+
+class Scheduler:
+    def __init__(self, repository):
+        self.repository = repository
+        self._index = ScheduleIndex()
+        self._lock = threading.RLock()
+
+    def index(self):
+        with self._lock:
+            signature = self.repository.signature()
+            if self._index.signature != signature:
+                df = self.repository.find(
+                    [("status", "!=", status) for status in INACTIVE_STATUSES],
+                    columns=["id", "doctor", "date", "time", "duration"]
+                )
+                self._index = ScheduleIndex.build(df, signature)
+            return self._index
+
+    def conflicts(self, doctor, start, duration, ignore=None):
+        # Ids of active appointments of doctor overlapping the one proposed
+        begin = _minutes(start)
+        return self.index().conflicts(doctor, begin, begin + int(duration), ignore)
+
+    def book(self, record):
+        # Adds the appointment unless its doctor is busy then; returns its id
+        start = datetime.combine(_as_date(record["date"]), _as_time(record["time"]))
+        duration = int(record.get("duration") or DEFAULT_DURATION)
+        with self._lock:
+            index = self.index()
+            conflicts = index.conflicts(record["doctor"], _minutes(start), _minutes(start) + duration)
+            if conflicts:
+                raise SchedulingConflict(record["doctor"], start, start + timedelta(minutes=duration), conflicts)
+            record = dict(record, duration=duration)
+            appointment_id = self.repository.add(record)
+            signature = self.repository.signature()
+            # Patch the index for our own write instead of rebuilding it. The check and the
+            # add are atomic within this process only; a booking another process makes in
+            # between isn't seen until the table changes again.
+            if record.get("status") not in INACTIVE_STATUSES:
+                index.add(record["doctor"], _minutes(start), _minutes(start) + duration, appointment_id)
+            index.signature = signature
+            return appointment_id
+
+    def set_status(self, appointment_id, status, expected_version=None):
+        # Returns False if the appointment is gone. An appointment leaving a cancelled
+        # status is checked for conflicts first, atomically with the update as in book().
+        with self._lock:
+            index = self.index()
+            appointment = self.repository.get(appointment_id)
+            if appointment is None:
+                return False
+            start = pd.to_datetime(f"{appointment['date']} {appointment['time']}", errors="coerce")
+            duration = pd.to_numeric(appointment.get("duration"), errors="coerce")
+            duration = DEFAULT_DURATION if pd.isna(duration) else int(duration)
+            doctor = appointment["doctor"]
+            holds_slot = status not in INACTIVE_STATUSES and not pd.isna(start) and not pd.isna(doctor)
+            if holds_slot and appointment["status"] in INACTIVE_STATUSES:
+                conflicts = index.conflicts(doctor, _minutes(start), _minutes(start) + duration, ignore=appointment_id)
+                if conflicts:
+                    raise SchedulingConflict(doctor, start, start + timedelta(minutes=duration), conflicts)
+            self.repository.update(appointment_id, {"status": status}, expected_version=expected_version)
+            signature = self.repository.signature()
+            if holds_slot:
+                index.add(doctor, _minutes(start), _minutes(start) + duration, appointment_id)
+            else:
+                index.remove(appointment_id)
+            index.signature = signature
+            return True
+
+    def free_slots(self, doctors, duration=DEFAULT_DURATION, after=None, count=5):
+        # The first count free (start, doctor) pairs across doctors, earliest first
+        after = max(after or datetime.now(), datetime.now())
+        start = _minutes(after)
+        stop = start + HORIZON_DAYS * _MINUTES_PER_DAY
+        day_start, day_end = _working_hours()
+        index = self.index()
+        streams = [
+            _tagged(index.doctors.get(doctor, DoctorIntervals()).free_starts(
+                start, stop, int(duration), day_start, day_end), doctor)
+            for doctor in doctors
+        ]
+        return [(_datetime(minute), doctor) for minute, doctor in islice(heapq.merge(*streams), count)]
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(backend=None):
+    repository = get_repository("appointments", backend)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(repository.backend)
+        if scheduler is None:
+            scheduler = Scheduler(repository)
+            _schedulers[repository.backend] = scheduler
+        return scheduler
+
+
+def fit_batch(index, doctors, starts, durations, statuses):
+    # Which of a batch of new appointments fit around those in index and the ones
+    # before them in the batch. Those that fit are added to index under placeholder
+    # ids, so pass a private index, such as a new Scheduler's.
+    starts = (pd.to_datetime(pd.Series(starts), errors="coerce") - _EPOCH) // pd.Timedelta(minutes=1)
+    durations = pd.to_numeric(pd.Series(durations), errors="coerce").fillna(DEFAULT_DURATION).astype("int64")
+    fits = []
+    for doctor, start, duration, status in zip(doctors, starts, durations, statuses):
+        if pd.isna(doctor) or pd.isna(start) or status in INACTIVE_STATUSES:
+            fits.append(True)
+            continue
+        start, end = int(start), int(start) + int(duration)
+        fits.append(not index.conflicts(doctor, start, end))
+        if fits[-1]:
+            index.add(doctor, start, end, -len(index.bookings) - 1)
+    return fits
+
+
+def _tagged(minutes, doctor):
+    for minute in minutes:
+        yield minute, doctor
+
+
+def _minutes(moment):
+    return (moment - _EPOCH) // timedelta(minutes=1)
+
+
+def _datetime(minutes):
+    return _EPOCH + timedelta(minutes=int(minutes))
+
+
+def _ceil(minutes, step):
+    return -(-minutes // step) * step
+
+
+def _working_hours():
+    start, end = (time.fromisoformat(part.strip()) for part in WORKING_HOURS.split("-"))
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def _as_date(value):
+    return date.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+
+def _as_time(value):
+    return time.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _format(moment):
+    return moment.strftime("%Y-%m-%d %H:%M")
+
+
+def check_appointment(appointment):
+    # Called by the Appointment model before every insert and update
+    if appointment.status in INACTIVE_STATUSES or not appointment.doctor or appointment.appointment_date is None:
+        return
+    state = inspect(appointment)
+    if state.persistent and not any(state.attrs[name].history.has_changes()
+                                    for name in ("appointment_date", "duration", "doctor", "status")):
+        return
+    duration = appointment.duration or DEFAULT_DURATION
+    conflicts = get_scheduler("sql").conflicts(appointment.doctor, appointment.appointment_date, duration,
+                                               ignore=appointment.id)
+    if conflicts:
+        raise SchedulingConflict(appointment.doctor, appointment.appointment_date, appointment.ends_at, conflicts)
@@ -0,0 +1,381 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from functools import reduce
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from utils.repository import get_repository
+
+# Full-text patient search over an inverted index of the name, contact,
+# address and medical history fields. Text is lowercased and split into
+# words; contact numbers are also indexed as one run of digits so a
+# fragment of a phone number finds them.
+#
+# The index is built in bulk into sorted arrays: the vocabulary, and for
+# each term a slice of document ids with the weight of the best field it
+# appears in. A query word matches its exact term, terms it is a prefix of,
+# digit terms containing it, and failing all of those, terms sharing enough
+# trigrams with it to be a typo. Every word of the query must match; a
+# document's score adds up the best match quality x field weight per word.
+#
+# Writes are applied incrementally. A changed document's base postings are
+# masked out and its new terms go into a small pending layer that queries
+# also read. Once the pending layer grows past MAX_PENDING documents, the
+# index is rebuilt. The data backend hears about writes from DataManager
+# under the table lock. The SQL backend hears about them from session
+# events, and checks every REFRESH_SECONDS for writes made elsewhere.
+
+# Field -> weight of a match in it
+FIELDS = {"name": 3, "contact": 2, "address": 1, "medical_history": 1}
+# Match quality by kind; prefix and typo matches are scaled down further by how much they differ
+EXACT, PREFIX, INFIX, FUZZY = 1.0, 0.8, 0.7, 0.6
+# A misspelt query word matches at most this many of the closest terms
+MAX_EXPANSIONS = int(os.getenv("HMS_SEARCH_MAX_EXPANSIONS", "50"))
+# Least share of trigrams a term must have in common with a query word to count as a typo of it
+SIMILARITY = float(os.getenv("HMS_SEARCH_SIMILARITY", "0.3"))
+MAX_PENDING = int(os.getenv("HMS_SEARCH_MAX_PENDING", "2000"))
+REFRESH_SECONDS = float(os.getenv("HMS_SEARCH_REFRESH_SECONDS", "10"))
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class SearchIndex:
+    def __init__(self, signature=None):
+        self.signature = signature
+        # Base arrays: sorted vocabulary, and postings[starts[i]:starts[i + 1]] for term i
+        self.terms = []
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.starts = np.zeros(1, dtype=np.int64)
+        # Postings hold positions into ids, the sorted document ids, which can be far apart
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.trigrams = {}
+        self.trigram_counts = np.zeros(0, dtype=np.int64)
+        # By position in ids: base postings superseded by a later write
+        self.dead = np.zeros(0, dtype=bool)
+        # Documents written since the build: id -> {term: weight}, and the same by term
+        self.pending = {}
+        self.pending_postings = {}
+        self.pending_terms = []
+
+    @classmethod
+    def build(cls, df, fields, signature):
+        index = cls(signature)
+        postings = _frame_terms(df, fields)
+        if postings.empty:
+            return index
+        codes = pd.factorize(postings["term"], sort=False)[0]
+        index.terms = postings["term"].iloc[np.r_[0, np.flatnonzero(np.diff(codes)) + 1]].tolist()
+        index.starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1, len(codes)].astype(np.int64)
+        index.ids, index.docs = np.unique(postings["id"].to_numpy(dtype=np.int64), return_inverse=True)
+        index.weights = postings["weight"].to_numpy(dtype=np.float64)
+        index.lengths = np.fromiter(map(len, index.terms), dtype=np.int64, count=len(index.terms))
+        index.dead = np.zeros(len(index.ids), dtype=bool)
+
+        # Trigram -> positions of the terms containing it, for typo and digit fragment matches
+        grams = [_trigrams(term) for term in index.terms]
+        index.trigram_counts = np.fromiter(map(len, grams), dtype=np.int64, count=len(grams))
+        positions = np.repeat(np.arange(len(grams), dtype=np.int64), index.trigram_counts)
+        gram_codes, unique_grams = pd.factorize(pd.Series([gram for term in grams for gram in term]))
+        order = np.argsort(gram_codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(gram_codes[order])) + 1
+        index.trigrams = dict(zip(unique_grams, np.split(positions[order], bounds)))
+        return index
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def apply(self, doc_id, terms):
+        # terms is the document's new {term: weight}, None when it was deleted
+        doc_id = int(doc_id)
+        for term in self.pending.pop(doc_id, {}):
+            postings = self.pending_postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.pending_postings[term]
+                del self.pending_terms[bisect_left(self.pending_terms, term)]
+        position = np.searchsorted(self.ids, doc_id)
+        if position < len(self.ids) and self.ids[position] == doc_id:
+            self.dead[position] = True
+        if terms is None:
+            return
+        self.pending[doc_id] = terms
+        for term, weight in terms.items():
+            if term not in self.pending_postings:
+                self.pending_postings[term] = {}
+                insort(self.pending_terms, term)
+            self.pending_postings[term][doc_id] = weight
+
+    def search(self, text):
+        # (ids, scores) of documents matching every word of text, best first
+        words = list(dict.fromkeys(TOKEN.findall(str(text).lower())))
+        if not words:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = scores = None
+        # Rarest words first so the intersection shrinks quickly
+        for word in sorted(words, key=len, reverse=True):
+            word_ids, word_scores = self._match(word)
+            if ids is None:
+                ids, scores = word_ids, word_scores
+            else:
+                ids, left, right = np.intersect1d(ids, word_ids, assume_unique=True, return_indices=True)
+                scores = scores[left] + word_scores[right]
+            if len(ids) == 0:
+                break
+        # ids are ascending, so a stable sort breaks ties by id
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order]
+
+    def _match(self, word):
+        # Best score per document for one query word
+        positions, qualities = self._base_terms(word)
+        pending = self._pending_terms(word)
+        if not len(positions) and not pending and len(word) >= 3:
+            positions, qualities = self._fuzzy_terms(word)
+            pending = self._pending_fuzzy(word)
+        # Gather the postings of all matched terms at once: prefix matches are a whole range of the vocabulary
+        counts = self.starts[positions + 1] - self.starts[positions]
+        postings = np.repeat(self.starts[positions] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        docs = self.docs[postings]
+        alive = ~self.dead[docs]
+        best = np.zeros(len(self.ids))
+        np.maximum.at(best, docs[alive], (self.weights[postings] * np.repeat(qualities, counts))[alive])
+        docs = np.flatnonzero(best)
+        ids, scores = self.ids[docs], best[docs]
+        if pending:
+            # Pending documents are dead in the base, so they are merged in rather than added up
+            pending_ids, pending_scores = _best(
+                np.concatenate([np.fromiter(self.pending_postings[term].keys(), dtype=np.int64) for term, _ in pending]),
+                np.concatenate([np.fromiter(self.pending_postings[term].values(), dtype=np.float64) * quality
+                                for term, quality in pending]))
+            at = np.searchsorted(ids, pending_ids)
+            ids, scores = np.insert(ids, at, pending_ids), np.insert(scores, at, pending_scores)
+        return ids, scores
+
+    def _base_terms(self, word):
+        # Positions of the matching terms and the quality of each match
+        start = bisect_left(self.terms, word)
+        end = start
+        if len(word) >= 2:
+            end = bisect_left(self.terms, word + "\uffff", start)
+        elif start < len(self.terms) and self.terms[start] == word:
+            end = start + 1
+        positions = np.arange(start, end, dtype=np.int64)
+        # An exact match has quality 1; a completion less the longer it is
+        qualities = np.where(self.lengths[positions] == len(word), EXACT, PREFIX * len(word) / self.lengths[positions])
+        if word.isdigit() and len(word) >= 3:
+            lists = [self.trigrams.get(word[i:i + 3]) for i in range(len(word) - 2)]
+            if all(found is not None for found in lists):
+                candidates = reduce(np.intersect1d, sorted(lists, key=len))
+                infix = [p for p in candidates.tolist() if word in self.terms[p] and not self.terms[p].startswith(word)]
+                positions = np.concatenate([positions, np.array(infix, dtype=np.int64)])
+                qualities = np.concatenate([qualities, np.full(len(infix), INFIX)])
+        return positions, qualities
+
+    def _fuzzy_terms(self, word):
+        grams = _trigrams(word)
+        lists = [self.trigrams[gram] for gram in grams if gram in self.trigrams]
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        candidates, shared = np.unique(np.concatenate(lists), return_counts=True)
+        similarity = shared / (len(grams) + self.trigram_counts[candidates] - shared)
+        keep = np.flatnonzero(similarity >= SIMILARITY)
+        keep = keep[np.argsort(-similarity[keep], kind="stable")[:MAX_EXPANSIONS]]
+        return candidates[keep], FUZZY * similarity[keep]
+
+    def _pending_terms(self, word):
+        matches = []
+        start = bisect_left(self.pending_terms, word)
+        for term in self.pending_terms[start:bisect_left(self.pending_terms, word + "\uffff", start)]:
+            matches.append((term, EXACT if term == word else PREFIX * len(word) / len(term)))
+        if word.isdigit() and len(word) >= 3:
+            matches.extend((term, INFIX) for term in self.pending_terms
+                           if word in term and not term.startswith(word))
+        return matches
+
+    def _pending_fuzzy(self, word):
+        grams = _trigrams(word)
+        matches = []
+        for term in self.pending_terms:
+            term_grams = _trigrams(term)
+            shared = len(grams & term_grams)
+            similarity = shared / (len(grams) + len(term_grams) - shared)
+            if similarity >= SIMILARITY:
+                matches.append((term, FUZZY * similarity))
+        return matches
+
+
+class PatientSearch:
+    def __init__(self, repository):
+        self.repository = repository
+        self.fields = dict(FIELDS)
+        self._index = None
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self._results = {}
+        if repository.backend == "data":
+            repository.data_manager.subscribe(repository.entity, self._on_commit)
+        else:
+            watch_sql_patients(repository, self._on_sql_commit)
+
+    def index(self):
+        # Rebuilt when another writer changed the table or the pending layer is full
+        index = self._index
+        now = time.monotonic()
+        stale = index is None or index.pending_count() > MAX_PENDING
+        if not stale and (self.repository.backend == "data" or now - self._checked >= REFRESH_SECONDS):
+            self._checked = now
+            stale = index.signature != self.repository.signature()
+        if stale:
+            # Read without holding our lock: writers call _on_commit under the table lock
+            signature = self.repository.signature()
+            built = SearchIndex.build(self.repository.find(columns=["id"] + list(self.fields)), self.fields, signature)
+            with self._lock:
+                self._index = built
+                self._results.clear()
+                self._checked = now
+        return self._index
+
+    def search(self, text):
+        # Ids of the matching patients, best match first
+        index = self.index()
+        with self._lock:
+            key = (id(index), text)
+            result = self._results.get(key)
+            if result is None:
+                result = index.search(text)[0].tolist()
+                # Paging asks for the same search a few times in a row
+                if len(self._results) > 100:
+                    self._results.clear()
+                self._results[key] = result
+            return result
+
+    def _apply(self, changes):
+        for doc_id, record in changes:
+            self._index.apply(doc_id, None if record is None else document_terms(record, self.fields))
+        self._results.clear()
+
+    def _on_commit(self, signature, changes, new_signature):
+        with self._lock:
+            if self._index is None or self._index.signature != signature:
+                return
+            self._apply([((after or before)["id"], after) for before, after in changes])
+            self._index.signature = new_signature
+
+    def _on_sql_commit(self, changes):
+        with self._lock:
+            if self._index is None:
+                return
+            self._apply(changes)
+            # A write another process made since our last check goes unnoticed until the table changes again
+            with self.repository.database.engine.connect() as connection:
+                self._index.signature = tuple(connection.execute(self.repository.signature_statement()).one())
+
+
+_searches = {}
+_searches_lock = threading.Lock()
+
+
+def get_patient_search(backend=None):
+    repository = get_repository("patients", backend)
+    with _searches_lock:
+        search = _searches.get(repository.backend)
+        if search is None:
+            search = PatientSearch(repository)
+            _searches[repository.backend] = search
+        return search
+
+
+def document_terms(record, fields):
+    # {term: weight} for one record, each term at the weight of its best field
+    terms = {}
+    for field, weight in fields.items():
+        value = record.get(field)
+        if value is None or (isinstance(value, float) and value != value):
+            continue
+        text = str(value).lower()
+        words = TOKEN.findall(text)
+        if field == "contact":
+            digits = re.sub(r"\D", "", text)
+            if len(digits) >= 3:
+                words.append(digits)
+        for word in words:
+            if terms.get(word, 0) < weight:
+                terms[word] = weight
+    return terms
+
+
+def _frame_terms(df, fields):
+    # The same as document_terms for a whole frame: (term, id, weight) rows sorted by term and id
+    parts = []
+    for field, weight in fields.items():
+        text = df[field].astype(object).where(df[field].notna(), "").astype(str).str.lower()
+        words = pd.DataFrame({"id": df["id"].to_numpy(), "term": text.str.findall(TOKEN.pattern).to_numpy()})
+        parts.append(words.explode("term").assign(weight=weight))
+        if field == "contact":
+            digits = text.str.replace(r"\D", "", regex=True)
+            keep = (digits.str.len() >= 3).to_numpy()
+            parts.append(pd.DataFrame({"id": df["id"].to_numpy()[keep], "term": digits.to_numpy()[keep], "weight": weight}))
+    if not parts:
+        return pd.DataFrame(columns=["term", "id", "weight"])
+    rows = pd.concat(parts, ignore_index=True).dropna(subset=["term"])
+    return rows.groupby(["term", "id"], sort=True)["weight"].max().reset_index()
+
+
+def _trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _best(ids, scores):
+    # The highest score per id, ids ascending
+    ids, positions = np.unique(ids, return_inverse=True)
+    best = np.zeros(len(ids))
+    np.maximum.at(best, positions, scores)
+    return ids, best
+
+
+# Patient writes through SQLAlchemy sessions, from the repository or the ORM pages.
+# Watchers get (id, record) pairs after each commit, record None for a delete.
+
+_sql_watchers = []
+_sql_patients = None
+_watchers_lock = threading.Lock()
+
+
+def watch_sql_patients(repository, watcher):
+    global _sql_patients
+    with _watchers_lock:
+        _sql_patients = repository
+        _sql_watchers.append(watcher)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_patients(session, flush_context):
+    repository = _sql_patients
+    if repository is None:
+        return
+    model, fields = repository.model, repository.fields
+    changes = session.info.setdefault("patient_changes", [])
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, model):
+            changes.append((obj.id, {column: getattr(obj, attribute) for column, attribute in fields.items()}))
+    changes.extend((obj.id, None) for obj in session.deleted if isinstance(obj, model))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_patients(session):
+    changes = session.info.pop("patient_changes", None)
+    if changes:
+        for watcher in list(_sql_watchers):
+            watcher(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_patients(session):
+    session.info.pop("patient_changes", None)
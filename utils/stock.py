@@ -0,0 +1,357 @@
+import argparse
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import pandas as pd
+from utils.data_manager import StaleRecordError, _version
+from utils.repository import get_repository
+
+# Stock levels kept as an append-only ledger. Every change to an item's
+# quantity is recorded as a movement: a receipt, a dispense, or an
+# adjustment to a counted level. The quantity on the inventory row is the
+# running total. Movements are only ever added, so the ledger is the item's
+# consumption history.
+#
+# Levels are snapshotted every so often, so rebuilding them replays only the
+# movements since the latest snapshot. A new snapshot is taken once the
+# movements since the last one outnumber the items it would hold, which keeps
+# the snapshots smaller than the ledger. The first snapshot records the
+# quantities items had before the ledger existed, and adopt() brings in
+# items bulk imported straight into the inventory table the same way.
+#
+# A movement is written before the quantity it changes, so a write cut
+# short leaves the ledger ahead of the inventory row and rebuild() brings
+# the row up to it. A movement whose quantity update loses to a concurrent
+# write is reversed by a movement of the opposite quantity.
+#
+# Items are also kept in a LowStockIndex, sorted by headroom
+# (quantity - reorder_level). The items that need reordering are a prefix of
+# that order. Like the schedule index, it is stamped with the inventory
+# signature: writes made here patch it, and any other write rebuilds it on
+# next use.
+
+KINDS = ["receipt", "dispense", "adjustment"]
+DEFAULT_REORDER_LEVEL = 10
+# Fewest movements between two snapshots
+SNAPSHOT_EVERY = int(os.getenv("HMS_STOCK_SNAPSHOT_EVERY", "500"))
+# Item id of the row that keeps a snapshot of no items on record
+NO_ITEM = 0
+
+
+class InsufficientStock(Exception):
+    def __init__(self, item, available, requested):
+        super().__init__(f"Only {available} units of {item} in stock, can't dispense {requested}")
+        self.item = item
+        self.available = available
+        self.requested = requested
+
+
+class LowStockIndex:
+    # Item ids as parallel arrays sorted by headroom, lowest first
+    def __init__(self, signature=None):
+        self.signature = signature
+        self.headrooms = []
+        self.ids = []
+        self.headrooms_by_id = {}
+
+    @classmethod
+    def build(cls, df, signature):
+        index = cls(signature)
+        if df.empty:
+            return index
+        headroom = _headroom(df["quantity"], df["reorder_level"])
+        order = headroom.sort_values(kind="stable").index
+        index.headrooms = headroom[order].tolist()
+        index.ids = df["id"][order].tolist()
+        index.headrooms_by_id = dict(zip(index.ids, index.headrooms))
+        return index
+
+    def set(self, item_id, headroom):
+        self.remove(item_id)
+        position = bisect_right(self.headrooms, headroom)
+        self.headrooms.insert(position, headroom)
+        self.ids.insert(position, item_id)
+        self.headrooms_by_id[item_id] = headroom
+
+    def remove(self, item_id):
+        headroom = self.headrooms_by_id.pop(item_id, None)
+        if headroom is None:
+            return
+        position = bisect_left(self.headrooms, headroom)
+        while self.ids[position] != item_id:
+            position += 1
+        del self.headrooms[position], self.ids[position]
+
+    def count(self, headroom=0):
+        return bisect_right(self.headrooms, headroom)
+
+    def below(self, headroom=0, limit=None):
+        # Ids of items with at most this much headroom, lowest first
+        end = self.count(headroom)
+        return self.ids[:end if limit is None else min(end, limit)]
+
+
+class Stock:
+    def __init__(self, inventory, movements, snapshots):
+        self.inventory = inventory
+        self.movements = movements
+        self.snapshots = snapshots
+        self._index = LowStockIndex()
+        self._lock = threading.RLock()
+
+    def index(self):
+        with self._lock:
+            signature = self.inventory.signature()
+            if self._index.signature != signature:
+                df = self.inventory.find(columns=["id", "quantity", "reorder_level"])
+                self._index = LowStockIndex.build(df, signature)
+            return self._index
+
+    def low_stock_count(self):
+        return self.index().count()
+
+    def needs_reorder(self, limit=None):
+        # Items at or below their reorder level, the furthest below first
+        ids = self.index().below(limit=limit)
+        if not ids:
+            return self.inventory.find(limit=0)
+        items = self.inventory.find([("id", "in", ids)]).set_index("id", drop=False)
+        return items.reindex([item_id for item_id in ids if item_id in items.index]).reset_index(drop=True)
+
+    def history(self, item_id, limit=None):
+        return self.movements.find([("item_id", "==", item_id)], sort=[("id", False)], limit=limit)
+
+    def add_item(self, record, user=None):
+        # A new item's starting quantity goes through the ledger as its first receipt
+        quantity = int(record.get("quantity") or 0)
+        reorder_level = record.get("reorder_level")
+        record = dict(record, quantity=quantity,
+                      reorder_level=DEFAULT_REORDER_LEVEL if reorder_level is None else int(reorder_level))
+        with self._lock:
+            self._ensure_snapshot()
+            index = self.index()
+            # Should the receipt below never be written, adopt() takes the item in at this quantity
+            item_id = self.inventory.add(record)
+            signature = self.inventory.signature()
+            if quantity:
+                self._snapshot_if_due(self._append(item_id, "receipt", quantity, "Opening stock", user))
+            index.set(item_id, quantity - record["reorder_level"])
+            index.signature = signature
+            return item_id
+
+    def record(self, item_id, kind, quantity, reason=None, user=None, expected_version=None):
+        # Receipts add quantity, dispenses take it away and adjustments set the
+        # counted level. Returns the new level, or None if the item is gone.
+        if kind not in KINDS:
+            raise ValueError(f"Unknown stock movement: {kind}")
+        with self._lock:
+            self._ensure_snapshot()
+            index = self.index()
+            item = self.inventory.get(item_id)
+            if item is None:
+                return None
+            current = _int(item["quantity"])
+            change = {"receipt": quantity, "dispense": -quantity, "adjustment": quantity - current}[kind]
+            if current + change < 0:
+                raise InsufficientStock(item["item"], current, quantity)
+            # Rejects the movement if the item changed since the caller read it
+            if expected_version is not None and _version(expected_version) != _version(item["version"]):
+                raise StaleRecordError(self.inventory.entity, item_id, expected_version, item["version"])
+            movement_id = self._append(item_id, kind, change, reason, user)
+            try:
+                self.inventory.update(item_id, {
+                    "quantity": current + change,
+                    "last_updated": _now()
+                }, expected_version=item["version"])
+            except StaleRecordError:
+                # Another process changed the item after it was read here, so the
+                # movement never happened; the ledger is append-only, so it is reversed
+                self._append(item_id, kind, -change, f"Reverted movement {movement_id}: item changed concurrently", user)
+                raise
+            signature = self.inventory.signature()
+            self._snapshot_if_due(movement_id)
+            index.set(item_id, current + change - _reorder_level(item["reorder_level"]))
+            index.signature = signature
+            return current + change
+
+    def set_reorder_level(self, item_id, reorder_level, expected_version=None):
+        with self._lock:
+            index = self.index()
+            item = self.inventory.get(item_id)
+            if item is None:
+                return False
+            self.inventory.update(item_id, {"reorder_level": int(reorder_level)},
+                                  expected_version=item["version"] if expected_version is None else expected_version)
+            signature = self.inventory.signature()
+            index.set(item_id, _int(item["quantity"]) - int(reorder_level))
+            index.signature = signature
+            return True
+
+    def delete_item(self, item_id, expected_version=None):
+        # The item's movements stay in the ledger
+        with self._lock:
+            index = self.index()
+            if not self.inventory.delete(item_id, expected_version=expected_version):
+                return False
+            signature = self.inventory.signature()
+            index.remove(item_id)
+            index.signature = signature
+            return True
+
+    def _append(self, item_id, kind, change, reason, user):
+        movement_id = self.movements.add({
+            "item_id": item_id,
+            "kind": kind,
+            "quantity": change,
+            "reason": reason,
+            "user": user,
+            "timestamp": _now()
+        })
+        return movement_id
+
+    def _snapshot_if_due(self, movement_id):
+        through = self._latest_snapshot()
+        if movement_id - through >= max(SNAPSHOT_EVERY, self.snapshots.count([("through_movement", "==", through)])):
+            self.take_snapshot()
+
+    def _latest_snapshot(self):
+        # Last movement covered by the latest snapshot, None if there is no snapshot yet
+        latest = self.snapshots.find(columns=["through_movement"], sort=[("through_movement", False)], limit=1)
+        return None if latest.empty else _int(latest["through_movement"].iloc[0])
+
+    def _ensure_snapshot(self):
+        # Opening levels: everything on hand before the first movement was recorded
+        if self._latest_snapshot() is not None:
+            return
+        last = self.movements.find(columns=["id"], sort=[("id", False)], limit=1)
+        through = 0 if last.empty else _int(last["id"].iloc[0])
+        levels = self.inventory.find(columns=["id", "quantity"]).set_index("id")["quantity"]
+        self._write_snapshot(through, pd.to_numeric(levels, errors="coerce").fillna(0).astype("int64"))
+
+    def levels(self):
+        # Item id -> quantity from the latest snapshot plus the movements after it,
+        # together with the last movement they include
+        through = self._latest_snapshot()
+        if through is None:
+            return 0, pd.Series(dtype="int64")
+        base = self.snapshots.find([("through_movement", "==", through)], columns=["item_id", "quantity"],
+                                   sort=[("id", True)])
+        # A later snapshot through the same movement, like one adopting imported items, replaces the earlier one
+        base = base.drop_duplicates("item_id", keep="last")
+        tail = self.movements.find([("id", ">", through)], columns=["id", "item_id", "quantity"])
+        levels = pd.to_numeric(base.set_index("item_id")["quantity"], errors="coerce").drop(NO_ITEM, errors="ignore")
+        changes = pd.to_numeric(tail["quantity"], errors="coerce").groupby(tail["item_id"]).sum()
+        levels = levels.add(changes, fill_value=0).fillna(0).astype("int64")
+        return (through if tail.empty else _int(tail["id"].max())), levels
+
+    def take_snapshot(self):
+        with self._lock:
+            through, levels = self.levels()
+            if through == self._latest_snapshot():
+                return through
+            self._write_snapshot(through, levels)
+            return through
+
+    def adopt(self):
+        # Items the ledger has never seen, such as rows bulk imported into the
+        # inventory table, join it at their recorded quantity in a new snapshot.
+        # Returns the number of items adopted.
+        with self._lock:
+            self._ensure_snapshot()
+            through, levels = self.levels()
+            items = self.inventory.find(columns=["id", "quantity"]).set_index("id")["quantity"]
+            untracked = items[~items.index.isin(levels.index)]
+            if untracked.empty:
+                return 0
+            untracked = pd.to_numeric(untracked, errors="coerce").fillna(0).astype("int64")
+            self._write_snapshot(through, pd.concat([levels, untracked]))
+            return len(untracked)
+
+    def _write_snapshot(self, through, levels):
+        if levels.empty:
+            # Still leaves a snapshot to replay from when there are no items yet
+            levels = pd.Series([0], index=[NO_ITEM], dtype="int64")
+        self.snapshots.add_many(pd.DataFrame({
+            "through_movement": through,
+            "item_id": levels.index,
+            "quantity": levels.to_numpy(),
+            "taken_at": _now()
+        }))
+
+    def check(self):
+        # Items whose recorded quantity differs from the level the ledger adds up to.
+        # Items the ledger has never seen are left out until adopt() takes them in.
+        _, levels = self.levels()
+        items = self.inventory.find(columns=["id", "item", "quantity"]).set_index("id")
+        items["ledger"] = levels.reindex(items.index)
+        items = items[items["ledger"].notna()].astype({"ledger": "int64"})
+        items["quantity"] = pd.to_numeric(items["quantity"], errors="coerce").fillna(0).astype("int64")
+        return items[items["quantity"] != items["ledger"]].reset_index()
+
+    def rebuild(self):
+        # Resets recorded quantities to the ledger levels; returns the number of items changed
+        with self._lock:
+            self.adopt()
+            differences = self.check()
+            for row in differences.itertuples():
+                self.inventory.update(row.id, {"quantity": int(row.ledger), "last_updated": _now()})
+            return len(differences)
+
+
+_stocks = {}
+_stocks_lock = threading.Lock()
+
+
+def get_stock(backend=None):
+    inventory = get_repository("inventory", backend)
+    with _stocks_lock:
+        stock = _stocks.get(inventory.backend)
+        if stock is None:
+            stock = Stock(inventory, get_repository("stock_movements", backend),
+                          get_repository("stock_snapshots", backend))
+            _stocks[inventory.backend] = stock
+        return stock
+
+
+def _headroom(quantity, reorder_level):
+    quantity = pd.to_numeric(quantity, errors="coerce").fillna(0)
+    reorder_level = pd.to_numeric(reorder_level, errors="coerce").fillna(DEFAULT_REORDER_LEVEL)
+    return (quantity - reorder_level).astype("int64")
+
+
+def _reorder_level(value):
+    return DEFAULT_REORDER_LEVEL if pd.isna(value) else int(value)
+
+
+def _int(value):
+    return 0 if pd.isna(value) else int(value)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot the stock ledger or check levels against it")
+    parser.add_argument("command", choices=["snapshot", "check", "rebuild"])
+    parser.add_argument("--backend", choices=["data", "sql"], default=None)
+    args = parser.parse_args()
+
+    stock = get_stock(args.backend)
+    stock._ensure_snapshot()
+    if args.command == "snapshot":
+        print(f"Snapshot covers movements up to {stock.take_snapshot()}")
+    elif args.command == "check":
+        differences = stock.check()
+        for row in differences.itertuples():
+            print(f"{row.item} (id {row.id}): recorded {row.quantity}, ledger {row.ledger}")
+        if not differences.empty:
+            parser.exit(1, f"{len(differences)} items differ from the ledger\n")
+        print("All recorded quantities match the ledger")
+    else:
+        print(f"Reset {stock.rebuild()} items to their ledger levels")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import csv
+import json
+import os
+import pandas as pd
+from utils.locking import atomic_write
+
+# Storage backends decide how a table's base file is laid out on disk.
+# DataManager only talks to this interface, so the journal, cache and
+# indexes on top of it work the same whichever format is configured.
+class StorageBackend:
+    name = None
+    extension = None
+
+    def path(self, data_dir, table):
+        return f"{data_dir}/{table}.{self.extension}"
+
+    def read(self, path, columns=None):
+        raise NotImplementedError
+
+    def read_chunks(self, path, columns=None, chunksize=50000):
+        # Opens the file before returning so a later rewrite of path can't
+        # change what the returned iterator reads
+        raise NotImplementedError
+
+    def write(self, path, df):
+        raise NotImplementedError
+
+    def columns(self, path):
+        raise NotImplementedError
+
+
+class CSVBackend(StorageBackend):
+    name = "csv"
+    extension = "csv"
+
+    def read(self, path, columns=None):
+        return pd.read_csv(path, usecols=columns)
+
+    def read_chunks(self, path, columns=None, chunksize=50000):
+        return pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+    def write(self, path, df):
+        atomic_write(path, lambda tmp_path: df.to_csv(tmp_path, index=False))
+
+    def columns(self, path):
+        with open(path, "r", newline="") as f:
+            return next(csv.reader(f))
+
+
+class FeatherBackend(StorageBackend):
+    # Arrow IPC files are written uncompressed so reads can be memory-mapped
+    name = "feather"
+    extension = "feather"
+
+    def __init__(self):
+        try:
+            import pyarrow
+            import pyarrow.feather
+        except ImportError as e:
+            raise ImportError("The feather storage backend needs the pyarrow package") from e
+        self.pa = pyarrow
+        self.feather = pyarrow.feather
+
+    def read(self, path, columns=None):
+        table = self.feather.read_table(path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    def read_chunks(self, path, columns=None, chunksize=50000):
+        reader = self.pa.ipc.open_file(self.pa.memory_map(path, "r"))
+        return self._batches(reader, columns, chunksize)
+
+    def _batches(self, reader, columns, chunksize):
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for offset in range(0, batch.num_rows, chunksize):
+                yield batch.slice(offset, chunksize).to_pandas()
+
+    def write(self, path, df):
+        df = df.reset_index(drop=True)
+        atomic_write(path, lambda tmp_path: self.feather.write_feather(df, tmp_path, compression="uncompressed"))
+
+    def columns(self, path):
+        with self.pa.memory_map(path, "r") as source:
+            return self.pa.ipc.open_file(source).schema.names
+
+
+class PartitionedBackend(StorageBackend):
+    # Lays a table out as one file per month of a date column, in the format
+    # of the wrapped backend. A manifest lists the current partition files
+    # and is swapped in last, so a rewrite is atomic; path() points at it and
+    # DataManager's signatures, caches and locks key on it like a plain file.
+    # Range reads only open the partitions whose month can hold a match.
+    UNDATED = "undated"
+
+    def __init__(self, backend, column):
+        self.backend = backend
+        self.column = column
+        self.name = backend.name
+        self.extension = backend.extension
+
+    def path(self, data_dir, table):
+        # One directory per table; each format keeps its own manifest and files in it
+        return f"{data_dir}/{table}/manifest.{self.extension}.json"
+
+    def _manifest(self, path):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def partitions(self, path, start=None, end=None):
+        # Partition file paths, oldest month first; start/end are "YYYY-MM-DD" bounds
+        files = self._manifest(path)["partitions"]
+        directory = os.path.dirname(path)
+        keys = sorted(key for key in files if key != self.UNDATED)
+        if start is not None:
+            keys = [key for key in keys if key >= start[:7]]
+        if end is not None:
+            keys = [key for key in keys if key <= end[:7]]
+        if start is None and end is None and self.UNDATED in files:
+            keys.append(self.UNDATED)
+        return [os.path.join(directory, files[key]) for key in keys]
+
+    def read(self, path, columns=None, start=None, end=None):
+        frames = [self.backend.read(partition, columns) for partition in self.partitions(path, start, end)]
+        if not frames:
+            return pd.DataFrame(columns=columns or self.columns(path))
+        return pd.concat(frames, ignore_index=True)
+
+    def read_chunks(self, path, columns=None, chunksize=50000, start=None, end=None):
+        readers = [self.backend.read_chunks(partition, columns, chunksize)
+                   for partition in self.partitions(path, start, end)]
+        return (chunk for reader in readers for chunk in reader)
+
+    def write(self, path, df):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        generation = self._manifest(path)["generation"] + 1 if os.path.exists(path) else 1
+        # Month of each row in one vectorized pass; rows without a usable date share a partition
+        months = df[self.column].astype(str).str[:7]
+        months = months.where(months.str.match(r"^\d{4}-\d{2}$"), self.UNDATED)
+        files = {}
+        for month, rows in df.groupby(months, sort=False):
+            files[month] = f"{month}.{generation}.{self.extension}"
+            self.backend.write(os.path.join(directory, files[month]), rows)
+        manifest = {"columns": list(df.columns), "generation": generation, "partitions": files}
+        atomic_write(path, lambda tmp_path: _write_json(tmp_path, manifest))
+        # Files of earlier generations are unreachable once the manifest is swapped
+        current = set(files.values())
+        for name in os.listdir(directory):
+            if name.endswith(f".{self.extension}") and name not in current:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    # Still open by an export on Windows; the next rewrite removes it
+                    pass
+
+    def columns(self, path):
+        return self._manifest(path)["columns"]
+
+
+def _write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+BACKENDS = {
+    "csv": CSVBackend,
+    "feather": FeatherBackend
+}
+
+
+def get_backend(name=None):
+    name = name or os.getenv("HMS_STORAGE_BACKEND", "csv")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {name}")
+    return BACKENDS[name]()
+
+
+def convert(source, target, data_dir="data", tables=None):
+    # Compact first so pending journal rows are carried over and not replayed twice
+    from utils.data_manager import DataManager
+
+    source_manager = DataManager(backend=source, data_dir=data_dir)
+    target_backend = get_backend(target)
+    converted = {}
+    for table in tables or DataManager.SCHEMAS:
+        source_manager.compact(table)
+        df = source_manager.load_data(table)
+        storage = target_backend
+        if table in DataManager.PARTITIONS:
+            storage = PartitionedBackend(target_backend, DataManager.PARTITIONS[table])
+        storage.write(storage.path(data_dir, table), df)
+        converted[table] = len(df)
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert hospital data between storage formats")
+    parser.add_argument("source", choices=sorted(BACKENDS))
+    parser.add_argument("target", choices=sorted(BACKENDS))
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--tables", nargs="*")
+    args = parser.parse_args()
+
+    for table, rows in convert(args.source, args.target, args.data_dir, args.tables).items():
+        print(f"{table}: {rows} rows converted from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Process-wide cache of parsed tables shared by every DataManager instance.
+# Entries are keyed on the file path and stamped with a signature (mtime,
+# size and a local version counter), so a write from any process or any
+# session invalidates the cached frame on the next read.
+class TableCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def signature(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, self._versions.get(path, 0))
+
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, value, nbytes=None):
+        if nbytes is None:
+            nbytes = int(value.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (signature, value, nbytes)
+            self.current_bytes += nbytes
+            # Evict least recently used tables until we are back under budget
+            while self.current_bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._discard(old_key)
+                self.evictions += 1
+
+    def bump(self, path):
+        with self._lock:
+            self._versions[path] = self._versions.get(path, 0) + 1
+            self._discard(path)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            else:
+                self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+
+table_cache = TableCache(int(os.getenv("HMS_TABLE_CACHE_MB", "256")) * 1024 * 1024)
@@ -0,0 +1,208 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+import pandas as pd
+import streamlit as st
+from utils.repository import get_repository
+from utils.search import REFRESH_SECONDS, TOKEN, watch_sql_patients
+
+# Typeahead pickers for forms that pick a patient or a doctor. Rather than
+# sending every name to the browser, a picker is a search box plus a
+# selectbox holding only the first MAX_RESULTS matches, and it returns the
+# chosen record's id so duplicate names stay apart.
+#
+# Matches come from a PrefixIndex: sorted lowercase keys with the id of the
+# record each came from alongside, so the records starting with what was
+# typed are a bisect away. A record is keyed by its name from each word on
+# ("alice mary jones", "mary jones", "jones") and by the digits of its
+# contact number. Like the low-stock index it is stamped with the table
+# signature: writes seen through DataManager or the SQL session patch it,
+# any other write rebuilds it on next use.
+
+MAX_RESULTS = int(os.getenv("HMS_TYPEAHEAD_RESULTS", "20"))
+
+# Picker -> (entity, columns shown, filters); the first column is the name
+PICKERS = {
+    "patients": ("patients", ["name", "contact"], []),
+    "doctors": ("staff", ["name", "contact"], [("role", "==", "Doctor")])
+}
+
+
+class PrefixIndex:
+    def __init__(self, columns, signature=None):
+        self.columns = columns
+        self.signature = signature
+        self.keys = []
+        self.ids = []
+        # id -> the shown column values
+        self.records = {}
+
+    @classmethod
+    def build(cls, df, columns, signature):
+        index = cls(columns, signature)
+        if df.empty:
+            return index
+        values = df[columns].astype(object).where(df[columns].notna(), None)
+        index.records = dict(zip(df["id"].tolist(), values.itertuples(index=False, name=None)))
+
+        # The same keys record_keys gives, for the whole frame at once
+        text = values.where(values.notna(), "").astype(str)
+        words = text[columns[0]].str.lower().str.findall(TOKEN.pattern)
+        parts = []
+        for start in range(int(words.str.len().max() or 0)):
+            suffix = words[words.str.len() > start].str[start:].str.join(" ")
+            parts.append(pd.DataFrame({"key": suffix, "id": df["id"][suffix.index]}))
+        if "contact" in columns:
+            digits = text["contact"].str.replace(r"\D", "", regex=True)
+            digits = digits[digits != ""]
+            parts.append(pd.DataFrame({"key": digits, "id": df["id"][digits.index]}))
+        keys = pd.concat(parts, ignore_index=True).sort_values(["key", "id"], kind="stable")
+        index.keys = keys["key"].tolist()
+        index.ids = keys["id"].tolist()
+        return index
+
+    def set(self, record_id, values):
+        self.remove(record_id)
+        self.records[record_id] = values
+        for key in self._keys(values):
+            position = bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.ids.insert(position, record_id)
+
+    def remove(self, record_id):
+        values = self.records.pop(record_id, None)
+        if values is None:
+            return
+        for key in self._keys(values):
+            position = bisect_left(self.keys, key)
+            while self.ids[position] != record_id:
+                position += 1
+            del self.keys[position], self.ids[position]
+
+    def _keys(self, values):
+        contact = values[self.columns.index("contact")] if "contact" in self.columns else None
+        return record_keys(values[0], contact)
+
+    def search(self, text, limit=MAX_RESULTS):
+        # Ids of up to limit records with a key starting with text, in key order
+        query = " ".join(TOKEN.findall(str(text).lower()))
+        digits = re.sub(r"\D", "", str(text))
+        if digits and not re.sub(r"[\d\s()+-]", "", str(text)):
+            # A phone number however it is punctuated
+            query = digits
+        found = {}
+        # With nothing typed yet, list by name rather than from the phone numbers, which sort first
+        position = bisect_left(self.keys, query or "a")
+        while position < len(self.keys) and len(found) < limit and self.keys[position].startswith(query):
+            found.setdefault(self.ids[position], None)
+            position += 1
+        return list(found)
+
+
+class Typeahead:
+    def __init__(self, repository, columns, filters=None):
+        self.repository = repository
+        self.columns = columns
+        self.filters = list(filters or [])
+        self._index = PrefixIndex(columns)
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        # Filtered pickers are small and just rebuild after a write
+        self._patched = not self.filters and (repository.backend == "data" or repository.entity == "patients")
+        if self._patched and repository.backend == "data":
+            repository.data_manager.subscribe(repository.entity, self._on_commit)
+        elif self._patched:
+            watch_sql_patients(repository, self._on_sql_commit)
+
+    def index(self):
+        # SQL writes from other processes are checked for every REFRESH_SECONDS
+        index = self._index
+        now = time.monotonic()
+        if self._patched and self.repository.backend == "sql" and now - self._checked < REFRESH_SECONDS:
+            return index
+        self._checked = now
+        signature = self.repository.signature()
+        if index.signature != signature:
+            # Read without holding our lock: writers call _on_commit under the table lock
+            df = self.repository.find(self.filters, columns=["id"] + self.columns)
+            index = PrefixIndex.build(df, self.columns, signature)
+            with self._lock:
+                self._index = index
+        return index
+
+    def search(self, text, limit=MAX_RESULTS):
+        index = self.index()
+        with self._lock:
+            return index.search(text, limit)
+
+    def name(self, record_id):
+        values = self._index.records.get(record_id)
+        return None if values is None else values[0]
+
+    def label(self, record_id):
+        values = self._index.records.get(record_id)
+        if values is None:
+            return f"#{record_id}"
+        details = ", ".join(str(value) for value in (f"#{record_id}", *values[1:]) if value not in (None, ""))
+        return f"{values[0]} ({details})"
+
+    def _apply(self, record_id, record):
+        if record is None:
+            self._index.remove(record_id)
+        else:
+            self._index.set(record_id, tuple(None if pd.isna(record.get(column)) else record.get(column)
+                                             for column in self.columns))
+
+    def _on_commit(self, signature, changes, new_signature):
+        with self._lock:
+            if self._index.signature != signature:
+                return
+            for before, after in changes:
+                self._apply(int((after or before)["id"]), after)
+            self._index.signature = new_signature
+
+    def _on_sql_commit(self, changes):
+        with self._lock:
+            if self._index.signature is None:
+                return
+            for record_id, record in changes:
+                self._apply(record_id, record)
+            # As for patient search, a write another process made since the last check waits for the next one
+            with self.repository.database.engine.connect() as connection:
+                self._index.signature = tuple(connection.execute(self.repository.signature_statement()).one())
+
+
+_typeaheads = {}
+_typeaheads_lock = threading.Lock()
+
+
+def get_typeahead(picker, backend=None):
+    entity, columns, filters = PICKERS[picker]
+    repository = get_repository(entity, backend)
+    with _typeaheads_lock:
+        typeahead = _typeaheads.get((picker, repository.backend))
+        if typeahead is None:
+            typeahead = Typeahead(repository, columns, filters)
+            _typeaheads[(picker, repository.backend)] = typeahead
+        return typeahead
+
+
+def record_keys(name, contact=None):
+    words = TOKEN.findall(str(name or "").lower())
+    keys = [" ".join(words[start:]) for start in range(len(words))]
+    digits = re.sub(r"\D", "", "" if contact is None else str(contact))
+    return keys + [digits] if digits else keys
+
+
+def typeahead_select(label, typeahead, key, placeholder="Type a name or phone number"):
+    # Search box and a selectbox of its matches; returns the chosen id, None if nothing matches.
+    # Goes outside st.form, which would hold back the search until the form is submitted.
+    text = st.text_input(label, key=f"{key}_search", placeholder=placeholder)
+    ids = typeahead.search(text)
+    if not ids:
+        st.caption("No matches")
+        return None
+    return st.selectbox(f"Matching {label.lower()}s", ids, format_func=typeahead.label, key=f"{key}_choice",
+                        label_visibility="collapsed")